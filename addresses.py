@@ -0,0 +1,108 @@
+"""
+Cache of address lookups, mapping addresses to the grid company information of the supplier
+lookup API.
+
+Addresses are keyed by a normalized form, so the same address written differently (case,
+whitespace, "DK-" prefixed postal codes, the spelling of the city) is looked up upstream only
+once. Grid company areas rarely change, so lookups are kept for a long time, in an SQLite
+database that survives restarts and is shared by the worker processes, or else in a bounded
+in-process cache of their own, apart from the cached price data. Expired lookups are kept, to
+answer with when the lookup API fails.
+"""
+import json
+import re
+import time
+import unicodedata
+from typing import Optional
+
+from sqlitestore import SQLiteStore
+
+# A Danish postal code, optionally prefixed with the country code, and the city name after it
+_POSTAL_CODE = re.compile(r'\b(?:dk\s*-?\s*)?(\d{4})\b(?:\s+[^,\d]*)?(?=,|$)')
+
+
+def clean_address(address: str) -> str:
+    """Returns the address with whitespace collapsed, as sent upstream."""
+    return ' '.join(unicodedata.normalize('NFC', address).split())
+
+
+def normalize_address(address: str) -> str:
+    """
+    Returns the cache key of an address: casefolded, with collapsed whitespace and commas, and
+    the postal code without country prefix and city name, which the postal code determines.
+    """
+    key = clean_address(address).casefold()
+    key = re.sub(r'\s*,\s*', ', ', key).strip(' ,')
+    key = re.sub(r',\s*(danmark|denmark)$', '', key)
+    # Only the last postal code, in case the street or house number looks like one
+    matches = list(_POSTAL_CODE.finditer(key))
+    if matches:
+        m = matches[-1]
+        key = key[:m.start()] + m.group(1) + key[m.end():]
+    return key
+
+
+class AddressStore(SQLiteStore):
+    """
+    SQLite-backed store of address lookups by normalized address, safe to use from several
+    threads and worker processes, see SQLiteStore.
+    """
+
+    def __init__(self, path: str, timeout: int):
+        self.timeout = timeout
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS addresses (
+                key TEXT PRIMARY KEY,
+                info TEXT NOT NULL,
+                stored REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def get(self, key: str, stale: bool = False) -> Optional[dict]:
+        """
+        Returns the stored lookup for key, or None if there is none or it has expired, unless
+        stale is set.
+        """
+        row = self._connection().execute(
+            'SELECT info FROM addresses WHERE key = ? AND stored > ?',
+            (key, -1 if stale else time.time() - self.timeout),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, info: dict):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO addresses (key, info, stored) VALUES (?, ?, ?)',
+                (key, json.dumps(info, separators=(',', ':')), time.time()),
+            )
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM addresses')
+
+
+class CacheAddressStore:
+    """
+    Store of address lookups in a cachelib backend. Give it a backend of its own, so large
+    address batches do not evict the cached upstream data.
+    """
+
+    def __init__(self, backend, timeout: int, prefix='address:'):
+        self.backend = backend
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def get(self, key: str, stale: bool = False) -> Optional[dict]:
+        """See AddressStore.get."""
+        entry = self.backend.get(self.prefix + key)
+        if entry is None or not stale and entry[1] <= time.time() - self.timeout:
+            return None
+        return entry[0]
+
+    def set(self, key: str, info: dict):
+        # Stored as (lookup, time stored) without a backend timeout, so expired lookups are kept
+        # until the backend evicts them
+        self.backend.set(self.prefix + key, (info, time.time()), timeout=0)
+
+    def clear(self):
+        self.backend.clear()
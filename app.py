@@ -1,75 +1,295 @@
-from flask import Flask, request, jsonify, abort, redirect, url_for, render_template, send_from_directory
+from flask import Flask, Response, g, request, stream_with_context, jsonify, abort, redirect, url_for, render_template, send_from_directory
+from werkzeug.exceptions import HTTPException
 #from flask_limiter import Limiter
 #from flask_limiter.util import get_remote_address
 from flask_caching import Cache
-import requests
+from cachelib import SimpleCache
+import upstream
+import formats
+import coalesce
+import timeaxis
+import resample
+import loadshift
+import billing
+from tariffs import TariffIndex
+from pricing import compute_price_columns
+from fees import FeeSchedule, MissingRateError
+from timeseries import TimeSeriesStore, start_sync_thread, today_copenhagen
+from prefetch import Job, Prefetcher, start_prefetch_thread
+from snapshots import SnapshotStore, content_etag
+from gridcompanies import GridCompanyRegistry, current_tariff_codes, start_refresh_thread
+from addresses import AddressStore, CacheAddressStore, clean_address, normalize_address
+from dataclasses import replace
 from datetime import datetime, timedelta, date
-import pytz
-from dataclasses import dataclass
-from itertools import zip_longest
-from pprint import pprint
-from typing import Optional, TypedDict, List
+from typing import Optional, TypedDict, List, Union
 from functools import wraps
-from collections import OrderedDict
-import hashlib
-import pickle
-
-# Fallback cache storage for resilient API calls (LRU with max 100 items)
-_fallback_cache = OrderedDict()
-_FALLBACK_CACHE_MAX_SIZE = 100
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import time
+import metrics
+from fallbackstore import LocalFallbackStore, SharedFallbackStore, MISSING
+
+# Fallback cache storage for resilient API calls, in-process LRU bounded by the size of the
+# results. Replaced by a store shared between workers if FALLBACK_CACHE_SHARED is set.
+_fallback_store = LocalFallbackStore()
+
+def set_fallback_store(store):
+    """Replaces the store used by fallback_to_cache, e.g. with a SharedFallbackStore."""
+    global _fallback_store
+    _fallback_store = store
+
+# Timeout in seconds for each upstream source, the only upstream timeout setting. Entries can be
+# overridden with the UPSTREAM_TIMEOUTS configuration.
+UPSTREAM_TIMEOUTS = {
+    'elspotprices': 10,
+    'DayAheadPrices': 10,
+    'CO2EmisProg': 10,
+    'DatahubPriceList': 20,
+    'supplierlookup': 10,
+}
+
+# Thread pool used to issue independent upstream fetches concurrently
+_upstream_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='upstream')
+# Separate pool for the chunks of long ranges, which are submitted from the pool above
+_chunk_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='upstream-chunk')
 
 def fallback_to_cache(func):
     """
     Decorator that provides fallback to cached results when a function raises an exception.
 
-    When the decorated function succeeds, the result is stored in a fallback cache (LRU, max 100 items).
+    When the decorated function succeeds, the result is stored in the fallback store (by default
+    an in-process LRU bounded by FALLBACK_CACHE_MAX_BYTES). Results served from the cache are
+    normally stored already, and only marked as recently used.
     When it fails with any exception, the last successful result (if any) is returned instead.
     If no cached result exists, the exception is re-raised.
+
+    Every call is counted in the cache_calls_total metric, by outcome: hit when it was served
+    from the cache without upstream requests, miss when upstream was called, fallback when the
+    last successful result was returned instead and error when nothing was cached. Calls that
+    waited for another caller's fetch of the entry are not hits, and are only counted as waiters
+    in cache_coalesced_calls_total.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        # Create a cache key from function name and arguments
-        cache_key = (func.__name__, args, tuple(sorted(kwargs.items())))
-        # Use hash for large keys to avoid memory issues
-        try:
-            cache_key_hash = hashlib.md5(pickle.dumps(cache_key)).hexdigest()
-        except:
-            # Fallback to string representation if pickle fails
-            cache_key_hash = str(cache_key)
+        key = _fallback_cache_key(func, args, kwargs)
 
+        t0 = time.perf_counter()
+        upstream_requests = metrics.upstream_requests_in_thread()
+        coalesced_waits = metrics.coalesced_waits_in_thread()
+        outcome = 'error'
         try:
             # Try to execute the function
             result = func(*args, **kwargs)
+            if metrics.upstream_requests_in_thread() > upstream_requests:
+                outcome = 'miss'
+            elif metrics.coalesced_waits_in_thread() > coalesced_waits:
+                outcome = 'waiter'
+            else:
+                outcome = 'hit'
 
-            # On success, store in fallback cache with LRU eviction
-            if cache_key_hash in _fallback_cache:
-                # Move existing item to end (mark as recently used)
-                _fallback_cache.move_to_end(cache_key_hash)
-            _fallback_cache[cache_key_hash] = result
-
-            # Evict oldest item if cache exceeds max size
-            if len(_fallback_cache) > _FALLBACK_CACHE_MAX_SIZE:
-                _fallback_cache.popitem(last=False)  # Remove oldest (first) item
+            # On success, store in fallback cache
+            if outcome == 'miss' or not _fallback_store.touch(key):
+                _fallback_store.set(key, result)
 
             return result
         except Exception as e:
             # On failure, check if we have a cached result
-            if cache_key_hash in _fallback_cache:
-                print(f"Warning: {func.__name__} failed, returning cached result. Error: {e}")
-                # Move to end (mark as recently used)
-                _fallback_cache.move_to_end(cache_key_hash)
-                return _fallback_cache[cache_key_hash]
-            else:
+            cached = _fallback_store.get(key)
+            if cached is MISSING:
                 # No cached result available, re-raise the exception
                 raise
-
+            outcome = 'fallback'
+            age = _fallback_store.age(key)
+            stored = f" stored {age:.0f} seconds ago" if age is not None else ""
+            print(f"Warning: {func.__name__} failed, returning cached result{stored}. Error: {e}")
+            return cached
+        finally:
+            if outcome != 'waiter':
+                metrics.cache_calls.inc(function=func.__name__, outcome=outcome)
+                metrics.cache_call_duration.observe(time.perf_counter() - t0, function=func.__name__, outcome=outcome)
+
+    wrapper.fallback_to_cache = True
     return wrapper
 
+# Argument types used as they are in fallback keys, being hashable with a stable repr
+_KEY_TYPES = (str, int, float, bool, type(None), date)
+
+def _key_part(value):
+    if isinstance(value, _KEY_TYPES):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_key_part(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _key_part(v)) for k, v in value.items()))
+    return repr(value)
+
+def _fallback_cache_key(func, args, kwargs):
+    """Returns the key of func(*args, **kwargs): the function name and the normalized arguments."""
+    return (
+        func.__name__,
+        tuple(_key_part(a) for a in args),
+        tuple(sorted((k, _key_part(v)) for k, v in kwargs.items())) if kwargs else (),
+    )
+
+def fallback_store_stats():
+    """Returns the FallbackStats of the fallback store, or None if it is shared between workers."""
+    return _fallback_store.stats()
+
+metrics.Gauge('fallback_store_entries', 'Results in the fallback store of this worker',
+              lambda: getattr(fallback_store_stats(), 'entries', None))
+metrics.Gauge('fallback_store_bytes', 'Size of the results in the fallback store of this worker',
+              lambda: getattr(fallback_store_stats(), 'bytes', None))
+metrics.Gauge('fallback_store_oldest_age_seconds', 'Age of the oldest result in the fallback store of this worker',
+              lambda: getattr(fallback_store_stats(), 'oldest_age', None))
+
+def refresh_cached(func, *args, timeout=None):
+    """
+    Recomputes func(*args) for a memoized function and replaces its cached result.
+
+    Unlike deleting the memoize entry, callers keep getting the previous result until the new
+    one is stored. The fallback_to_cache entry is updated too, if func has one.
+
+    Args:
+        func: A function decorated with cache.memoize or coalesce.memoize, and optionally
+            fallback_to_cache.
+        timeout: Timeout of the new entry, defaults to the memoize timeout of func.
+    """
+    result = func.uncached(*args)
+    store_cached(func, args, result, timeout)
+    return result
+
+def store_cached(func, args, result, timeout=None):
+    """Stores result as the cached result of func(*args), see refresh_cached."""
+    if hasattr(func, 'store'):
+        func.store(result, *args, timeout=timeout)
+    else:
+        cache.set(func.make_cache_key(func.uncached, *args), result, timeout=timeout or func.cache_timeout)
+    if getattr(func, 'fallback_to_cache', False):
+        _fallback_store.set(_fallback_cache_key(func, args, {}), result)
+
+def fetch_concurrently(**calls):
+    """
+    Issues independent upstream fetches concurrently on the upstream thread pool.
+
+    Each keyword argument maps a name to a tuple of (function, *args). Returns a dict
+    mapping the same names to futures, so callers can decide per source how to handle
+    failures. Timeouts are enforced per upstream by the fetch functions themselves,
+    which keeps the fallback_to_cache behavior of each source intact.
+    """
+    return {
+        name: _upstream_executor.submit(func, *args)
+        for name, (func, *args) in calls.items()
+    }
+
 app = Flask(__name__)
 
-# Configure Flask-Caching
-app.config['CACHE_TYPE'] = 'simple'
+# Configure Flask-Caching. SimpleCache is per worker process, to share cached upstream data
+# between workers use e.g. CACHE_TYPE=FileSystemCache with CACHE_DIR, or CACHE_TYPE=RedisCache
+# with CACHE_REDIS_URL (requires the redis package).
+app.config['CACHE_TYPE'] = 'SimpleCache'
+
+# Keep the fallback_to_cache results in the Flask-Caching backend too, instead of per worker
+app.config['FALLBACK_CACHE_SHARED'] = False
+app.config['FALLBACK_CACHE_TIMEOUT'] = 7*24*60*60
+# Otherwise bound the results kept per worker by their total size in bytes, and by the size of
+# each, by default a quarter of the total
+app.config['FALLBACK_CACHE_MAX_BYTES'] = 64*1024*1024
+app.config['FALLBACK_CACHE_MAX_ENTRY_BYTES'] = None
+
+# Path of the SQLite database for the local time-series store of published prices and CO2
+# emissions. Disabled if not set. The sync job backfills the last TIMESERIES_SYNC_DAYS days.
+app.config['TIMESERIES_DB'] = None
+app.config['TIMESERIES_SYNC_DAYS'] = 60
+app.config['TIMESERIES_SYNC_INTERVAL'] = 60*60
+# Days upstream returned only partly are fetched again, until they are this many days old
+app.config['TIMESERIES_SETTLE_DAYS'] = 7
+
+# Prefetch today's prices, CO2 emissions and all grid companies' tariffs in the background, so
+# requests are served from the cache. Refreshes every PREFETCH_INTERVAL seconds, and every
+# PREFETCH_PUBLICATION_INTERVAL seconds around the publication of the day-ahead prices.
+app.config['PREFETCH'] = False
+app.config['PREFETCH_INTERVAL'] = 5*60
+app.config['PREFETCH_PUBLICATION_TIME'] = '13:00'
+app.config['PREFETCH_PUBLICATION_INTERVAL'] = 60
+app.config['PREFETCH_TARIFFS_INTERVAL'] = 30*60
+
+# Serve today's and tomorrow's prices of the known grid companies from precomputed responses,
+# rebuilt after SNAPSHOT_MAX_AGE seconds or when the prefetcher refreshes their inputs
+app.config['SNAPSHOTS'] = True
+app.config['SNAPSHOT_MAX_AGE'] = 60
+
+# Address lookups are kept for ADDRESS_CACHE_TIMEOUT seconds, in the SQLite database at
+# ADDRESS_DB if set, or else per worker in a cache of up to ADDRESS_CACHE_MAX_ENTRIES lookups,
+# separate from the Flask-Caching backend. /adresse-batch resolves up to ADDRESS_BATCH_MAX
+# addresses per request, with ADDRESS_LOOKUP_CONCURRENCY upstream lookups at a time.
+app.config['ADDRESS_DB'] = None
+app.config['ADDRESS_CACHE_TIMEOUT'] = 30*24*60*60
+app.config['ADDRESS_CACHE_MAX_ENTRIES'] = 100000
+app.config['ADDRESS_BATCH_MAX'] = 5000
+app.config['ADDRESS_LOOKUP_CONCURRENCY'] = 8
+
+# Data file of the known grid companies, whose tariff codes are refreshed from DatahubPriceList
+# every GRIDCOMPANIES_REFRESH_INTERVAL seconds if set
+app.config['GRIDCOMPANIES_FILE'] = os.path.join(app.root_path, 'gridcompanies.json')
+app.config['GRIDCOMPANIES_REFRESH_INTERVAL'] = 0
+
+# Data file of the date-effective taxes and fees: elafgift, Energinet's tariffs and moms
+app.config['FEES_FILE'] = os.path.join(app.root_path, 'fees.json')
+
+# Cache-Control max-age in seconds for responses with windows including today or later, with
+# windows that ended before today (immutable), and for the grid company list and API spec
+app.config['HTTP_MAX_AGE_CURRENT'] = 60
+app.config['HTTP_MAX_AGE_HISTORIC'] = 24*60*60
+app.config['HTTP_MAX_AGE_STATIC'] = 60*60
+
+# Most customers per /elpris-regning request
+app.config['BILL_MAX_CUSTOMERS'] = 1000
+
+# Upstream data past its timeout is served for up to UPSTREAM_STALE_TIMEOUT seconds more, while
+# it is refreshed in the background
+app.config['UPSTREAM_STALE_TIMEOUT'] = 10*60
+
+# Configure pooled upstream HTTP sessions
+app.config['UPSTREAM_POOL_SIZE'] = 10
+app.config['UPSTREAM_RETRIES'] = 2
+app.config['UPSTREAM_BACKOFF_FACTOR'] = 0.3
+# Timeouts in seconds by upstream source, overriding those of UPSTREAM_TIMEOUTS, e.g.
+# FLASK_UPSTREAM_TIMEOUTS='{"DatahubPriceList": 30}'
+app.config['UPSTREAM_TIMEOUTS'] = {}
+
+# Allow overriding the configuration from FLASK_* environment variables
+app.config.from_prefixed_env()
+
 cache = Cache(app)
+if app.config['FALLBACK_CACHE_SHARED']:
+    set_fallback_store(SharedFallbackStore(cache.cache, timeout=app.config['FALLBACK_CACHE_TIMEOUT']))
+else:
+    set_fallback_store(LocalFallbackStore(
+        max_bytes=app.config['FALLBACK_CACHE_MAX_BYTES'],
+        max_entry_bytes=app.config['FALLBACK_CACHE_MAX_ENTRY_BYTES'],
+    ))
+
+registry = GridCompanyRegistry.load(app.config['GRIDCOMPANIES_FILE'])
+fee_schedule = FeeSchedule.load(app.config['FEES_FILE'])
+
+if app.config['ADDRESS_DB']:
+    _address_store = AddressStore(app.config['ADDRESS_DB'], timeout=app.config['ADDRESS_CACHE_TIMEOUT'])
+else:
+    _address_store = CacheAddressStore(SimpleCache(threshold=app.config['ADDRESS_CACHE_MAX_ENTRIES']), timeout=app.config['ADDRESS_CACHE_TIMEOUT'])
+_address_executor = ThreadPoolExecutor(max_workers=app.config['ADDRESS_LOOKUP_CONCURRENCY'], thread_name_prefix='address-lookup')
+
+_timeseries_store = None
+if app.config['TIMESERIES_DB']:
+    _timeseries_store = TimeSeriesStore(app.config['TIMESERIES_DB'], settle_days=app.config['TIMESERIES_SETTLE_DAYS'])
+
+upstream.configure(
+    pool_size=app.config['UPSTREAM_POOL_SIZE'],
+    retries=app.config['UPSTREAM_RETRIES'],
+    backoff_factor=app.config['UPSTREAM_BACKOFF_FACTOR'],
+)
+UPSTREAM_TIMEOUTS.update(app.config['UPSTREAM_TIMEOUTS'])
 
 # Configure Flask-Limiter
 #limiter = Limiter(get_remote_address, app=app)
@@ -79,21 +299,34 @@ cache = Cache(app)
 def maindoc():
     return render_template('main.html')
 
-@fallback_to_cache
-@cache.memoize(timeout=60)
-def get_spotprices_legacy(start, priceArea, end=None):
+# Sort order of the energidataservice.dk datasets
+_DATASET_SORT = {
+    'elspotprices': 'HourUTC asc',
+    'DayAheadPrices': 'TimeUTC asc',
+    'CO2EmisProg': 'Minutes5UTC asc',
+}
+
+def _dataset_params(dataset, start, priceArea, end=None):
     params = {
         "start": start.isoformat(),
         "filter": '{"PriceArea":"%s"}' % priceArea,
-        "sort": "HourUTC asc",
+        "sort": _DATASET_SORT[dataset],
     }
     if end:
         params['end'] = end.isoformat()
+    return params
 
-    response = requests.get('https://api.energidataservice.dk/dataset/elspotprices', params=params, verify="energidataservice.pem")
+def _fetch_spotprices_legacy(start, priceArea, end=None):
+    params = _dataset_params('elspotprices', start, priceArea, end)
+    response = upstream.get('https://api.energidataservice.dk/dataset/elspotprices', params=params, timeout=UPSTREAM_TIMEOUTS['elspotprices'], name='elspotprices')
     response.raise_for_status()
     return response.json()
 
+@fallback_to_cache
+@coalesce.memoize(cache, timeout=60, stale_timeout=app.config['UPSTREAM_STALE_TIMEOUT'])
+def get_spotprices_legacy(start, priceArea, end=None):
+    return _read_timeseries('elspotprices', start, priceArea, end)
+
 
 class DayAheadPriceRecord(TypedDict):
     """Represents a single DayAheadPrice record from the API."""
@@ -105,74 +338,37 @@ class DayAheadPricesResponse(TypedDict):
     """Represents the full response from the API."""
     records: List[DayAheadPriceRecord]
 
-@fallback_to_cache
-@cache.memoize(timeout=60)
-def get_dayahead_prices(start: datetime, priceArea: str, end: Optional[datetime] = None) -> Optional[DayAheadPricesResponse]:
-    params = {
-        "start": start.isoformat(),
-        "filter": '{"PriceArea":"%s"}' % priceArea,
-        "sort": "TimeUTC asc",
-    }
-    if end:
-        params['end'] = end.isoformat()
-
-    response = requests.get('https://api.energidataservice.dk/dataset/DayAheadPrices', params=params, verify="energidataservice.pem")
+def _fetch_dayahead_prices(start: datetime, priceArea: str, end: Optional[datetime] = None) -> DayAheadPricesResponse:
+    params = _dataset_params('DayAheadPrices', start, priceArea, end)
+    response = upstream.get('https://api.energidataservice.dk/dataset/DayAheadPrices', params=params, timeout=UPSTREAM_TIMEOUTS['DayAheadPrices'], name='DayAheadPrices')
     response.raise_for_status()
+    return _compensate_missing_dkk(response.json())
 
+def _compensate_missing_dkk(retval):
     #Compensate for missing prices in DKK, if we have prices in EUR, since that is sometimes a failure mode of energidataservice
-    retval = response.json()
     for x in retval['records']:
         if not x['DayAheadPriceDKK'] and x['DayAheadPriceEUR']:
             x['DayAheadPriceDKK'] = x['DayAheadPriceEUR'] * 7.46038
 
     return retval
 
-
-def _convert_copenhagen_to_utc_hour(timestamp_str):
-    """
-    Converts a timestamp string in the Copenhagen timezone to UTC.
-
-    Args:
-        timestamp_str: A string representing the timestamp in partial ISO-format YYYY-MM-DDTHH format, in the Copenhagen timezone.
-
-    Returns:
-        The corresponding ISO timestamp in UTC.
-    """
-    copenhagen_timezone = pytz.timezone('Europe/Copenhagen')
-    hour_dt = datetime.strptime(timestamp_str, "%Y-%m-%dT%H")
-    copenhagen_dt = copenhagen_timezone.localize(hour_dt)
-    utc_dt = copenhagen_dt.astimezone(pytz.utc)
-    return utc_dt.strftime("%Y-%m-%dT%H:%M:%S")
+@fallback_to_cache
+@coalesce.memoize(cache, timeout=60, stale_timeout=app.config['UPSTREAM_STALE_TIMEOUT'])
+def get_dayahead_prices(start: datetime, priceArea: str, end: Optional[datetime] = None) -> Optional[DayAheadPricesResponse]:
+    return _read_timeseries('DayAheadPrices', start, priceArea, end)
 
 
 @cache.memoize(timeout=60)
 def get_spotprices_from_dayahead_prices(start: datetime, priceArea: str, end: Optional[datetime] = None):
     dayaheadprices = get_dayahead_prices(start, priceArea, end)
 
-    perhour = []
-    curhour = None
-    curvalues = []
-    for x in dayaheadprices['records']:
-        xhour = hour_from_isotimestamp(x['TimeDK'])
-        if curhour is None or curhour != xhour:
-            if curvalues != []:
-                perhour += [{
-                        "HourDK": curhour + ":00:00",
-                        "HourUTC": _convert_copenhagen_to_utc_hour(curhour),
-                        "SpotPriceDKK": sum(curvalues) / len(curvalues)
-                    }]
-            curhour = xhour
-            curvalues = []
-
-        curvalues += [x['DayAheadPriceDKK']]
-
-    #handle last hour
-    if curhour:
-        perhour += [{
-                "HourDK": curhour + ":00:00",
-                "HourUTC": _convert_copenhagen_to_utc_hour(curhour),
-                "SpotPriceDKK": sum(curvalues) / len(curvalues)
-            }]
+    with metrics.span('aggregate_spotprices'):
+        hours, prices = average_per_hour(dayaheadprices['records'], 'TimeDK', 'DayAheadPriceDKK')
+        perhour = [{
+                "HourDK": hour,
+                "HourUTC": hourUTC,
+                "SpotPriceDKK": price
+            } for hour, hourUTC, price in zip(hours, timeaxis.copenhagen_to_utc(hours), prices)]
 
     return {
         'records': perhour,
@@ -189,214 +385,226 @@ class CO2EmissionsResponse(TypedDict):
     """Represents the full response from the API."""
     records: List[DayAheadPriceRecord]
 
-@fallback_to_cache
-@cache.memoize(timeout=60)
-def get_co2emissions(start: datetime, priceArea: str, end: Optional[datetime] = None) -> Optional[CO2EmissionsResponse]:
-    params = {
-        "start": start.isoformat(),
-        "filter": '{"PriceArea":"%s"}' % priceArea,
-        "sort": "Minutes5UTC asc",
-    }
-    if end:
-        params['end'] = end.isoformat()
-
-    response = requests.get('https://api.energidataservice.dk/dataset/CO2EmisProg', params=params, verify="energidataservice.pem")
+def _fetch_co2emissions(start: datetime, priceArea: str, end: Optional[datetime] = None) -> CO2EmissionsResponse:
+    params = _dataset_params('CO2EmisProg', start, priceArea, end)
+    response = upstream.get('https://api.energidataservice.dk/dataset/CO2EmisProg', params=params, timeout=UPSTREAM_TIMEOUTS['CO2EmisProg'], name='CO2EmisProg')
     response.raise_for_status()
     return response.json()
 
-def hour_from_isotimestamp(ts):
-    return ts[:len("YYYY-MM-DDTHH")]
+@fallback_to_cache
+@coalesce.memoize(cache, timeout=60, stale_timeout=app.config['UPSTREAM_STALE_TIMEOUT'])
+def get_co2emissions(start: datetime, priceArea: str, end: Optional[datetime] = None) -> Optional[CO2EmissionsResponse]:
+    return _read_timeseries('CO2EmisProg', start, priceArea, end)
+
+# Datasets kept in the local time-series store: fetch function and Danish time column
+_TIMESERIES_DATASETS = {
+    'elspotprices': (_fetch_spotprices_legacy, 'HourDK'),
+    'DayAheadPrices': (_fetch_dayahead_prices, 'TimeDK'),
+    'CO2EmisProg': (_fetch_co2emissions, 'Minutes5DK'),
+}
+
+def _read_timeseries(dataset, start, priceArea, end):
+    fetch, time_key = _TIMESERIES_DATASETS[dataset]
+    if _timeseries_store is None:
+        return fetch(start, priceArea, end)
+    return _timeseries_store.read_through(dataset, time_key, fetch, start, priceArea, end)
+
+if _timeseries_store is not None and app.config['TIMESERIES_SYNC_INTERVAL']:
+    # The legacy elspotprices dataset is no longer updated, so it is only stored on demand
+    start_sync_thread(
+        _timeseries_store,
+        {dataset: _TIMESERIES_DATASETS[dataset] for dataset in ('DayAheadPrices', 'CO2EmisProg')},
+        ('DK1', 'DK2'),
+        days=app.config['TIMESERIES_SYNC_DAYS'],
+        interval=app.config['TIMESERIES_SYNC_INTERVAL'],
+    )
+
+def average_per_hour(records, time_key, value_key):
+    """
+    Averages the values of records into Danish hours, by the local timestamps in time_key.
+    Returns the hours, as YYYY-MM-DDTHH:00:00, and the averages. The repeated hour 02 of the
+    25 hour day is averaged into one hour.
+    """
+    keys = [timeaxis.local_seconds(r[time_key]) for r in records]
+    starts = resample.bucket_starts(keys, resample.RESOLUTIONS['hour'])
+    averages = resample.resample(keys, [r[value_key] for r in records], starts, 'mean')
+    return [timeaxis.format_seconds(start) for start in starts], averages
 
 @cache.memoize(timeout=60)
 def get_co2emissions_avgperhour(start: datetime, priceArea: str, end: Optional[datetime] = None):
     co2emissions = get_co2emissions(start, priceArea, end)
 
-    perhour = []
-    curhour = None
-    curvalues = []
-    for x in co2emissions['records']:
-        xhour = hour_from_isotimestamp(x['Minutes5DK'])
-        if curhour is None or curhour != xhour:
-            if curvalues != []:
-                perhour += [{
-                        "HourDK": curhour + ":00:00",
-                        "CO2Emission": sum(curvalues) / len(curvalues)
-                    }]
-            curhour = xhour
-            curvalues = []
-
-        curvalues += [x['CO2Emission']]
-
-    #handle last hour
-    if curhour:
-        perhour += [{
-                "HourDK": curhour + ":00:00",
-                "CO2Emission": sum(curvalues) / len(curvalues)
-            }]
+    with metrics.span('aggregate_co2emissions'):
+        hours, averages = average_per_hour(co2emissions['records'], 'Minutes5DK', 'CO2Emission')
+        perhour = [{
+                "HourDK": hour,
+                "CO2Emission": average
+            } for hour, average in zip(hours, averages)]
 
     return {
         'records': perhour,
         }
 
 @cache.memoize(timeout=60)
-def get_co2emissions_aligned_to_timeseries(start: datetime, priceArea: str, timestamps: List[datetime], end: Optional[datetime] = None):
+def get_co2emissions_aligned(start: datetime, priceArea: str, end: Optional[datetime] = None):
+    """CO2 emissions averaged into the slots of the day-ahead prices of the same window."""
+    timestamps = [r['TimeDK'] for r in get_dayahead_prices(start, priceArea, end)['records']]
     co2emissions = get_co2emissions(start, priceArea, end)
+    return align_co2emissions(co2emissions['records'], timestamps)
 
-    records = []
-    curvalues = []
-    timestamps_idx = 0
-    curts = timestamps[timestamps_idx]
-    nextts = timestamps[timestamps_idx + 1]
-    for x in co2emissions['records']:
-        xts = datetime.fromisoformat(x['Minutes5DK'])
-        if xts >= nextts:
-            if curvalues != []:
-                records += [{
-                        "TimeDK": curts.isoformat(),
-                        "CO2Emission": sum(curvalues) / len(curvalues)
-                    }]
-            timestamps_idx += 1
-            curts = timestamps[timestamps_idx]
-            if timestamps_idx + 1 >= len(timestamps):
-                break
-            nextts = timestamps[timestamps_idx + 1]
-            curvalues = []
-
-        curvalues += [x['CO2Emission']]
-
-    #handle last timestamp
-    if curvalues != []:
-        records += [{
-                "TimeDK": curts.isoformat(),
-                "CO2Emission": sum(curvalues) / len(curvalues)
-            }]
+@metrics.timed('align_co2emissions')
+def align_co2emissions(co2records, timestamps: List[Union[datetime, str]]):
+    """
+    Averages 5 minute CO2 emission records into the slots starting at the given Danish local
+    timestamps, given as datetimes or ISO strings.
+    """
+    labels = [ts if isinstance(ts, str) else ts.isoformat() for ts in timestamps]
+    # Slots and records are matched in UTC, which tells apart the repeated hour of the 25 hour day
+    starts = timeaxis.utc_seconds(labels)
+    # The last slot is as long as the one before it
+    end = 2 * starts[-1] - starts[-2]
+    averages = resample.resample(
+        # Minutes5UTC is unambiguous, so it needs no DST handling
+        timeaxis.grid_seconds([x['Minutes5UTC'] for x in co2records], 5*60),
+        [x['CO2Emission'] for x in co2records],
+        starts, 'mean', end)
 
     return {
-        'records': records,
+        'records': [{"TimeDK": label, "CO2Emission": average} for label, average in zip(labels, averages)],
         }
 
-@fallback_to_cache
-@cache.memoize(timeout=60*60)
-def get_tariffs(gln_Number, chargeTypeCode):
-    params = {
+def _tariffs_params(gln_Number, chargeTypeCode):
+    return {
         "filter": '{"GLN_Number":"%s", "ChargeType":"D03", "ChargeTypeCode":"%s"}' % (gln_Number, chargeTypeCode),
         #"sort": "HourUTC asc",
         "limit": 0,
     }
-    response = requests.get('https://api.energidataservice.dk/dataset/DatahubPriceList', params=params, verify="energidataservice.pem")
+
+@fallback_to_cache
+@coalesce.memoize(cache, timeout=60*60, stale_timeout=app.config['UPSTREAM_STALE_TIMEOUT'])
+def get_tariffs(gln_Number, chargeTypeCode):
+    params = _tariffs_params(gln_Number, chargeTypeCode)
+    response = upstream.get('https://api.energidataservice.dk/dataset/DatahubPriceList', params=params, timeout=UPSTREAM_TIMEOUTS['DatahubPriceList'], name='DatahubPriceList')
     response.raise_for_status()
     return response.json()['records']
 
 
-@cache.memoize(timeout=60)
-def get_tariffs_for_date(start, gln_Number, chargeTypeCode):
+@cache.memoize(timeout=60*60)
+def get_tariff_index(gln_Number, chargeTypeCode) -> TariffIndex:
     tariffs = get_tariffs(gln_Number, chargeTypeCode)
+    with metrics.span('tariff_index'):
+        return TariffIndex(tariffs)
 
-    start = datetime.combine(start, datetime.min.time())
 
-    for t in tariffs:
-        t['ValidFrom'] = datetime.fromisoformat(t['ValidFrom'])
-        t['ValidTo'] = t['ValidTo'] and datetime.fromisoformat(t['ValidTo']) or None
-        #XXX seems buggy if t['ValidTo'] is None
-
-        if start >= t['ValidFrom'] and start < t['ValidTo']:
-            #compensate for potentially missing prices, use Price1
-            for i in range(2, 25):
-                if not t[f'Price{i}']:
-                    t[f'Price{i}'] = t['Price1']
-            return t
-
-    return None
+def get_tariffs_for_date(start, gln_Number, chargeTypeCode):
+    return get_tariff_index(gln_Number, chargeTypeCode).record_for(start)
 
 def date_from_reqparam(param):
     date_format = '%Y-%m-%d'
     return datetime.strptime(param, date_format).date()
 
-@dataclass
-class GridCompany:
-    name: str
-    gln_Number: str
-    chargeTypeCode: str
-    gridCompanyNumber: str
-    priceArea: Optional[str] = "DK1"
-
-#Painfully manually extracted from https://www.energidataservice.dk/tso-electricity/DatahubPricelist
-gridCompanies = [
-    GridCompany("N1 A/S", "5790000611003", "T-C-F-T-TD", "344", "DK1"),
-    GridCompany("Zeanet A/S", "5790001089375", "43110", "860", "DK2"),
-    GridCompany("NOE Net A/S", "5790000395620", "30030", "347", "DK1"),
-    GridCompany("Radius Elnet A/S", "5790000705689", "DT_C_01", "790", "DK2"),
-    GridCompany("Radius Elnet A/S", "5790000705689", "DT_C_01", "791", "DK2"),
-    GridCompany("Netselskabet Elværk A/S - 331", "5790000681358", "5NCFF", "331", "DK1"),
-    GridCompany("TREFOR El-Net Øst A/S", "5790000706686", "46", "911", "DK2"),
-    GridCompany("Sunds Net A.m.b.a", "5790001095444", "SEF-NT-05", "396", "DK1"),
-    GridCompany("Elnet Midt A/S", "5790001100520", "T3001", "154", "DK1"),
-    GridCompany("Vores Elnet A/S", "5790000610976", "TNT1011", "543", "DK1"),
-    GridCompany("Netselskabet Elværk A/S - 042", "5790000681075", "0NCFF", "042", "DK1"),
-    GridCompany("NKE-Elnet A/S", "5790001088231", "94TR_C_ET", "854", "DK2"),
-    GridCompany("Hurup Elværk Net A/S", "5790000610839", "HEV-NT-01T", "381", "DK1"),
-    GridCompany("Elektrus A/S", "5790000836239", "6000091", "757", "DK2"),
-    GridCompany("Aal El-Net A M B A", "5790001095451", "AAL-NT-05", "370", "DK1"),
-    GridCompany("Nord Energi Net A/S", "5790000610877", "TAC", "031", "DK1"),
-    GridCompany("Nord Energi Net A/S", "5790000610877", "TAC", "032", "DK1"),
-    GridCompany("RAH Net A/S", "5790000681327", "RAH-C", "348", "DK1"),
-    GridCompany("Videbæk Elnet A/S", "5790000610822", "VE-ON-11", "385", "DK1"), #maybe also need to add "VE-NT-01"
-    GridCompany("Ravdex A/S", "5790000836727", "NT-C", "531", "DK1"),
-    GridCompany("Midtfyns Elforsyning A.m.b.A", "5790001089023", "TNT15000", "584", "DK1"),
-    GridCompany("FLOW Elnet A/S", "5790000392551", "FE2 NT-01", "533", "DK1"),
-    GridCompany("Veksel A/S", "5790001088217", "NT-10", "532", "DK1"),
-    GridCompany("TREFOR El-net A/S", "5790000392261", "C", "244", "DK1"),
-    GridCompany("Cerius A/S", "5790000705184", "30TR_C_ET", "740", "DK2"),
-    GridCompany("Elinord A/S", "5790001095277", "43300", "051", "DK1"),
-    GridCompany("Dinel A/S - 232", "5790000610099", "TCL<100_02", "232", "DK1"),
-    GridCompany("Dinel A/S - 233", "5790000610099", "TCL<100_02", "233", "DK1"),
-    GridCompany("Ikast El Net A/S", "5790000682102", "IEV-NT-05", "342", "DK1"),
-    GridCompany("KONSTANT Net A/S", "5790000704842", "151-NT01T", "151", "DK1"),
-    GridCompany("KONSTANT Net A/S", "5790000683345", "245-NT01T", "245", "DK1"),
-    GridCompany("Hammel El-forsyning Net A/S", "5790001090166", "C-Tarif", "141", "DK1"),
-    GridCompany("El-net Kongerslev A/S", "5790002502699", "C-Tarif", "016", "DK1"),
-    GridCompany("Tarm Elværk Net A/S", "5790000706419", "TEV-NT-11T", "384", "DK1"),
-    GridCompany("L-NET A/S", "5790001090111", "4000", "351", "DK1"),
-    GridCompany("Hjerting Transformatorforening", "5790001095376", "C-Tarif", "371", "DK1"),
-    GridCompany("Nakskov Elnet A/S", "5790001088460", "92TR_C_ET", "853", "DK2"),
-    GridCompany("Læsø Elnet A/S", "5790001103460", "43100", "085", "DK1"),
-]
+def refresh_registry():
+    """Updates the tariff codes of the grid company registry from the currently valid tariffs."""
+    global registry
+    params = {
+        "filter": '{"ChargeType":"D03"}',
+        "columns": "GLN_Number,ChargeTypeCode,ValidFrom,ValidTo",
+        "limit": 0,
+    }
+    response = upstream.get('https://api.energidataservice.dk/dataset/DatahubPriceList', params=params, timeout=UPSTREAM_TIMEOUTS['DatahubPriceList'], name='DatahubPriceList')
+    response.raise_for_status()
+    registry = registry.with_current_tariffs(current_tariff_codes(response.json()['records']))
+
+if app.config['GRIDCOMPANIES_REFRESH_INTERVAL']:
+    start_refresh_thread(refresh_registry, app.config['GRIDCOMPANIES_REFRESH_INTERVAL'])
+
+def prefetch_jobs(today):
+    """The cached entries the default /elpris and /elpris-detaljer windows for today use."""
+    jobs = []
+    # The default start is the server's date, which differs from the Danish date around midnight
+    for start in dict.fromkeys((today, datetime.now().date())):
+        for priceArea in ('DK1', 'DK2'):
+            # In dependency order, so derived entries are computed from the refreshed ones
+            jobs += [
+                Job(get_dayahead_prices, (start, priceArea, None)),
+                Job(get_spotprices_from_dayahead_prices, (start, priceArea, None)),
+                Job(get_co2emissions, (start, priceArea, None)),
+                Job(get_co2emissions_avgperhour, (start, priceArea, None)),
+                Job(get_co2emissions_aligned, (start, priceArea, None)),
+            ]
+    every = app.config['PREFETCH_TARIFFS_INTERVAL']
+    for gln_Number, chargeTypeCode in registry.tariffs():
+        jobs += [
+            Job(get_tariffs, (gln_Number, chargeTypeCode), every),
+            Job(get_tariff_index, (gln_Number, chargeTypeCode), every),
+        ]
+    return jobs
+
+def http_caching(max_age, vary=None):
+    """
+    Decorator adding HTTP caching headers to the view's successful responses: Cache-Control
+    with max_age seconds, given as a number or as a function returning (seconds, immutable) for
+    the current request, and a content hash ETag unless the response has one or is streamed.
+    Requests with a matching If-None-Match are answered with 304 Not Modified.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code not in (200, 304):
+                return response
+
+            seconds, immutable = max_age() if callable(max_age) else (max_age, False)
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = seconds
+            response.cache_control.immutable = immutable
+            if vary:
+                response.vary.add(vary)
+
+            if response.status_code == 200 and 'ETag' not in response.headers \
+                    and not response.is_streamed and not response.direct_passthrough:
+                response.set_etag(content_etag(response.get_data()))
+                response.make_conditional(request)
+            return response
+        return wrapper
+    return decorator
 
 @app.route('/gridcompanies')
+@http_caching(app.config['HTTP_MAX_AGE_STATIC'])
 def route_gridcompanies():
-    return jsonify(gridCompanies)
-
-def elafgift(year):
-    if year == 2026:
-        return 0.008
-    elif year == 2025:
-        return 0.720
-    elif year == 2024:
-        return 0.761
-
-#https://energinet.dk/el/elmarkedet/tariffer/aktuelle-tariffer/
-#TODO: get these from the API, or update for 2026
-def energinet_nettarif(year):
-    if year == 2026:
-        return 0.043
-    return 0.061
-
-def energinet_systemtarif(year):
-    if year == 2026:
-        return 0.072
-    return 0.074
-
-moms = 1.25 #percentage
+    response = Response(registry.json, mimetype='application/json')
+    response.set_etag(registry.etag)
+    return response.make_conditional(request)
 
-@fallback_to_cache
-@cache.memoize(timeout=60*60)
-def get_info_for_address(address):
-    response = requests.get('https://api.elnet.greenpowerdenmark.dk/api/supplierlookup/' + address)
+def lookup_address(address):
+    response = upstream.get('https://api.elnet.greenpowerdenmark.dk/api/supplierlookup/' + address, timeout=UPSTREAM_TIMEOUTS['supplierlookup'], name='supplierlookup')
     response.raise_for_status()
     return response.json()
 
-@app.route('/adresse/<address>')
-def adresse(address):
+def get_info_for_address(address):
+    """
+    Returns the supplier lookup result for an address, from the address cache if it has been
+    looked up before in any spelling, see addresses.normalize_address. If the lookup API fails,
+    an expired lookup is returned instead, if there is one.
+    """
+    key = normalize_address(address)
+    info = _address_store.get(key)
+    if info is None:
+        try:
+            info = lookup_address(clean_address(address))
+        except Exception as e:
+            info = _address_store.get(key, stale=True)
+            if info is None:
+                raise
+            print(f"Warning: lookup_address failed, returning expired lookup. Error: {e}")
+            return info
+        if info:
+            _address_store.set(key, info)
+    return info
+
+def grid_company_for_address(address):
+    """Returns the grid company of an address, or aborts if it is not found."""
     if len(address) > 100:
         abort(400, 'Address too long')
 
@@ -405,10 +613,15 @@ def adresse(address):
         abort(400, 'Address not found in lookup API')
 
     gridCompanyNumber = info['def']
-    gridCompany = next((c for c in gridCompanies if c.gridCompanyNumber == gridCompanyNumber), None)
+    gridCompany = registry.by_number(gridCompanyNumber)
     if not gridCompany:
         print(f'Gridcompany not found for number {gridCompanyNumber}')
         abort(500, f'Gridcompany not found for number {gridCompanyNumber}')
+    return gridCompany
+
+@app.route('/adresse/<address>')
+def adresse(address):
+    gridCompany = grid_company_for_address(address)
 
     startDate = request.args.get('start')
     start = startDate and '&start=' + startDate or ''
@@ -419,123 +632,626 @@ def adresse(address):
     else:
         return redirect(url_for('elpris') + "?GLN_Number=" + gridCompany.gln_Number + start)
 
-@app.route('/elpris-detaljer')
-def elpris_detaljer():
-    startDate = request.args.get('start', datetime.now().date(), type=date_from_reqparam)
-    gln_Number = request.args.get('GLN_Number', '5790000611003')
-    gridCompany = next((c for c in gridCompanies if c.gln_Number == gln_Number), None)
+def _resolve_address(address):
+    try:
+        return {'address': address, 'gridCompany': grid_company_for_address(address)}
+    except HTTPException as e:
+        return {'address': address, 'error': e.description}
+    except Exception as e:
+        print(f"Warning: lookup of address {address!r} failed. Error: {e}")
+        return {'address': address, 'error': 'Address lookup failed'}
+
+@app.route('/adresse-batch', methods=['POST'])
+def adresse_batch():
+    """
+    Grid companies for many addresses in one request, e.g. when importing customers.
 
-    priceArea = request.args.get('PriceArea', gridCompany.priceArea)
-    chargeTypeCode = request.args.get('ChargeTypeCode', gridCompany.chargeTypeCode)
-    if not chargeTypeCode:
-        chargeTypeCode = gridCompany.chargeTypeCode
+    Takes a JSON body {"addresses": [...]}, and returns one result per address, in order, with
+    either the gridCompany or an error. Addresses are looked up concurrently, and each distinct
+    address (see addresses.normalize_address) only once.
+    """
+    body = request.get_json(silent=True)
+    addresses = body.get('addresses') if isinstance(body, dict) else None
+    if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+        abort(400, 'JSON body with a list of addresses required')
+    if len(addresses) > app.config['ADDRESS_BATCH_MAX']:
+        abort(400, f"At most {app.config['ADDRESS_BATCH_MAX']} addresses per request")
+
+    lookups = {}
+    for address in addresses:
+        key = normalize_address(address)
+        if key not in lookups:
+            lookups[key] = _address_executor.submit(_resolve_address, address)
+
+    results = []
+    for address in addresses:
+        result = lookups[normalize_address(address)].result()
+        results.append(dict(result, address=address))
 
-    endDate = None
+    return jsonify({
+        'results': results
+        })
+
+def requested_format():
+    """Returns the format given by the `format` parameter, or else negotiated from the Accept header."""
+    format = request.args.get('format')
+    if format is None:
+        mimetype = request.accept_mimetypes.best_match(list(formats.MIMETYPES.values()), default=formats.MIMETYPES['json'])
+        format = formats.format_for_mimetype(mimetype)
+    if format not in formats.MIMETYPES:
+        abort(400, 'Unsupported format')
+    return format
+
+def price_response(gridCompany, price_columns, startDate, endDate, chunked, time_dk_key, time_utc_key):
+    """
+    Renders the price columns of the window in the requested format.
+
+    price_columns(startDate, endDate) computes the price columns of a window, see requested_window
+    for the arguments. The format is given by the `format` query parameter, or else negotiated
+    from the Accept header, see formats.MIMETYPES. The default `json` returns a single JSON
+    document with one record per row. `ndjson` and `csv` are streamed: chunked windows are fetched,
+    priced and rendered one calendar month at a time while the response is sent, so memory use and
+    time to first byte stay flat for long ranges. The first month is computed before the response
+    starts, so upstream failures there are still answered with an error status. `columns` (JSON)
+    and `msgpack` hold one array per column.
+    """
+    format = requested_format()
+    mimetype = formats.MIMETYPES[format]
+
+    if format in formats.STREAMING:
+        if chunked:
+            windows = [(max(chunkStart, startDate), min(chunkEnd, endDate)) for chunkStart, chunkEnd in month_chunks(startDate, endDate)]
+        else:
+            windows = [(startDate, endDate)]
+        first = price_columns(*windows[0])
+
+        def chunks():
+            yield first
+            for window in windows[1:]:
+                yield price_columns(*window)
+
+        if format == 'ndjson':
+            rendered = ((app.json.dumps(record) + '\n' for record in columns.records(time_dk_key, time_utc_key))
+                        for columns in chunks())
+        else:
+            rendered = (formats.render_csv(columns, time_dk_key, time_utc_key, header=i == 0)
+                        for i, columns in enumerate(chunks()))
+        return Response(stream_with_context(metrics.timed_chunks('render', rendered)), mimetype=mimetype)
+
+    columns = price_columns(startDate, endDate)
+    with metrics.span('render'):
+        if format == 'columns':
+            return Response(formats.render_columns_json(gridCompany, columns, time_dk_key, time_utc_key), mimetype=mimetype)
+        elif format == 'msgpack':
+            return Response(formats.render_msgpack(gridCompany, columns, time_dk_key, time_utc_key), mimetype=mimetype)
+
+        return jsonify({
+            'gridCompany': gridCompany,
+            'records': list(columns.records(time_dk_key, time_utc_key))
+            })
+
+def requested_resolution():
+    """Returns the `resolution` parameter (see resample.RESOLUTIONS), or None to keep that of the data."""
+    resolution = request.args.get('resolution')
+    if resolution is not None and resolution not in resample.RESOLUTIONS:
+        abort(400, 'Unsupported resolution')
+    return resolution
+
+def default_end_date(startDate):
+    """Historic windows are capped at 30 days, recent ones run until the latest known price."""
     one_month_ago = datetime.now().date() - timedelta(days=30)
     if startDate < one_month_ago:
-        endDate = startDate + timedelta(days=30)
+        return startDate + timedelta(days=30)
+    return None
 
-    dayaheadprices = get_dayahead_prices(startDate, priceArea, endDate)
-    timestamps = list(map(lambda dah: datetime.fromisoformat(dah['TimeDK']), dayaheadprices['records']))
-    try:
-        co2emissions = get_co2emissions_aligned_to_timeseries(startDate, priceArea, timestamps, endDate)
-    except:
-        co2emissions = {'records': []}
+def spotprices_source(startDate):
+    """Returns the function providing hourly spot prices for windows starting at startDate."""
+    #officially the data stops flowing date(2025, 9, 30), but let's change over sooner
+    spotprices_cutoff_date = date(2025, 9, 7)
+    if startDate > spotprices_cutoff_date:
+        return get_spotprices_from_dayahead_prices
+    else:
+        return get_spotprices_legacy
 
-    records = []
-    for (p, emission) in zip_longest(dayaheadprices['records'], co2emissions['records']):
-        hourstamp = datetime.fromisoformat(p['TimeDK'])
-        tariffs = get_tariffs_for_date(hourstamp, gln_Number, chargeTypeCode)
+def get_spotprices_hourly(start, priceArea, end=None):
+    return spotprices_source(start)(start, priceArea, end)
+
+# Longest range accepted with explicit start and end parameters
+MAX_RANGE_DAYS = 366
 
-        pout = {
-            'TimeDK': p['TimeDK'],
-            'TimeUTC': p['TimeUTC'],
-            'SpotPrice': p['DayAheadPriceDKK'] / 1000.0, # MWh to KWh
+def requested_window():
+    """
+    Returns (startDate, endDate, chunked) for the start and end request parameters.
+
+    Without an end parameter the window is the traditional one, see default_end_date. With an
+    explicit end (exclusive), the range is fetched in chunks, see fetch_series.
+    """
+    startDate = request.args.get('start', datetime.now().date(), type=date_from_reqparam)
+    endDate = request.args.get('end', None, type=date_from_reqparam)
+    if endDate is None:
+        return startDate, default_end_date(startDate), False
+
+    if endDate <= startDate:
+        abort(400, 'end must be after start')
+    if (endDate - startDate).days > MAX_RANGE_DAYS:
+        abort(400, f'Ranges are limited to {MAX_RANGE_DAYS} days')
+    return startDate, endDate, True
+
+def price_max_age():
+    """
+    Returns (max-age, immutable) for the price window of the current request. Windows that ended
+    before today are historic, and their prices no longer change.
+    """
+    startDate, endDate, chunked = requested_window()
+    if endDate is not None and endDate <= datetime.now().date():
+        return app.config['HTTP_MAX_AGE_HISTORIC'], True
+    return app.config['HTTP_MAX_AGE_CURRENT'], False
+
+def month_chunks(startDate, endDate):
+    """Splits [startDate, endDate) into whole calendar months covering it."""
+    chunks = []
+    chunkStart = startDate.replace(day=1)
+    while chunkStart < endDate:
+        chunkEnd = (chunkStart + timedelta(days=32)).replace(day=1)
+        chunks.append((chunkStart, chunkEnd))
+        chunkStart = chunkEnd
+    return chunks
+
+@metrics.timed('fetch')
+def fetch_series(func, time_key, startDate, priceArea, endDate, chunked):
+    """
+    Fetches func(startDate, priceArea, endDate), optionally split into chunks.
 
-            'ElAfgift': elafgift(hourstamp.year),
-            'EnergiNetNetTarif': energinet_nettarif(hourstamp.year),
-            'EnergiNetSystemTarif': energinet_systemtarif(hourstamp.year),
+    Chunks are whole calendar months, so overlapping ranges share cached chunks. They are fetched
+    in parallel, each with its own memoize and fallback_to_cache entry, then merged in order and
+    trimmed to [startDate, endDate) on the Danish time column time_key.
+    """
+    if not chunked:
+        return func(startDate, priceArea, endDate)
 
-            'NetselskabTarif': tariffs['Price%d' % (hourstamp.hour % 24 + 1)],
+    futures = [_chunk_executor.submit(func, chunkStart, priceArea, chunkEnd)
+               for chunkStart, chunkEnd in month_chunks(startDate, endDate)]
+    records = []
+    for future in futures:
+        records += future.result()['records']
 
-            'CO2Emission': emission and emission['CO2Emission'] or None,
+    lo, hi = startDate.isoformat(), endDate.isoformat()
+    return {
+        'records': [r for r in records if lo <= r[time_key] < hi],
         }
-        pout['TotalExMoms'] = pout['SpotPrice'] + pout['ElAfgift'] + \
-                pout['EnergiNetNetTarif'] + pout['EnergiNetSystemTarif'] + \
-                pout['NetselskabTarif']
-        pout['Moms'] = pout['TotalExMoms'] * 0.25
-        pout['Total'] = pout['TotalExMoms'] + pout['Moms']
-        records.append(pout)
 
-    return jsonify({
-        'gridCompany': gridCompany,
-        'records': records
-        })
+_snapshots = SnapshotStore()
 
-@app.route('/elpris')
-def elpris():
-    startDate = request.args.get('start', datetime.now().date(), type=date_from_reqparam)
+def snapshot_key():
+    """
+    Returns the key of the snapshot serving the current request, or None if it is not served
+    from snapshots. That is requests for today or tomorrow of a known grid company, without
+    other parameters than GLN_Number, start and format.
+    """
+    if not app.config['SNAPSHOTS'] or not set(request.args) <= {'GLN_Number', 'start', 'format'}:
+        return None
     gln_Number = request.args.get('GLN_Number', '5790000611003')
-    gridCompany = next((c for c in gridCompanies if c.gln_Number == gln_Number), None)
+    if registry.by_gln(gln_Number) is None:
+        return None
+
+    today = datetime.now().date()
+    try:
+        startDate = request.args.get('start', today, type=date_from_reqparam)
+    except ValueError:
+        return None
+    if startDate not in (today, today + timedelta(days=1)):
+        return None
+    return (request.endpoint, gln_Number, startDate, requested_format())
+
+def snapshot_response(snapshot):
+    response = Response(snapshot.body, mimetype=snapshot.mimetype)
+    response.set_etag(snapshot.etag)
+    response.last_modified = snapshot.last_modified
+    return response.make_conditional(request)
+
+def serve_snapshot(view):
+    """
+    Decorator serving the view's response from a snapshot, for requests covered by
+    snapshot_key(). Missing and expired snapshots are built from the view's response.
+    Conditional requests (If-None-Match, If-Modified-Since) are answered with 304 Not Modified.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = snapshot_key()
+        if key is None:
+            return view(*args, **kwargs)
+
+        snapshot = None if g.get('rebuild_snapshot') else _snapshots.get(key)
+        if snapshot is None:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            max_age = g.get('snapshot_max_age', app.config['SNAPSHOT_MAX_AGE'])
+            snapshot = _snapshots.put(key, response.get_data(), response.mimetype, max_age)
+        return snapshot_response(snapshot)
+    return wrapper
+
+def rebuild_snapshots(max_age):
+    """
+    Rebuilds the snapshots that have been requested, e.g. after their inputs were refreshed,
+    and drops those of past days.
+    """
+    today = datetime.now().date()
+    for endpoint, gln_Number, startDate, format in _snapshots.keys():
+        if startDate < today:
+            _snapshots.discard((endpoint, gln_Number, startDate, format))
+            continue
+
+        query = {'GLN_Number': gln_Number, 'start': startDate.isoformat(), 'format': format}
+        with app.test_request_context(app.url_map.bind('').build(endpoint), query_string=query):
+            g.rebuild_snapshot = True
+            g.snapshot_max_age = max_age
+            try:
+                app.full_dispatch_request()
+            except Exception as e:
+                print(f"Warning: rebuilding snapshot of {endpoint} for {gln_Number} failed. Error: {e}")
+
+def requested_grid_company():
+    """Returns (gridCompany, priceArea, chargeTypeCode) for the GLN_Number, PriceArea and ChargeTypeCode parameters."""
+    gln_Number = request.args.get('GLN_Number', '5790000611003')
+    gridCompany = registry.by_gln(gln_Number)
+    if not gridCompany:
+        abort(400, f'Gridcompany not found for GLN_Number {gln_Number}')
 
     priceArea = request.args.get('PriceArea', gridCompany.priceArea)
     chargeTypeCode = request.args.get('ChargeTypeCode', gridCompany.chargeTypeCode)
     if not chargeTypeCode:
         chargeTypeCode = gridCompany.chargeTypeCode
+    return gridCompany, priceArea, chargeTypeCode
+
+def requested_companies():
+    """Returns the grid companies for the GLN_Number (list) or PriceArea parameters of /elpris-batch."""
+    gln_Numbers = [gln for param in request.args.getlist('GLN_Number') for gln in param.split(',') if gln]
+
+    if gln_Numbers:
+        companies = []
+        for gln_Number in gln_Numbers:
+            gridCompany = registry.by_gln(gln_Number)
+            if not gridCompany:
+                abort(400, f'Gridcompany not found for GLN_Number {gln_Number}')
+            companies.append(gridCompany)
+    else:
+        priceArea = request.args.get('PriceArea')
+        if not priceArea:
+            abort(400, 'GLN_Number or PriceArea required')
+        companies = registry.by_price_area(priceArea)
+
+    # Some companies are listed once per grid company number, but share their tariffs
+    unique = {}
+    for c in companies:
+        unique.setdefault((c.gln_Number, c.chargeTypeCode), c)
+    return list(unique.values())
+
+def upstream_calls_for_request():
+    """
+    Returns the upstream getter calls, as (func, args), that the price route of the current
+    request will make. The ASGI mode fetches these asynchronously before running the route.
+    """
+    endpoint = request.endpoint
+    if endpoint not in ('elpris', 'elpris_detaljer', 'elpris_batch', 'elpris_billigst'):
+        return []
+    key = snapshot_key()
+    if key is not None and _snapshots.get(key) is not None:
+        # Served without upstream data
+        return []
+
+    startDate, endDate, chunked = requested_window()
+    windows = month_chunks(startDate, endDate) if chunked else [(startDate, endDate)]
+    if endpoint in ('elpris_batch', 'elpris_billigst'):
+        companies = requested_companies()
+        priceAreas = sorted({c.priceArea for c in companies})
+        tariffs = [(c.gln_Number, c.chargeTypeCode) for c in companies]
+    else:
+        gridCompany, priceArea, chargeTypeCode = requested_grid_company()
+        priceAreas = [priceArea]
+        tariffs = [(gridCompany.gln_Number, chargeTypeCode)]
+
+    calls = []
+    for priceArea in priceAreas:
+        for start, end in windows:
+            if endpoint == 'elpris_detaljer' or spotprices_source(start) is get_spotprices_from_dayahead_prices:
+                calls.append((get_dayahead_prices, (start, priceArea, end)))
+            else:
+                calls.append((get_spotprices_legacy, (start, priceArea, end)))
+            calls.append((get_co2emissions, (start, priceArea, end)))
+    calls += [(get_tariffs, t) for t in tariffs]
+    return calls
+
+@metrics.timed('compute')
+def hourly_price_columns(spotprices, co2emissions, tariff_index):
+    records = spotprices['records']
+    return compute_price_columns(
+        [p['HourDK'] for p in records],
+        [p['HourUTC'] for p in records],
+        [p['SpotPriceDKK'] for p in records],
+        tariff_index,
+        [int(p['HourDK'][11:13]) for p in records],
+        [e['CO2Emission'] for e in co2emissions['records']],
+        fee_schedule,
+    )
+
+@metrics.timed('compute')
+def detailed_price_columns(dayaheadprices, co2emissions, tariff_index):
+    records = dayaheadprices['records']
+    return compute_price_columns(
+        [p['TimeDK'] for p in records],
+        [p['TimeUTC'] for p in records],
+        [p['DayAheadPriceDKK'] for p in records],
+        tariff_index,
+        [int(p['TimeDK'][11:13]) for p in records],
+        [e['CO2Emission'] for e in co2emissions['records']],
+        fee_schedule,
+    )
 
-    endDate = None
-    one_month_ago = datetime.now().date() - timedelta(days=30)
-    if startDate < one_month_ago:
-        endDate = startDate + timedelta(days=30)
+@app.route('/elpris-detaljer')
+@http_caching(price_max_age, vary='Accept')
+@serve_snapshot
+def elpris_detaljer():
+    startDate, endDate, chunked = requested_window()
+    resolution = requested_resolution()
+    gridCompany, priceArea, chargeTypeCode = requested_grid_company()
+    gln_Number = gridCompany.gln_Number
+
+    def price_columns(startDate, endDate):
+        fetches = fetch_concurrently(
+            dayaheadprices=(fetch_series, get_dayahead_prices, 'TimeDK', startDate, priceArea, endDate, chunked),
+            co2emissions=(fetch_series, get_co2emissions_aligned, 'TimeDK', startDate, priceArea, endDate, chunked),
+            tariffs=(get_tariff_index, gln_Number, chargeTypeCode),
+        )
+
+        dayaheadprices = fetches['dayaheadprices'].result()
+        try:
+            co2emissions = fetches['co2emissions'].result()
+        except:
+            co2emissions = {'records': []}
+        tariff_index = fetches['tariffs'].result()
 
-    #officially the data stops flowing date(2025, 9, 30), but let's change over sooner
-    spotprices_cutoff_date = date(2025, 9, 7)
-    if startDate > spotprices_cutoff_date:
-        spotprices = get_spotprices_from_dayahead_prices(startDate, priceArea, endDate)
-    else:
-        spotprices = get_spotprices_legacy(startDate, priceArea, endDate)
+        columns = detailed_price_columns(dayaheadprices, co2emissions, tariff_index)
+        if resolution:
+            columns = resample.resample_price_columns(columns, resolution)
+        return columns
+
+    return price_response(gridCompany, price_columns, startDate, endDate, chunked, 'TimeDK', 'TimeUTC')
+
+@app.route('/elpris')
+@http_caching(price_max_age, vary='Accept')
+@serve_snapshot
+def elpris():
+    startDate, endDate, chunked = requested_window()
+    resolution = requested_resolution()
+    gridCompany, priceArea, chargeTypeCode = requested_grid_company()
+    gln_Number = gridCompany.gln_Number
+
+    def price_columns(startDate, endDate):
+        fetches = fetch_concurrently(
+            spotprices=(fetch_series, get_spotprices_hourly, 'HourDK', startDate, priceArea, endDate, chunked),
+            co2emissions=(fetch_series, get_co2emissions_avgperhour, 'HourDK', startDate, priceArea, endDate, chunked),
+            tariffs=(get_tariff_index, gln_Number, chargeTypeCode),
+        )
+
+        spotprices = fetches['spotprices'].result()
+        try:
+            co2emissions = fetches['co2emissions'].result()
+        except:
+            co2emissions = {'records': []}
+        tariff_index = fetches['tariffs'].result()
+
+        columns = hourly_price_columns(spotprices, co2emissions, tariff_index)
+        if resolution:
+            columns = resample.resample_price_columns(columns, resolution)
+        return columns
+
+    return price_response(gridCompany, price_columns, startDate, endDate, chunked, 'HourDK', 'HourUTC')
+
+def hourly_price_columns_for(companies, startDate, endDate, chunked):
+    """
+    Returns the hourly price columns of each of the grid companies. Spot prices and CO2
+    emissions are fetched once per price area, and each company's tariffs are applied on top.
+    """
+    priceAreas = sorted({c.priceArea for c in companies})
+
+    fetches = fetch_concurrently(
+        **{'spotprices-' + a: (fetch_series, get_spotprices_hourly, 'HourDK', startDate, a, endDate, chunked) for a in priceAreas},
+        **{'co2emissions-' + a: (fetch_series, get_co2emissions_avgperhour, 'HourDK', startDate, a, endDate, chunked) for a in priceAreas},
+        **{'tariffs-%d' % i: (get_tariff_index, c.gln_Number, c.chargeTypeCode) for i, c in enumerate(companies)},
+    )
+
+    spotprices = {a: fetches['spotprices-' + a].result() for a in priceAreas}
+    co2emissions = {}
+    for a in priceAreas:
+        try:
+            co2emissions[a] = fetches['co2emissions-' + a].result()
+        except:
+            co2emissions[a] = {'records': []}
+
+    return [hourly_price_columns(spotprices[c.priceArea], co2emissions[c.priceArea], fetches['tariffs-%d' % i].result())
+            for i, c in enumerate(companies)]
+
+@app.route('/elpris-batch')
+@http_caching(price_max_age)
+def elpris_batch():
+    """
+    Hourly prices for several grid companies in one response.
+
+    Takes a list of GLN_Number parameters (repeated or comma separated), or a PriceArea to get
+    all known grid companies in that area. Spot prices and CO2 emissions are fetched once per
+    price area, and each company's tariffs are applied on top.
+    """
+    startDate, endDate, chunked = requested_window()
+    resolution = requested_resolution()
+    companies = requested_companies()
+
+    format = request.args.get('format', 'json')
+    if format not in ('json', 'columns'):
+        abort(400, 'Unsupported format')
+
+    results = []
+    for c, columns in zip(companies, hourly_price_columns_for(companies, startDate, endDate, chunked)):
+        if resolution:
+            columns = resample.resample_price_columns(columns, resolution)
+        if format == 'columns':
+            results.append({'gridCompany': c, 'columns': formats.column_dict(columns, 'HourDK', 'HourUTC')})
+        else:
+            results.append({'gridCompany': c, 'records': list(columns.records('HourDK', 'HourUTC'))})
 
+    return jsonify({
+        'results': results
+        })
+
+def requested_local_time(param, default=None):
+    """Returns the Danish local ISO datetime (or date) of a request parameter as UTC seconds."""
+    value = request.args.get(param, default)
+    if value is None:
+        return None
     try:
-        co2emissions = get_co2emissions_avgperhour(startDate, priceArea, endDate)
-    except:
-        co2emissions = {'records': []}
+        value = datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        abort(400, f'Invalid {param}')
+    return timeaxis.utc_seconds([value])[0]
+
+@app.route('/elpris-billigst')
+@http_caching(price_max_age)
+def elpris_billigst():
+    """
+    The cheapest hours of the window for several grid companies, e.g. to plan EV charging.
 
-    records = []
-    for (p, hour, emission) in zip_longest(spotprices['records'], range(len(spotprices['records'])), co2emissions['records']):
-        hourstamp = datetime.fromisoformat(p['HourDK'])
-        tariffs = get_tariffs_for_date(hourstamp, gln_Number, chargeTypeCode)
+    Takes the grid companies and window like /elpris-batch, and `hours`: the number of hours
+    needed. With consecutive=false the cheapest hours are chosen one by one, otherwise the
+    cheapest block of consecutive hours. Only hours ending after `after` (default now) and by
+    `before` (a deadline, optional) are considered. `by` selects the column to minimize:
+    Total (default) or CO2Emission.
+    """
+    startDate, endDate, chunked = requested_window()
+    companies = requested_companies()
+
+    hours = request.args.get('hours', type=int)
+    if not hours or hours < 1:
+        abort(400, 'hours must be a positive number')
+    consecutive = request.args.get('consecutive', 'true') != 'false'
+    by = request.args.get('by', 'Total')
+    if by not in ('Total', 'CO2Emission'):
+        abort(400, 'by must be Total or CO2Emission')
+    after = requested_local_time('after', timeaxis.local_now())
+    before = requested_local_time('before')
+
+    results = []
+    for c, columns in zip(companies, hourly_price_columns_for(companies, startDate, endDate, chunked)):
+        starts = timeaxis.utc_seconds(columns.TimeDK)
+        lo = bisect_right(starts, after - 60*60)
+        hi = bisect_right(starts, before - 60*60) if before is not None else len(starts)
+
+        values = getattr(columns, by)
+        if consecutive:
+            found = loadshift.cheapest_block(values, hours, lo, hi)
+            slots = found and list(range(found[0], found[0] + hours))
+        else:
+            found = loadshift.cheapest_slots(values, hours, lo, hi)
+            slots = found and found[0]
+
+        results.append({
+            'gridCompany': c,
+            'HourDK': [columns.TimeDK[i] for i in slots] if found else [],
+            'HourUTC': [columns.TimeUTC[i] for i in slots] if found else [],
+            by: found[1] if found else None,
+        })
 
-        pout = {
-            'HourDK': p['HourDK'],
-            'HourUTC': p['HourUTC'],
-            'SpotPrice': p['SpotPriceDKK'] / 1000.0, # MWh to KWh
+    return jsonify({
+        'results': results
+        })
 
-            'ElAfgift': elafgift(hourstamp.year),
-            'EnergiNetNetTarif': energinet_nettarif(hourstamp.year),
-            'EnergiNetSystemTarif': energinet_systemtarif(hourstamp.year),
+@app.route('/elpris-regning', methods=['POST'])
+def elpris_regning():
+    """
+    Bills for the metered consumption of one or more customers of a grid company.
 
-            'NetselskabTarif': tariffs['Price%d' % (hour % 24 + 1)],
+    The body holds the consumption as CSV (text/csv) or in the compact binary format
+    (application/octet-stream), see billing. It is priced with the hourly prices of /elpris for
+    the window covering the consumption, and with hourly=true the cost of each consumption slot
+    is included.
+    """
+    gridCompany, priceArea, chargeTypeCode = requested_grid_company()
+    hourly = request.args.get('hourly', 'false') == 'true'
+
+    try:
+        if request.mimetype == 'text/csv':
+            consumptions = billing.read_csv(io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline=''), app.config['BILL_MAX_CUSTOMERS'])
+        elif request.mimetype == 'application/octet-stream':
+            consumptions = billing.read_binary(request.stream, app.config['BILL_MAX_CUSTOMERS'])
+        else:
+            abort(415, 'Consumption must be text/csv or application/octet-stream')
+    except billing.ConsumptionError as e:
+        abort(400, str(e))
+    if not any(len(c.starts) for c in consumptions):
+        abort(400, 'No consumption')
+
+    startDate, endDate = billing.window_dates(consumptions)
+    if (endDate - startDate).days > MAX_RANGE_DAYS:
+        abort(400, f'Ranges are limited to {MAX_RANGE_DAYS} days')
+
+    try:
+        columns, = hourly_price_columns_for([replace(gridCompany, chargeTypeCode=chargeTypeCode)], startDate, endDate, True)
+    except MissingRateError as e:
+        # The consumption is outside the dates the fees are known for
+        abort(400, str(e))
+
+    results = []
+    for consumption, b in zip(consumptions, billing.bills(columns, consumptions)):
+        result = {'customer': b.customer, 'kWh': b.kWh, 'unpricedKWh': b.unpricedKWh}
+        result.update(b.costs)
+        if hourly:
+            result['hourly'] = {
+                'TimeUTC': [timeaxis.format_seconds(t) for t in consumption.starts],
+                'kWh': [k if k == k else None for k in consumption.kWh],
+                'Total': b.cost,
+            }
+        results.append(result)
 
-            'CO2Emission': emission and emission['CO2Emission'] or None,
-        }
-        pout['TotalExMoms'] = pout['SpotPrice'] + pout['ElAfgift'] + \
-                pout['EnergiNetNetTarif'] + pout['EnergiNetSystemTarif'] + \
-                pout['NetselskabTarif']
-        pout['Moms'] = pout['TotalExMoms'] * 0.25
-        pout['Total'] = pout['TotalExMoms'] + pout['Moms']
-        records.append(pout)
-
-    
     return jsonify({
         'gridCompany': gridCompany,
-        'records': records
+        'results': results
         })
 
+if app.config['PREFETCH']:
+    start_prefetch_thread(Prefetcher(
+        cache, refresh_cached, prefetch_jobs,
+        interval=app.config['PREFETCH_INTERVAL'],
+        publication_time=datetime.strptime(app.config['PREFETCH_PUBLICATION_TIME'], '%H:%M').time(),
+        publication_interval=app.config['PREFETCH_PUBLICATION_INTERVAL'],
+        after_run=rebuild_snapshots,
+    ))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.http_request_duration.observe(time.perf_counter() - g.request_start, route=route, status=str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def route_metrics():
+    """
+    Metrics of this worker process in the Prometheus text format: request durations per route,
+    upstream request durations, cache hits, misses and fallbacks per cached function, the size
+    and staleness of the fallback store, and the durations of the pipeline stages (fetch,
+    aggregation, tariffs, compute and render).
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/apidocs/')
 def swagger_ui():
     return render_template('swagger_ui.html')
 
 @app.route('/apispec')
+@http_caching(app.config['HTTP_MAX_AGE_STATIC'])
 def get_spec():
     return send_from_directory(app.root_path, 'openapi.yaml')
 
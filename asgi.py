@@ -0,0 +1,212 @@
+"""
+ASGI entry point, serving the app with asynchronous upstream I/O.
+
+Run with e.g. `uvicorn asgi:application --workers 4`. The WSGI entry point (app:app under
+gunicorn) keeps working as before.
+
+The price routes spend most of their time waiting on the upstream APIs. Here, the upstream data
+a request needs (see app.upstream_calls_for_request) is first fetched concurrently with the async
+upstream client, without holding a thread, and stored in the same caches the sync getters use.
+The Flask route then runs in a thread pool on cached data, so it only holds a thread while it
+computes and renders the response, and one process can have hundreds of requests waiting on
+upstream at once. Other routes run in the thread pool directly.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+import app as wsgi
+import upstream
+
+# Threads running the Flask app and the blocking cache and SQLite reads. Requests only hold one
+# while computing and rendering, not while waiting on upstream.
+WSGI_THREADS = 32
+
+_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+
+def _run_blocking(func, *args):
+    return asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+def _environ(scope, body):
+    """Builds the WSGI environ of the HTTP request in scope, see PEP 3333."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port or 80),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = 'HTTP_' + name
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+def _run_wsgi(environ, send, loop):
+    """Runs the Flask app in a worker thread, sending the response through the event loop."""
+    def send_sync(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    start = {}
+
+    def start_response(status, headers, exc_info=None):
+        start['message'] = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        }
+
+    result = wsgi.app(environ, start_response)
+    try:
+        started = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                send_sync(start['message'])
+                started = True
+            send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            send_sync(start['message'])
+        send_sync({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def _wsgi_application(scope, receive, send):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    await _run_blocking(_run_wsgi, _environ(scope, bytes(body)), send, asyncio.get_running_loop())
+
+
+async def _aget_json(url, params, dataset):
+    response = await upstream.aget(url, params=params, timeout=wsgi.UPSTREAM_TIMEOUTS[dataset], name=dataset)
+    response.raise_for_status()
+    return response.json()
+
+
+async def _afetch_dataset(dataset, start, priceArea, end=None):
+    """Async counterpart of the app._fetch_* functions."""
+    retval = await _aget_json('https://api.energidataservice.dk/dataset/' + dataset, wsgi._dataset_params(dataset, start, priceArea, end), dataset)
+    if dataset == 'DayAheadPrices':
+        retval = wsgi._compensate_missing_dkk(retval)
+    return retval
+
+
+async def _aread_timeseries(dataset, start, priceArea, end=None):
+    """Async counterpart of app._read_timeseries."""
+    store = wsgi._timeseries_store
+    if store is None:
+        return await _afetch_dataset(dataset, start, priceArea, end)
+
+    stored, fetch_start, store_before = await _run_blocking(store.plan_read, dataset, start, priceArea, end)
+    if fetch_start is None:
+        return {'records': stored}
+    response = await _afetch_dataset(dataset, fetch_start, priceArea, end)
+    _, time_key = wsgi._TIMESERIES_DATASETS[dataset]
+    return await _run_blocking(store.complete_read, dataset, time_key, priceArea, stored, response, store_before)
+
+
+async def _aget_tariffs(gln_Number, chargeTypeCode):
+    retval = await _aget_json('https://api.energidataservice.dk/dataset/DatahubPriceList', wsgi._tariffs_params(gln_Number, chargeTypeCode), 'DatahubPriceList')
+    return retval['records']
+
+
+# Async counterparts of the upstream getters in app.py
+_ASYNC_GETTERS = {
+    wsgi.get_spotprices_legacy: lambda *args: _aread_timeseries('elspotprices', *args),
+    wsgi.get_dayahead_prices: lambda *args: _aread_timeseries('DayAheadPrices', *args),
+    wsgi.get_co2emissions: lambda *args: _aread_timeseries('CO2EmisProg', *args),
+    wsgi.get_tariffs: _aget_tariffs,
+}
+
+_inflight = {}
+
+
+async def _fetch_into_cache(func, args):
+    try:
+        result = await _ASYNC_GETTERS[func](*args)
+        await _run_blocking(wsgi.store_cached, func, args, result)
+    except Exception as e:
+        # The route fetches it again, falling back to the last good result if that fails too
+        print(f"Warning: async fetch of {func.__name__} failed. Error: {e}")
+
+
+async def prefetch(func, args):
+    """
+    Fetches func(*args) into its cache entry, unless that is fresh. Concurrent calls for the same
+    entry share one fetch. Stale entries are refreshed without waiting, as the route serves them.
+    """
+    entry = await _run_blocking(func.peek, *args)
+    if entry is not None and entry[1]:
+        return
+
+    key = (func, args)
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(_fetch_into_cache(func, args))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    if entry is None:
+        await asyncio.shield(task)
+
+
+async def prefetch_for_request(scope):
+    """Fetches the upstream data the route for the HTTP request in scope needs."""
+    try:
+        with wsgi.app.test_request_context(scope['path'], query_string=scope['query_string'].decode('latin-1')):
+            calls = wsgi.upstream_calls_for_request()
+    except HTTPException:
+        # Invalid requests are answered by the route
+        return
+    await asyncio.gather(*(prefetch(func, args) for func, args in calls))
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.aclose_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] == 'http':
+        await prefetch_for_request(scope)
+    await _wsgi_application(scope, receive, send)
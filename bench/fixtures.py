@@ -0,0 +1,212 @@
+"""
+Transport adapters standing in for the upstream APIs, mounted on the pooled sessions in upstream.py.
+
+- RecordingAdapter passes requests through to the live APIs and records every response.
+- ReplayAdapter serves recorded responses, keyed on the request URL, without network access.
+- SyntheticAdapter generates deterministic responses in the upstream formats, for when no
+  recording is available. Results are comparable between commits, but not with recordings.
+- FailingAdapter answers every request with 503, to exercise the fallback_to_cache paths.
+
+Except for RecordingAdapter, the adapters also serve the async client of the ASGI mode.
+"""
+from datetime import date, datetime, timedelta
+import functools
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import pytz
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+import timeaxis
+import upstream
+
+
+def fixture_key(url):
+    """Returns a stable key for a request URL, independent of query parameter order."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    normalized = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+    return hashlib.sha1(normalized.encode()).hexdigest(), normalized
+
+
+def _response(request, status, body, headers=None):
+    response = Response()
+    response.status_code = status
+    response.reason = 'OK' if status < 400 else 'Error'
+    response.headers = CaseInsensitiveDict(headers or {'Content-Type': 'application/json'})
+    response.raw = io.BytesIO(body)
+    response.url = request.url
+    response.request = request
+    response.encoding = 'utf-8'
+    return response
+
+
+def mount(adapter):
+    """Mounts the adapter on the pooled sessions of all upstream hosts, and the async clients."""
+    for host in upstream.HOSTS:
+        upstream.session_for(host).mount('https://', adapter)
+    upstream.mount_async(async_transport(adapter) if hasattr(adapter, 'respond') else None)
+
+
+def async_transport(adapter):
+    """Returns an httpx transport answering requests with adapter.respond(url)."""
+    import httpx
+
+    def handle(request):
+        status, body, headers = adapter.respond(str(request.url))
+        return httpx.Response(status, content=body, headers=headers)
+    return httpx.MockTransport(handle)
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        key, url = fixture_key(request.url)
+        with gzip.open(os.path.join(self.directory, key + '.json.gz'), 'wt') as f:
+            json.dump({
+                'url': url,
+                'status': response.status_code,
+                'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+                'body': response.text,
+            }, f)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    @functools.lru_cache(maxsize=None)
+    def _load(self, key):
+        path = os.path.join(self.directory, key + '.json.gz')
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt') as f:
+            fixture = json.load(f)
+        return fixture['status'], fixture['body'].encode(), fixture['headers']
+
+    def respond(self, url):
+        key, url = fixture_key(url)
+        fixture = self._load(key)
+        if fixture is None:
+            return 404, json.dumps({'error': f'No fixture recorded for {url}'}).encode(), None
+        return fixture
+
+    def send(self, request, **kwargs):
+        return _response(request, *self.respond(request.url))
+
+    def close(self):
+        pass
+
+
+class FailingAdapter(BaseAdapter):
+    def respond(self, url):
+        return 503, b'{"error": "Service Unavailable"}', None
+
+    def send(self, request, **kwargs):
+        return _response(request, *self.respond(request.url))
+
+    def close(self):
+        pass
+
+
+def _series(start, end, minutes):
+    """Yields (utc, dk) naive datetimes every `minutes` over the Danish dates [start, end)."""
+    t = timeaxis.COPENHAGEN_TIMEZONE.localize(datetime.combine(start, datetime.min.time())).astimezone(pytz.utc)
+    stop = timeaxis.COPENHAGEN_TIMEZONE.localize(datetime.combine(end, datetime.min.time())).astimezone(pytz.utc)
+    while t < stop:
+        yield t.replace(tzinfo=None), t.astimezone(timeaxis.COPENHAGEN_TIMEZONE).replace(tzinfo=None)
+        t += timedelta(minutes=minutes)
+
+
+def _value(t, base, amplitude):
+    minutes = int((t - datetime(2000, 1, 1)).total_seconds() // 60)
+    return round(base + amplitude * math.sin(minutes / 997.0) + (minutes % 7) * 0.37, 6)
+
+
+class SyntheticAdapter(BaseAdapter):
+    """
+    Generates deterministic upstream responses from the request parameters.
+
+    Open-ended requests (without end) get data until `today` + 2 days, like upstream returns
+    prices for tomorrow.
+    """
+
+    def __init__(self, today=date(2025, 10, 20)):
+        super().__init__()
+        self.today = today
+
+    def respond(self, url):
+        return 200, self._body(url), None
+
+    def send(self, request, **kwargs):
+        return _response(request, *self.respond(request.url))
+
+    def close(self):
+        pass
+
+    @functools.lru_cache(maxsize=256)
+    def _body(self, url):
+        parts = urlsplit(url)
+        params = dict(parse_qsl(parts.query))
+        dataset = parts.path.rsplit('/', 1)[-1]
+
+        if 'supplierlookup' in parts.path:
+            return json.dumps({'name': 'Elnetselskabet N1', 'def': '344'}).encode()
+        if dataset == 'DatahubPriceList':
+            return json.dumps({'records': self._tariffs(json.loads(params['filter']))}).encode()
+
+        start = date.fromisoformat(params['start'][:10])
+        end = date.fromisoformat(params['end'][:10]) if 'end' in params else self.today + timedelta(days=2)
+        priceArea = json.loads(params['filter'])['PriceArea']
+        base = 600 if priceArea == 'DK1' else 650
+
+        if dataset == 'DayAheadPrices':
+            records = [{
+                'TimeUTC': utc.isoformat(), 'TimeDK': dk.isoformat(), 'PriceArea': priceArea,
+                'DayAheadPriceDKK': _value(utc, base, 300), 'DayAheadPriceEUR': _value(utc, base / 7.46, 40),
+            } for utc, dk in _series(start, end, 15)]
+        elif dataset == 'elspotprices':
+            records = [{
+                'HourUTC': utc.isoformat(), 'HourDK': dk.isoformat(), 'PriceArea': priceArea,
+                'SpotPriceDKK': _value(utc, base, 300), 'SpotPriceEUR': _value(utc, base / 7.46, 40),
+            } for utc, dk in _series(start, end, 60)]
+        elif dataset == 'CO2EmisProg':
+            records = [{
+                'Minutes5UTC': utc.isoformat(), 'Minutes5DK': dk.isoformat(), 'PriceArea': priceArea,
+                'CO2Emission': float(int(_value(utc, 100, 60))),
+            } for utc, dk in _series(start, end, 5)]
+        else:
+            records = []
+
+        return json.dumps({'total': len(records), 'records': records}).encode()
+
+    def _tariffs(self, filter):
+        def record(validFrom, validTo, prices):
+            r = {
+                'ChargeOwner': 'Synthetic', 'GLN_Number': filter['GLN_Number'], 'ChargeType': 'D03',
+                'ChargeTypeCode': filter['ChargeTypeCode'], 'Note': 'Nettarif C', 'Description': '',
+                'ValidFrom': validFrom, 'ValidTo': validTo, 'VATClass': 'D02',
+            }
+            for i in range(1, 25):
+                r[f'Price{i}'] = prices[i - 1] if i <= len(prices) else None
+            return r
+
+        return [
+            record('2025-10-01T00:00:00', None, [0.1101] * 6 + [0.3303] * 11 + [0.991] * 4 + [0.3303] * 3),
+            record('2025-04-01T00:00:00', '2025-10-01T00:00:00', [0.0867] * 6 + [0.1301] * 11 + [0.3382] * 4 + [0.1301] * 3),
+            record('2023-01-01T00:00:00', '2025-04-01T00:00:00', [0.2724]),
+        ]
@@ -0,0 +1,114 @@
+"""
+Micro-benchmarks of the time series conversions on the request path, against the code they
+replaced.
+
+Each case times the current implementation and a reference copy of the baseline one on a month
+of synthetic upstream records, including the 25 hour day, in alternating runs, and reports the
+best of each.
+
+Usage:
+    python -m bench.micro
+    python -m bench.micro --number 20 --repeat 7
+"""
+import argparse
+import sys
+import timeit
+from datetime import date, datetime
+
+import pytz
+
+import timeaxis
+from app import align_co2emissions
+from bench.fixtures import _series
+
+WINDOW = (date(2025, 10, 1), date(2025, 10, 31))
+
+
+def baseline_align_co2emissions(co2records, timestamps):
+    """The per record fromisoformat loop that align_co2emissions replaced, for reference."""
+    records = []
+    curvalues = []
+    timestamps_idx = 0
+    curts = timestamps[timestamps_idx]
+    nextts = timestamps[timestamps_idx + 1]
+    for x in co2records:
+        xts = datetime.fromisoformat(x['Minutes5DK'])
+        if xts >= nextts:
+            if curvalues != []:
+                records += [{
+                        "TimeDK": curts.isoformat(),
+                        "CO2Emission": sum(curvalues) / len(curvalues)
+                    }]
+            timestamps_idx += 1
+            curts = timestamps[timestamps_idx]
+            if timestamps_idx + 1 >= len(timestamps):
+                break
+            nextts = timestamps[timestamps_idx + 1]
+            curvalues = []
+
+        curvalues += [x['CO2Emission']]
+
+    if curvalues != []:
+        records += [{
+                "TimeDK": curts.isoformat(),
+                "CO2Emission": sum(curvalues) / len(curvalues)
+            }]
+
+    return {
+        'records': records,
+        }
+
+
+def baseline_utc(timestamps):
+    """Localizing each timestamp with pytz, as the baseline converted to UTC, for reference."""
+    return [timeaxis.COPENHAGEN_TIMEZONE.localize(datetime.fromisoformat(ts)).astimezone(pytz.utc) for ts in timestamps]
+
+
+def cases():
+    """Returns {name: (current, baseline)} of the benchmarked calls."""
+    co2records = [{'Minutes5UTC': utc.isoformat(), 'Minutes5DK': dk.isoformat(), 'CO2Emission': float(i % 300)}
+                  for i, (utc, dk) in enumerate(_series(*WINDOW, 5))]
+    labels = [dk.isoformat() for _, dk in _series(*WINDOW, 15)]
+    minutes5 = [r['Minutes5DK'] for r in co2records]
+
+    return {
+        f'align_co2emissions ({len(co2records)} records)': (
+            lambda: align_co2emissions(co2records, labels),
+            # The baseline route parsed the slot timestamps before aligning
+            lambda: baseline_align_co2emissions(co2records, [datetime.fromisoformat(ts) for ts in labels]),
+        ),
+        f'utc_seconds ({len(minutes5)} timestamps)': (
+            lambda: timeaxis.utc_seconds(minutes5),
+            lambda: baseline_utc(minutes5),
+        ),
+    }
+
+
+def best(funcs, number, repeat):
+    """
+    Returns the best time in milliseconds of a call of each function, over repeat runs of number
+    calls. The runs of the functions alternate, so that they see the same machine load.
+    """
+    times = [[] for _ in funcs]
+    for _ in range(repeat):
+        for func, runs in zip(funcs, times):
+            runs.append(timeit.timeit(func, number=number))
+    return [min(runs) / number * 1000 for runs in times]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=10, help='calls per run')
+    parser.add_argument('--repeat', type=int, default=5, help='runs, of which the best is reported')
+    args = parser.parse_args(argv)
+
+    header = f"{'case':<40} {'ms':>9} {'baseline ms':>12} {'ratio':>7}"
+    print(header)
+    print('-' * len(header))
+    for name, (current, baseline) in cases().items():
+        ms, baseline_ms = best((current, baseline), args.number, args.repeat)
+        print(f"{name:<40} {ms:>9.2f} {baseline_ms:>12.2f} {ms / baseline_ms:>7.2f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
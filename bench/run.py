@@ -0,0 +1,200 @@
+"""
+Offline benchmark of the hot paths, replaying upstream responses instead of calling the live APIs.
+
+Measures latency (p50/p99), throughput and allocations per route, for a cold cache, a warm cache
+and the fallback_to_cache path where all upstreams fail. Results are written as JSON together
+with the git commit, so runs on different commits can be compared with --compare.
+
+Usage:
+    python -m bench.run                         # synthetic upstream data
+    python -m bench.run --record bench/fixtures # record live responses for the routes below
+    python -m bench.run --replay bench/fixtures # replay recorded responses
+    python -m bench.run --output new.json --compare old.json
+"""
+import argparse
+import contextlib
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import app
+from bench.fixtures import FailingAdapter, RecordingAdapter, ReplayAdapter, SyntheticAdapter, mount
+
+# Fixed dates, so recorded fixtures stay valid
+ROUTES = {
+    '/elpris': '/elpris?start=2025-10-01',
+    '/elpris-detaljer': '/elpris-detaljer?start=2025-10-01',
+    '/adresse/<address>': '/adresse/Sofiendalsvej 80, 9200 Aalborg',
+}
+
+SCENARIOS = ('cold', 'warm', 'fallback')
+
+
+def clear_caches():
+    app.cache.clear()
+    app._fallback_store.clear()
+    app._snapshots.clear()
+    app._address_store.clear()
+
+
+@contextlib.contextmanager
+def expired_addresses(expired=True):
+    """
+    Treats all stored address lookups as expired, so they are looked up again and only served
+    when the lookup API fails, as the address store is what lookups fall back on.
+    """
+    timeout = app._address_store.timeout
+    if expired:
+        app._address_store.timeout = 0
+    try:
+        yield
+    finally:
+        app._address_store.timeout = timeout
+
+
+def run_scenario(client, url, scenario, iterations, upstream_adapter):
+    """Returns the latencies in seconds of `iterations` requests to url in the given scenario."""
+    mount(upstream_adapter)
+    clear_caches()
+    # Prime the caches: the warm scenario serves from them, the fallback scenario falls back on them
+    response = client.get(url)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{url} failed with {response.status_code}, missing fixtures?')
+
+    if scenario == 'fallback':
+        mount(FailingAdapter())
+
+    latencies = []
+    with expired_addresses(scenario == 'fallback'):
+        for _ in range(iterations):
+            if scenario == 'cold':
+                clear_caches()
+            elif scenario == 'fallback':
+                app.cache.clear()
+
+            t0 = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - t0)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{url} failed with {response.status_code} in scenario {scenario}')
+
+    mount(upstream_adapter)
+    return latencies
+
+
+def measure_allocations(client, url, scenario, upstream_adapter):
+    """Returns (peak bytes, allocated bytes, allocated blocks) for one request in the scenario."""
+    mount(upstream_adapter)
+    clear_caches()
+    client.get(url)
+    if scenario == 'cold':
+        clear_caches()
+    elif scenario == 'fallback':
+        mount(FailingAdapter())
+        app.cache.clear()
+
+    with expired_addresses(scenario == 'fallback'):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        client.get(url)
+        after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    allocated = sum(s.size_diff for s in stats if s.size_diff > 0)
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0)
+    mount(upstream_adapter)
+    return peak, allocated, blocks
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def benchmark(upstream_adapter, iterations, routes=ROUTES, scenarios=SCENARIOS):
+    client = app.app.test_client()
+    results = {}
+    for scenario in scenarios:
+        for name, url in routes.items():
+            latencies = run_scenario(client, url, scenario, iterations, upstream_adapter)
+            peak, allocated, blocks = measure_allocations(client, url, scenario, upstream_adapter)
+            results.setdefault(scenario, {})[name] = {
+                'iterations': iterations,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'mean_ms': statistics.mean(latencies) * 1000,
+                'requests_per_second': len(latencies) / sum(latencies),
+                'peak_kib': peak / 1024,
+                'allocated_kib': allocated / 1024,
+                'allocated_blocks': blocks,
+            }
+    return results
+
+
+def print_results(results, previous=None):
+    header = f"{'scenario':<9} {'route':<20} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak KiB':>10} {'blocks':>9}"
+    print(header)
+    print('-' * len(header))
+    for scenario, routes in results.items():
+        for route, r in routes.items():
+            line = f"{scenario:<9} {route:<20} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['requests_per_second']:>9.1f} {r['peak_kib']:>10.0f} {r['allocated_blocks']:>9}"
+            old = previous and previous.get(scenario, {}).get(route)
+            if old:
+                line += f"   p50 {(r['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%, peak {(r['peak_kib'] / old['peak_kib'] - 1) * 100:+.0f}%"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--replay', metavar='DIR', help='replay upstream responses recorded in DIR')
+    source.add_argument('--record', metavar='DIR', help='record live upstream responses into DIR and exit')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', help='only run the given scenario(s)')
+    parser.add_argument('--output', metavar='FILE', help='write results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='compare with results from an earlier run')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        mount(RecordingAdapter(args.record))
+        clear_caches()
+        client = app.app.test_client()
+        for url in ROUTES.values():
+            print(url, client.get(url).status_code)
+        return
+
+    upstream_adapter = ReplayAdapter(args.replay) if args.replay else SyntheticAdapter()
+    results = benchmark(upstream_adapter, args.iterations, scenarios=args.scenario or SCENARIOS)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'upstream': 'replay' if args.replay else 'synthetic',
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
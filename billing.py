@@ -0,0 +1,238 @@
+"""
+Bill calculation for metered consumption.
+
+Consumption is read in bulk, from CSV or a compact binary format, into one array of kWh per
+customer, and joined with the PriceColumns of the window by UTC time. A year of hourly meter
+data for many customers is priced with a few passes over arrays, without a dict per hour.
+Like pricing.py it is independent of Flask.
+
+The binary format is a sequence of blocks, one per customer, little endian:
+
+    uint16   length of the customer id, followed by the id in UTF-8
+    int64    start of the first slot, in seconds since 1970-01-01T00:00 UTC
+    uint32   slot length in seconds, e.g. 3600, or 900 for quarter hourly meter data
+    uint32   number of slots, followed by one float32 per slot: kWh, or NaN if missing
+"""
+import csv
+import itertools
+import math
+import struct
+import sys
+from array import array
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import timeaxis
+from pricing import PriceColumns
+
+_BLOCK_HEADER = struct.Struct('<qII')
+_ID_LENGTH = struct.Struct('<H')
+
+# Longest series accepted per customer in the binary format: a leap year of quarter hours
+MAX_SLOTS = 366 * 24 * 4
+
+# Price components summed per bill, in DKK
+BILL_COLUMNS = (
+    'SpotPrice', 'ElAfgift', 'EnergiNetNetTarif', 'EnergiNetSystemTarif',
+    'NetselskabTarif', 'TotalExMoms', 'Moms', 'Total',
+)
+
+
+class ConsumptionError(ValueError):
+    """Malformed consumption data."""
+
+
+@dataclass
+class Consumption:
+    """Metered consumption of one customer."""
+    customer: str
+    # Start of each slot, in seconds since 1970-01-01T00:00 UTC. A range for regular series.
+    starts: Sequence[int]
+    # kWh per slot, NaN if missing
+    kWh: array
+
+
+@dataclass
+class Bill:
+    customer: str
+    # Consumption in slots with a price, and in slots without
+    kWh: float
+    unpricedKWh: float
+    # Cost per price component, see BILL_COLUMNS
+    costs: Dict[str, float]
+    # Total cost of each consumption slot, None if it has no price or consumption
+    cost: List[Optional[float]]
+
+
+def read_csv(lines: Iterable[str], max_customers: Optional[int] = None) -> List[Consumption]:
+    """
+    Reads consumption from CSV lines, as they arrive.
+
+    The header names the columns: `kWh`, the start of the slot as `HourUTC` or `TimeUTC` (UTC),
+    or as `HourDK` or `TimeDK` (Danish local time), and optionally `customer`. Columns may be
+    separated by semicolons, and then kWh may have a decimal comma. The rows of each customer
+    must be in chronological order, but customers may be interleaved.
+    """
+    lines = iter(lines)
+    header = next(lines, '')
+    delimiter = ';' if ';' in header else ','
+    reader = csv.reader(itertools.chain([header], lines), delimiter=delimiter)
+
+    columns = [c.strip() for c in next(reader, [])]
+    time_column = next((c for c in ('HourUTC', 'TimeUTC', 'HourDK', 'TimeDK') if c in columns), None)
+    if time_column is None or 'kWh' not in columns:
+        raise ConsumptionError('CSV header must name a kWh column and an HourUTC, TimeUTC, HourDK or TimeDK column')
+    time_i, kwh_i = columns.index(time_column), columns.index('kWh')
+    customer_i = columns.index('customer') if 'customer' in columns else None
+
+    series: Dict[str, Tuple[array, array]] = {}
+    for row in reader:
+        if not row:
+            continue
+        try:
+            customer = row[customer_i] if customer_i is not None else ''
+            start = timeaxis.local_seconds(row[time_i].strip())
+            value = row[kwh_i].strip().replace(',', '.') if delimiter == ';' else row[kwh_i].strip()
+            kWh = float(value) if value else math.nan
+        except (IndexError, ValueError):
+            raise ConsumptionError(f'Invalid consumption on line {reader.line_num}')
+
+        s = series.get(customer)
+        if s is None:
+            if max_customers is not None and len(series) >= max_customers:
+                raise ConsumptionError(f'At most {max_customers} customers per request')
+            s = series[customer] = (array('q'), array('d'))
+        s[0].append(start)
+        s[1].append(kWh)
+
+    consumptions = []
+    for customer, (starts, kWh) in series.items():
+        if time_column.endswith('DK'):
+            starts = array('q', timeaxis.local_to_utc(starts))
+        consumptions.append(Consumption(customer, starts, kWh))
+    return consumptions
+
+
+def _read_exactly(stream: BinaryIO, n: int) -> bytes:
+    data = b''
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def read_binary(stream: BinaryIO, max_customers: Optional[int] = None) -> List[Consumption]:
+    """Reads consumption in the binary format (see the module docstring) from a stream."""
+    consumptions = []
+    while True:
+        data = _read_exactly(stream, _ID_LENGTH.size)
+        if not data:
+            return consumptions
+        if max_customers is not None and len(consumptions) >= max_customers:
+            raise ConsumptionError(f'At most {max_customers} customers per request')
+
+        try:
+            length, = _ID_LENGTH.unpack(data)
+            customer = _read_exactly(stream, length).decode('utf-8')
+            start, interval, count = _BLOCK_HEADER.unpack(_read_exactly(stream, _BLOCK_HEADER.size))
+        except (struct.error, UnicodeDecodeError):
+            raise ConsumptionError(f'Truncated or invalid block {len(consumptions)}')
+        if interval == 0 or count > MAX_SLOTS:
+            raise ConsumptionError(f'Invalid slot length or count in block {len(consumptions)}')
+
+        values = array('f')
+        data = _read_exactly(stream, count * values.itemsize)
+        if len(data) != count * values.itemsize:
+            raise ConsumptionError(f'Truncated block {len(consumptions)}')
+        values.frombytes(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        consumptions.append(Consumption(customer, range(start, start + count * interval, interval), array('d', values)))
+
+
+def binary_block(customer: str, start: int, interval: int, kWh: Sequence[float]) -> bytes:
+    """Encodes the consumption of a customer as a block of the binary format."""
+    customer = customer.encode('utf-8')
+    values = array('f', kWh)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return _ID_LENGTH.pack(len(customer)) + customer + _BLOCK_HEADER.pack(start, interval, len(values)) + values.tobytes()
+
+
+def window_dates(consumptions: List[Consumption], interval: int = 3600) -> Tuple[date, date]:
+    """
+    Returns the Danish dates (start, end exclusive) of the pricing window covering the
+    consumption, given the length of its slots.
+    """
+    first = min(c.starts[0] for c in consumptions if len(c.starts))
+    last = max(c.starts[-1] for c in consumptions if len(c.starts)) + interval - 1
+    startDate = date.fromisoformat(timeaxis.format_seconds(timeaxis.utc_to_local(first))[:10])
+    endDate = date.fromisoformat(timeaxis.format_seconds(timeaxis.utc_to_local(last))[:10])
+    return startDate, endDate + timedelta(days=1)
+
+
+def slot_index(columns: PriceColumns) -> Dict[int, int]:
+    """
+    Returns the price slot by its start in UTC seconds. Computed once per window, shared by all bills.
+
+    A slot merging a repeated local time, like hour 02 of the hourly prices on the day DST ends,
+    starts at the UTC time of its standard time repetition, and also covers the earlier one.
+    """
+    starts = [timeaxis.local_seconds(ts) for ts in columns.TimeUTC]
+    local = [timeaxis.local_seconds(ts) for ts in columns.TimeDK]
+    index = {t: i for i, t in enumerate(starts)}
+    for i in range(1, len(starts)):
+        step = local[i] - local[i - 1]
+        # More UTC time than local time since the previous slot: the UTC times of the repetitions
+        # merged into this slot
+        extra = starts[i] - starts[i - 1] - step
+        if extra > 0 and step > 0:
+            for t in range(starts[i] - extra, starts[i], step):
+                index.setdefault(t, i)
+    return index
+
+
+def bill(columns: PriceColumns, consumption: Consumption, index: Optional[Dict[int, int]] = None, width: int = 3600) -> Bill:
+    """
+    Prices the consumption of a customer with the price columns of the window.
+
+    Each consumption slot is priced with the price slot containing its start, so consumption
+    slots must not be longer than the price slots, which are width seconds long (hourly for
+    /elpris). index is the slot_index() of the columns, to share it between customers.
+    """
+    if index is None:
+        index = slot_index(columns)
+    positions = array('q', [index.get(t - t % width, -1) for t in consumption.starts])
+
+    # The priced slots, as parallel arrays of price slot and kWh
+    slots, kWh = array('q'), array('d')
+    for s, k in zip(positions, consumption.kWh):
+        if s >= 0 and k == k:
+            slots.append(s)
+            kWh.append(k)
+
+    costs = {}
+    for name in BILL_COLUMNS:
+        column = getattr(columns, name)
+        costs[name] = math.fsum(column[s] * k for s, k in zip(slots, kWh))
+
+    total = columns.Total
+    cost = [total[s] * k if s >= 0 and k == k else None for s, k in zip(positions, consumption.kWh)]
+
+    priced = math.fsum(kWh)
+    return Bill(
+        customer=consumption.customer,
+        kWh=priced,
+        unpricedKWh=math.fsum(k for k in consumption.kWh if k == k) - priced,
+        costs=costs,
+        cost=cost,
+    )
+
+
+def bills(columns: PriceColumns, consumptions: List[Consumption], width: int = 3600) -> List[Bill]:
+    """Prices the consumption of each customer, see bill()."""
+    index = slot_index(columns)
+    return [bill(columns, c, index, width) for c in consumptions]
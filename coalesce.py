@@ -0,0 +1,165 @@
+"""
+Memoization with request coalescing (single-flight) and stale-while-revalidate.
+
+When a cached entry is missing, only one caller per key computes it and concurrent callers wait
+for its result: within a worker process through a shared future, and across worker processes
+through a lock entry in the cache, when the cache backend is shared. When an entry is past its
+timeout but within the stale timeout, callers get the stale value right away while one
+background refresh runs.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+import inspect
+import os
+import threading
+import time
+
+import metrics
+
+# Seconds between checks for the result of a computation in another worker process
+POLL_INTERVAL = 0.05
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cache-refresh')
+
+
+def _join(key):
+    """Returns (future, leader) for key, where leader is True if the caller must compute it."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future, False
+        future = _inflight[key] = Future()
+        return future, True
+
+
+def _fulfil(key, future, compute):
+    try:
+        future.set_result(compute())
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def memoize(cache, timeout, stale_timeout=0, lock_timeout=30):
+    """
+    Decorator like cache.memoize, with request coalescing and stale-while-revalidate.
+
+    The decorated function gets the attributes of a memoized function used elsewhere
+    (uncached, make_cache_key, cache_timeout), and:
+    - peek(*args): Returns (value, fresh) for the cached entry, or None if there is none.
+    - store(value, *args, timeout=None): Stores a value computed elsewhere as the entry.
+
+    Args:
+        cache: The Flask-Caching Cache to store entries in.
+        timeout: Seconds an entry is fresh.
+        stale_timeout: Seconds after that during which the stale entry is served while it is
+            refreshed in the background. 0 disables stale-while-revalidate.
+        lock_timeout: Maximum seconds to wait for a computation in another worker process.
+    """
+    def decorator(f):
+        name = f.__name__
+        prefix = f'coalesce:{f.__module__}.{f.__qualname__}:'
+        signature = inspect.signature(f)
+
+        def make_cache_key(_f, *args, **kwargs):
+            # Unlike cache.memoize keys, these do not depend on a version entry in the cache, which
+            # concurrent first callers would each create with a different random value. Arguments
+            # are bound to the signature, so f(a) and f(a, end=None) share their entry.
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return prefix + repr(tuple(bound.arguments.items()))
+
+        def store(key, value, fresh_for):
+            # Entries are (value, fresh until), kept for the stale timeout after that
+            cache.set(key, (value, time.time() + fresh_for), timeout=fresh_for + stale_timeout)
+
+        def compute(key, args, kwargs):
+            value = f(*args, **kwargs)
+            store(key, value, timeout)
+            return value
+
+        def compute_once(key, args, kwargs):
+            """Computes the entry, unless another worker process is already computing it."""
+            lock_key = key + ':lock'
+            if cache.add(lock_key, os.getpid(), timeout=lock_timeout):
+                try:
+                    return compute(key, args, kwargs)
+                finally:
+                    cache.delete(lock_key)
+
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                entry = cache.get(key)
+                if entry is not None:
+                    return entry[0]
+                if not cache.has(lock_key):
+                    # The other worker failed
+                    break
+            return compute(key, args, kwargs)
+
+        def refresh_in_background(key, args, kwargs):
+            future, leader = _join(key)
+            if not leader:
+                return
+
+            def revalidate():
+                lock_key = key + ':lock'
+                if not cache.add(lock_key, os.getpid(), timeout=lock_timeout):
+                    # Another worker process is refreshing it
+                    entry = cache.get(key)
+                    if entry is not None:
+                        return entry[0]
+                    return compute(key, args, kwargs)
+                try:
+                    return compute(key, args, kwargs)
+                except Exception as e:
+                    print(f"Warning: background refresh of {name} failed, serving stale result. Error: {e}")
+                    raise
+                finally:
+                    cache.delete(lock_key)
+
+            _refresh_executor.submit(_fulfil, key, future, revalidate)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = make_cache_key(f, *args, **kwargs)
+            entry = cache.get(key)
+            if entry is not None:
+                value, fresh_until = entry
+                if time.time() < fresh_until:
+                    metrics.coalesced_calls.inc(function=name, outcome='fresh')
+                else:
+                    metrics.coalesced_calls.inc(function=name, outcome='stale')
+                    refresh_in_background(key, args, kwargs)
+                return value
+
+            future, leader = _join(key)
+            if leader:
+                metrics.coalesced_calls.inc(function=name, outcome='leader')
+                _fulfil(key, future, lambda: compute_once(key, args, kwargs))
+            else:
+                metrics.coalesced_calls.inc(function=name, outcome='waiter')
+                metrics.record_coalesced_wait()
+            return future.result()
+
+        def peek(*args):
+            entry = cache.get(make_cache_key(f, *args))
+            if entry is None:
+                return None
+            return entry[0], time.time() < entry[1]
+
+        def store_value(value, *args, timeout=None):
+            store(make_cache_key(f, *args), value, timeout or wrapper.cache_timeout)
+
+        wrapper.uncached = f
+        wrapper.make_cache_key = make_cache_key
+        wrapper.cache_timeout = timeout
+        wrapper.peek = peek
+        wrapper.store = store_value
+        return wrapper
+    return decorator
@@ -0,0 +1,190 @@
+"""
+Storage backends for the fallback_to_cache decorator.
+
+LocalFallbackStore keeps results in the worker process. SharedFallbackStore keeps them in
+a cachelib backend (e.g. the FileSystemCache or RedisCache configured for Flask-Caching),
+so all workers share the last good results, and a freshly started worker can fall back
+on data another worker fetched.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+import pickle
+import threading
+import time
+from typing import Any, Optional
+
+# Returned by get() when no result is stored for the key
+MISSING = object()
+
+# Keys of results too large to keep that LocalFallbackStore remembers, so they are not measured again
+MAX_REJECTED_KEYS = 1024
+
+
+def entry_size(value) -> int:
+    """Returns the size in bytes of a result, as measured by its pickled size."""
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+@dataclass
+class _Entry:
+    value: Any
+    size: int
+    stored: float
+
+
+@dataclass
+class FallbackStats:
+    """Snapshot of a fallback store, see LocalFallbackStore.stats()."""
+    entries: int
+    bytes: int
+    max_bytes: int
+    # Seconds since the oldest and newest results were stored, None if empty
+    oldest_age: Optional[float]
+    newest_age: Optional[float]
+
+
+class LocalFallbackStore:
+    """
+    In-process LRU store, holding results of at most max_bytes in total, by the size of each
+    result as measured by entry_size(). Results larger than max_entry_bytes are not kept, so a
+    single huge response cannot push out all others, and their keys are remembered, so the
+    same result served from the cache is not pickled and rejected again on every call.
+    """
+
+    def __init__(self, max_bytes=64*1024*1024, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self._items = OrderedDict()
+        self._bytes = 0
+        # Size in bytes of the rejected results by key, least recently rejected first
+        self._rejected = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return MISSING
+            # Move to end (mark as recently used)
+            self._items.move_to_end(key)
+            return entry.value
+
+    def age(self, key) -> Optional[float]:
+        """Returns the seconds since the result for key was stored, or None if there is none."""
+        with self._lock:
+            entry = self._items.get(key)
+            return time.time() - entry.stored if entry else None
+
+    def touch(self, key) -> bool:
+        """
+        Marks the result for key as recently used, without replacing it. False if there is none,
+        unless it was rejected as too large.
+        """
+        with self._lock:
+            if key in self._rejected:
+                return True
+            if key not in self._items:
+                return False
+            self._items.move_to_end(key)
+            return True
+
+    def set(self, key, value):
+        # Measured outside the lock, as pickling a large response takes a while
+        size = entry_size(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            if size > self.max_entry_bytes:
+                if key not in self._rejected:
+                    print(f"Warning: result of {size} bytes is too large for the fallback store")
+                self._rejected[key] = size
+                self._rejected.move_to_end(key)
+                if len(self._rejected) > MAX_REJECTED_KEYS:
+                    self._rejected.popitem(last=False)
+                return
+            self._rejected.pop(key, None)
+            self._items[key] = _Entry(value, size, time.time())
+            self._bytes += size
+
+            # Evict least recently used items until the store fits
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._rejected.clear()
+            self._bytes = 0
+
+    def stats(self) -> FallbackStats:
+        now = time.time()
+        with self._lock:
+            stored = [e.stored for e in self._items.values()]
+            return FallbackStats(
+                entries=len(self._items),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                oldest_age=now - min(stored) if stored else None,
+                newest_age=now - max(stored) if stored else None,
+            )
+
+    def entries(self):
+        """Returns (key, size in bytes, age in seconds) of each result, least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [(key, e.size, now - e.stored) for key, e in self._items.items()]
+
+
+class SharedFallbackStore:
+    """
+    Store backed by a cachelib cache shared between workers.
+
+    Errors from the backend are swallowed, as the fallback store must never make a
+    request fail that would otherwise have succeeded.
+    """
+
+    def __init__(self, backend, timeout=7*24*60*60, prefix='fallback:'):
+        self.backend = backend
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def _key(self, key):
+        # Keys are tuples of normalized arguments, whose repr is the same in every worker
+        return self.prefix + (key if isinstance(key, str) else repr(key))
+
+    def _entry(self, key):
+        try:
+            # Results are stored as (result, time stored), so a stored None is distinguishable from a miss
+            return self.backend.get(self._key(key))
+        except Exception as e:
+            print(f"Warning: fallback store lookup failed. Error: {e}")
+            return None
+
+    def get(self, key):
+        entry = self._entry(key)
+        if entry is None:
+            return MISSING
+        return entry[0]
+
+    def age(self, key) -> Optional[float]:
+        entry = self._entry(key)
+        return time.time() - entry[1] if entry is not None and len(entry) > 1 else None
+
+    def touch(self, key) -> bool:
+        try:
+            return self.backend.has(self._key(key))
+        except Exception as e:
+            print(f"Warning: fallback store lookup failed. Error: {e}")
+            return False
+
+    def set(self, key, value):
+        try:
+            self.backend.set(self._key(key), (value, time.time()), timeout=self.timeout)
+        except Exception as e:
+            print(f"Warning: fallback store update failed. Error: {e}")
+
+    def stats(self) -> Optional[FallbackStats]:
+        """Not available, the backend cannot be enumerated."""
+        return None
@@ -0,0 +1,123 @@
+"""
+Schedule of the taxes and fees added to the spot price and the grid company tariff: elafgift,
+Energinet's net and system tariffs (https://energinet.dk/el/elmarkedet/tariffer/aktuelle-tariffer/)
+and moms.
+
+Rates are date-effective: each component has intervals [validFrom, validTo) of Danish dates with
+a rate, loaded from a data file (fees.json), so rate changes, also in the middle of a year, only
+need a data update. For pricing, the schedule is compiled into one rate per slot of a window.
+"""
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Components of the schedule, in DKK per kWh, except MomsRate, the VAT rate on the total
+COMPONENTS = ('ElAfgift', 'EnergiNetNetTarif', 'EnergiNetSystemTarif', 'MomsRate')
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fees.json')
+
+
+class MissingRateError(ValueError):
+    """A component of the schedule has no rate for a day."""
+
+
+@dataclass(frozen=True)
+class Interval:
+    # None for open ended intervals. validTo is exclusive.
+    validFrom: Optional[date]
+    validTo: Optional[date]
+    rate: float
+
+
+@dataclass
+class FeeColumns:
+    """The rates of a window, one per slot."""
+    ElAfgift: array
+    EnergiNetNetTarif: array
+    EnergiNetSystemTarif: array
+    MomsRate: array
+
+
+def _rate_at(intervals: List[Interval], day: date) -> Optional[float]:
+    for i in intervals:
+        if (i.validFrom is None or i.validFrom <= day) and (i.validTo is None or day < i.validTo):
+            return i.rate
+    return None
+
+
+class FeeSchedule:
+    """
+    Immutable schedule of the rates of all components. The interval boundaries of all components
+    are merged into one sorted list, with the rates of all components between each pair of
+    boundaries, so a day is looked up with a single bisect.
+    """
+
+    def __init__(self, intervals: Dict[str, List[Interval]]):
+        missing = set(COMPONENTS) - set(intervals)
+        if missing:
+            raise ValueError(f'No rates for {sorted(missing)}')
+        for component in COMPONENTS:
+            ordered = sorted(intervals[component], key=lambda i: i.validFrom or date.min)
+            for a, b in zip(ordered, ordered[1:]):
+                if a.validTo is None or (b.validFrom or date.min) < a.validTo:
+                    raise ValueError(f'Overlapping {component} rates from {a.validFrom} and {b.validFrom}')
+
+        self._bounds = sorted({d for c in COMPONENTS for i in intervals[c] for d in (i.validFrom, i.validTo) if d is not None})
+        self._rates = [
+            tuple(_rate_at(intervals[c], day) for c in COMPONENTS)
+            for day in [date.min] + self._bounds
+        ]
+
+    @classmethod
+    def load(cls, path: str) -> 'FeeSchedule':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls({
+            component: [
+                Interval(
+                    validFrom=i['validFrom'] and date.fromisoformat(i['validFrom']),
+                    validTo=i['validTo'] and date.fromisoformat(i['validTo']),
+                    rate=i['rate'],
+                )
+                for i in intervals
+            ]
+            for component, intervals in data.items()
+        })
+
+    def rates_for(self, day: date) -> Tuple[Optional[float], ...]:
+        """Returns the rates of COMPONENTS on day, None where a component has no rate."""
+        return self._rates[bisect_right(self._bounds, day)]
+
+    def compile(self, times_dk: Sequence[str]) -> FeeColumns:
+        """
+        Returns the rates for each slot of a window, given the Danish ISO timestamps of the slots.
+        Raises MissingRateError if a component has no rate for a slot.
+        """
+        # Rates only change per day, so look each day up once, then build the columns by index
+        per_day = {}
+        segments = array('q')
+        for time_dk in times_dk:
+            day = time_dk[:len('YYYY-MM-DD')]
+            segment = per_day.get(day)
+            if segment is None:
+                segment = per_day[day] = bisect_right(self._bounds, date.fromisoformat(day))
+                if None in self._rates[segment]:
+                    component = COMPONENTS[self._rates[segment].index(None)]
+                    raise MissingRateError(f'No {component} rate for {day}')
+            segments.append(segment)
+
+        return FeeColumns(*(
+            array('d', [rates[s] for s in segments])
+            for rates in ([r[i] for r in self._rates] for i in range(len(COMPONENTS)))
+        ))
+
+
+@lru_cache(maxsize=None)
+def default_schedule() -> FeeSchedule:
+    """Returns the schedule of the fees.json next to this module."""
+    return FeeSchedule.load(DEFAULT_FILE)
@@ -0,0 +1,71 @@
+"""
+Response formats for computed price columns.
+
+All formats are rendered from the same PriceColumns. Row formats (json, ndjson, csv) repeat
+the column names per record or once in a header, while the columnar formats (columns,
+msgpack) hold one array per column, which is much cheaper to produce and parse for long ranges.
+"""
+import csv
+from dataclasses import asdict
+import io
+import json
+from typing import Iterator
+
+import msgpack
+
+# Supported formats, by name as used in the `format` query parameter, with their mimetypes
+MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'columns': 'application/vnd.elpris.columns+json',
+    'csv': 'text/csv',
+    'msgpack': 'application/msgpack',
+}
+
+# Formats that are streamed, see app.price_response
+STREAMING = {'ndjson', 'csv'}
+
+
+def format_for_mimetype(mimetype):
+    return next((f for f, m in MIMETYPES.items() if m == mimetype), None)
+
+
+def column_dict(columns, time_dk_key, time_utc_key) -> dict:
+    """Returns the columns as a dict of lists, with the time columns named as given."""
+    out = {time_dk_key: columns.TimeDK, time_utc_key: columns.TimeUTC}
+    for name in columns.VALUE_COLUMNS:
+        out[name] = list(getattr(columns, name))
+    return out
+
+
+def render_columns_json(gridCompany, columns, time_dk_key, time_utc_key) -> str:
+    return json.dumps({
+        'gridCompany': asdict(gridCompany),
+        'columns': column_dict(columns, time_dk_key, time_utc_key),
+    }, separators=(',', ':'))
+
+
+def render_msgpack(gridCompany, columns, time_dk_key, time_utc_key) -> bytes:
+    return msgpack.packb({
+        'gridCompany': asdict(gridCompany),
+        'columns': column_dict(columns, time_dk_key, time_utc_key),
+    })
+
+
+def render_csv(columns, time_dk_key, time_utc_key, header=True) -> Iterator[str]:
+    """Yields a header line, unless header is false, and then one line per record."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    if header:
+        writer.writerow((time_dk_key, time_utc_key) + columns.VALUE_COLUMNS)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    value_columns = [getattr(columns, name) for name in columns.VALUE_COLUMNS]
+    for row in zip(columns.TimeDK, columns.TimeUTC, *value_columns):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
@@ -0,0 +1,116 @@
+"""
+Registry of the known grid companies, with their tariff (GLN_Number and ChargeTypeCode), grid
+company number and price area.
+
+The companies are loaded from a data file (gridcompanies.json), originally extracted by hand
+from https://www.energidataservice.dk/tso-electricity/DatahubPricelist, and indexed by GLN,
+grid company number and price area. The tariff codes can be refreshed from DatahubPriceList in
+the background, as grid companies occasionally replace them.
+"""
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime
+import json
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from snapshots import content_etag
+
+
+@dataclass(frozen=True)
+class GridCompany:
+    name: str
+    gln_Number: str
+    chargeTypeCode: str
+    gridCompanyNumber: str
+    priceArea: Optional[str] = "DK1"
+
+
+class GridCompanyRegistry:
+    """
+    Immutable set of grid companies with dict indexes. Some companies are listed once per grid
+    company number, sharing one GLN_Number; by_gln returns the first of them.
+    """
+
+    def __init__(self, companies: List[GridCompany]):
+        self.companies = list(companies)
+        self._by_gln: Dict[str, GridCompany] = {}
+        self._by_number: Dict[str, GridCompany] = {}
+        self._by_price_area: Dict[str, List[GridCompany]] = {}
+        for c in self.companies:
+            self._by_gln.setdefault(c.gln_Number, c)
+            self._by_number.setdefault(c.gridCompanyNumber, c)
+            self._by_price_area.setdefault(c.priceArea, []).append(c)
+
+        # The /gridcompanies response, serialized once, like Flask's jsonify
+        self.json = (json.dumps([asdict(c) for c in self.companies], sort_keys=True, separators=(',', ':')) + '\n').encode()
+        self.etag = content_etag(self.json)
+
+    @classmethod
+    def load(cls, path: str) -> 'GridCompanyRegistry':
+        with open(path, encoding='utf-8') as f:
+            return cls([GridCompany(**c) for c in json.load(f)])
+
+    def by_gln(self, gln_Number: str) -> Optional[GridCompany]:
+        return self._by_gln.get(gln_Number)
+
+    def by_number(self, gridCompanyNumber: str) -> Optional[GridCompany]:
+        return self._by_number.get(gridCompanyNumber)
+
+    def by_price_area(self, priceArea: str) -> List[GridCompany]:
+        return self._by_price_area.get(priceArea, [])
+
+    def tariffs(self) -> List[tuple]:
+        """Returns the distinct (gln_Number, chargeTypeCode) of the companies, in order."""
+        return list(dict.fromkeys((c.gln_Number, c.chargeTypeCode) for c in self.companies))
+
+    def with_current_tariffs(self, current_codes: Dict[str, Set[str]]) -> 'GridCompanyRegistry':
+        """
+        Returns a registry with the tariff codes updated from current_codes, the ChargeTypeCodes
+        of the currently valid tariffs by GLN_Number. A code that is no longer valid is only
+        replaced if the company has a single valid code, otherwise it is kept with a warning.
+        """
+        companies = []
+        for c in self.companies:
+            codes = current_codes.get(c.gln_Number)
+            if codes is None or c.chargeTypeCode in codes:
+                companies.append(c)
+            elif len(codes) == 1:
+                code, = codes
+                print(f"Grid company {c.name} changed tariff code from {c.chargeTypeCode} to {code}")
+                companies.append(replace(c, chargeTypeCode=code))
+            else:
+                print(f"Warning: tariff code {c.chargeTypeCode} of grid company {c.name} is no longer valid, candidates: {sorted(codes)}")
+                companies.append(c)
+
+        unknown = set(current_codes) - set(self._by_gln)
+        if unknown:
+            print(f"Grid companies not in the registry: {sorted(unknown)}")
+        return GridCompanyRegistry(companies)
+
+
+def current_tariff_codes(records: List[dict], now: Optional[datetime] = None) -> Dict[str, Set[str]]:
+    """Returns the ChargeTypeCodes by GLN_Number of DatahubPriceList records valid at now."""
+    now = now or datetime.now()
+    codes = {}
+    for r in records:
+        validFrom = datetime.fromisoformat(r['ValidFrom'])
+        validTo = r['ValidTo'] and datetime.fromisoformat(r['ValidTo'])
+        if validFrom <= now and (not validTo or now < validTo):
+            codes.setdefault(r['GLN_Number'], set()).add(r['ChargeTypeCode'])
+    return codes
+
+
+def start_refresh_thread(refresh: Callable[[], None], interval: int):
+    """Starts a daemon thread calling refresh() every interval seconds."""
+    def run():
+        while True:
+            try:
+                refresh()
+            except Exception as e:
+                print(f"Warning: grid company refresh failed. Error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='gridcompanies-refresh', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,57 @@
+"""
+Searches for the cheapest (or cleanest) slots of a price series, for load shifting: when to
+charge an EV or run a heat pump.
+
+Works on one value per slot, e.g. the Total or CO2Emission column of PriceColumns, restricted to
+the slots [lo, hi). Slots without a value (None) are never chosen.
+"""
+import heapq
+import math
+from array import array
+from typing import List, Optional, Sequence, Tuple
+
+
+def cheapest_block(values: Sequence[Optional[float]], n: int, lo: int = 0, hi: Optional[int] = None) -> Optional[Tuple[int, float]]:
+    """
+    Returns (start, average) of the n consecutive slots in [lo, hi) with the lowest sum, the
+    earliest of equally cheap ones, or None if there are no n consecutive slots with values.
+    Runs in one pass over prefix sums.
+    """
+    hi = len(values) if hi is None else hi
+    if n <= 0 or hi - lo < n:
+        return None
+
+    # Prefix sums and counts of the missing values, so each window is checked in O(1)
+    sums = array('d', [0.0])
+    missing = array('q', [0])
+    for v in values[lo:hi]:
+        sums.append(sums[-1] + (v if v is not None else 0.0))
+        missing.append(missing[-1] + (v is None))
+
+    best = None
+    best_sum = math.inf
+    for i in range(hi - lo - n + 1):
+        if missing[i + n] != missing[i]:
+            continue
+        total = sums[i + n] - sums[i]
+        if total < best_sum:
+            best, best_sum = i, total
+    if best is None:
+        return None
+    start = lo + best
+    return start, math.fsum(values[start:start + n]) / n
+
+
+def cheapest_slots(values: Sequence[Optional[float]], k: int, lo: int = 0, hi: Optional[int] = None) -> Optional[Tuple[List[int], float]]:
+    """
+    Returns (slots, average) of the k slots in [lo, hi) with the lowest values, in chronological
+    order, or None if fewer than k slots have values.
+    """
+    hi = len(values) if hi is None else hi
+    if k <= 0:
+        return None
+    candidates = ((values[i], i) for i in range(lo, hi) if values[i] is not None)
+    chosen = heapq.nsmallest(k, candidates)
+    if len(chosen) < k:
+        return None
+    return sorted(i for _, i in chosen), math.fsum(v for v, _ in chosen) / k
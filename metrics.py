@@ -0,0 +1,198 @@
+"""
+Minimal Prometheus-style metrics: counters, gauges, histograms and timing spans.
+
+Metrics are kept per worker process and rendered in the Prometheus text exposition format by
+render(), which app.py serves on /metrics. Spans time a block of code into the
+span_duration_seconds histogram, labelled with the span name.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_local = threading.local()
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(tuple(labels[n] for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: [count per bucket (non-cumulative, last is +Inf), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        i = next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels[n] for n in self.labelnames))
+        return entry[2] if entry else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, c in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += c
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", bound)])} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Gauge:
+    """A value read when rendered, from a function returning a number, or None to leave it out."""
+
+    def __init__(self, name, help, function):
+        self.name = name
+        self.help = help
+        self.function = function
+        _registry.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        value = self.function()
+        if value is not None:
+            lines.append(f'{self.name} {value}')
+        return lines
+
+
+span_duration = Histogram('span_duration_seconds', 'Duration of instrumented pipeline stages', ['span'])
+
+upstream_request_duration = Histogram('upstream_request_duration_seconds', 'Duration of upstream HTTP requests', ['upstream'])
+upstream_requests = Counter('upstream_requests_total', 'Upstream HTTP requests by response status', ['upstream', 'status'])
+
+cache_calls = Counter(
+    'cache_calls_total',
+    'Calls of cached upstream functions by outcome: hit (served from cache), miss (fetched upstream), '
+    'fallback (upstream failed, served last good result) or error (upstream failed, nothing cached)',
+    ['function', 'outcome'])
+cache_call_duration = Histogram('cache_call_duration_seconds', 'Duration of calls of cached upstream functions', ['function', 'outcome'])
+
+coalesced_calls = Counter(
+    'cache_coalesced_calls_total',
+    'Calls of coalesced cached functions by outcome: fresh, stale (served while refreshing in the '
+    'background), leader (computed the entry) or waiter (waited for another caller computing it)',
+    ['function', 'outcome'])
+
+prefetch_refreshes = Counter('prefetch_refreshes_total', 'Cache entries refreshed by the prefetcher', ['function', 'outcome'])
+
+http_request_duration = Histogram('http_request_duration_seconds', 'Duration of HTTP requests by route', ['route', 'status'])
+
+
+@contextmanager
+def span(name):
+    """Times the enclosed block into span_duration_seconds{span=name}."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_duration.observe(time.perf_counter() - t0, span=name)
+
+
+def timed(name):
+    """Decorator timing every call of the function as a span."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_chunks(name, chunks):
+    """
+    Yields the items of each iterable in chunks, timing their production as one span, e.g. the
+    rendering of a streamed response. Producing the iterables themselves, and the time the
+    consumer takes between items, are not part of the span.
+    """
+    elapsed = 0.0
+    try:
+        for chunk in chunks:
+            items = iter(chunk)
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - t0
+                yield item
+    finally:
+        span_duration.observe(elapsed, span=name)
+
+
+def record_upstream_request():
+    """Notes that the current thread made an upstream request, see upstream_requests_in_thread."""
+    _local.upstream_requests = getattr(_local, 'upstream_requests', 0) + 1
+
+
+def upstream_requests_in_thread():
+    """Number of upstream requests made by the current thread so far."""
+    return getattr(_local, 'upstream_requests', 0)
+
+
+def record_coalesced_wait():
+    """Notes that the current thread waited for another caller's computation, see coalesce."""
+    _local.coalesced_waits = getattr(_local, 'coalesced_waits', 0) + 1
+
+
+def coalesced_waits_in_thread():
+    """Number of times the current thread waited for another caller's computation so far."""
+    return getattr(_local, 'coalesced_waits', 0)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
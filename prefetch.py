@@ -0,0 +1,129 @@
+"""
+Background prefetching of the upstream data most requests need.
+
+Day-ahead prices are published once a day around 13:00 Danish time, when every client polls for
+tomorrow's prices at once. The prefetcher refreshes the cached entries ahead of expiry on a fixed
+cadence, and more often around publication, so user requests are served from the cache instead
+of paying for the upstream fetch.
+"""
+from datetime import datetime, time as dtime, timedelta
+import os
+import threading
+import time
+
+import metrics
+import timeaxis
+
+
+class Job:
+    """Refreshes func(*args) every `every` seconds, or at the prefetcher's cadence if None."""
+
+    def __init__(self, func, args, every=None):
+        self.func = func
+        self.args = tuple(args)
+        self.every = every
+
+    def __repr__(self):
+        return f'{self.func.__name__}{self.args!r}'
+
+
+class Prefetcher:
+    """
+    Runs refresh jobs on a cadence.
+
+    Args:
+        cache: The Flask-Caching Cache used for the lease, so only one worker process prefetches
+            at a time when the cache is shared between workers.
+        refresh: Function called as refresh(func, *args, timeout=...) to recompute and store an entry.
+        jobs: Function returning the list of Jobs for a given Danish date.
+        interval: Seconds between runs.
+        publication_time: Danish local time at which day-ahead prices are published.
+        publication_window: Seconds from 15 minutes before publication_time during which
+            publication_interval is used instead of interval.
+        publication_interval: Seconds between runs around publication.
+        after_run: Function called as after_run(max_age) after a run that refreshed entries,
+            with the number of seconds until they are refreshed again at the latest.
+    """
+
+    LEASE_KEY = 'prefetch-lease'
+
+    def __init__(self, cache, refresh, jobs, interval=5*60, publication_time=dtime(13, 0),
+                 publication_window=75*60, publication_interval=60, after_run=None):
+        self.cache = cache
+        self.refresh = refresh
+        self.jobs = jobs
+        self.interval = interval
+        self.publication_time = publication_time
+        self.publication_window = publication_window
+        self.publication_interval = publication_interval
+        self.after_run = after_run
+        self._last_refresh = {}
+
+    def _window_start(self, now):
+        start = datetime.combine(now.date(), self.publication_time) - timedelta(minutes=15)
+        return timeaxis.COPENHAGEN_TIMEZONE.localize(start)
+
+    def cadence(self, now):
+        """Returns the seconds between runs at `now`, a timezone aware datetime."""
+        start = self._window_start(now)
+        if start <= now < start + timedelta(seconds=self.publication_window):
+            return self.publication_interval
+        return self.interval
+
+    def next_delay(self, now):
+        """Returns the seconds until the next run, waking up for the publication window and midnight."""
+        delay = self.cadence(now)
+        start = self._window_start(now)
+        midnight = timeaxis.COPENHAGEN_TIMEZONE.localize(datetime.combine(now.date() + timedelta(days=1), dtime()))
+        for wakeup in (start, midnight):
+            if now < wakeup:
+                delay = min(delay, (wakeup - now).total_seconds() + 1)
+        return max(delay, 1)
+
+    def run_once(self, now=None):
+        """Refreshes the due jobs, if this worker gets the lease. Returns the number refreshed."""
+        now = now or datetime.now(timeaxis.COPENHAGEN_TIMEZONE)
+        cadence = self.cadence(now)
+        if not self.cache.add(self.LEASE_KEY, os.getpid(), timeout=max(1, int(cadence) - 1)):
+            # Another worker is prefetching into the shared cache
+            return 0
+
+        refreshed = 0
+        max_age = 2 * max(self.interval, cadence)
+        for job in self.jobs(now.date()):
+            every = job.every or cadence
+            key = (job.func.__name__, job.args)
+            last = self._last_refresh.get(key)
+            if last is not None and (now - last).total_seconds() < every:
+                continue
+
+            # Keep entries until well after the next refresh, also when the cadence slows down
+            # after publication, so they never expire in between
+            timeout = max(job.func.cache_timeout or 0, 2 * job.every if job.every else max_age)
+            try:
+                self.refresh(job.func, *job.args, timeout=timeout)
+                self._last_refresh[key] = now
+                refreshed += 1
+                metrics.prefetch_refreshes.inc(function=job.func.__name__, outcome='ok')
+            except Exception as e:
+                metrics.prefetch_refreshes.inc(function=job.func.__name__, outcome='error')
+                print(f"Warning: prefetch of {job!r} failed. Error: {e}")
+
+        if refreshed and self.after_run:
+            self.after_run(max_age)
+        return refreshed
+
+    def run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Warning: prefetch run failed. Error: {e}")
+            time.sleep(self.next_delay(datetime.now(timeaxis.COPENHAGEN_TIMEZONE)))
+
+
+def start_prefetch_thread(prefetcher: Prefetcher):
+    """Starts a daemon thread running the prefetcher."""
+    thread = threading.Thread(target=prefetcher.run, name='prefetch', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,108 @@
+"""
+Batched electricity price computation.
+
+Works on aligned columns for a whole pricing window (one slot per hour or quarter of an hour)
+instead of one dict per row, and is independent of Flask, so it can be used as a library.
+Rendering to records is kept separate, see PriceColumns.records().
+"""
+from array import array
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterator, List, Optional, Sequence
+
+from fees import FeeSchedule, default_schedule
+
+
+@dataclass
+class PriceColumns:
+    """Aligned price components for a window, all in DKK per kWh."""
+    TimeDK: List[str]
+    TimeUTC: List[str]
+    SpotPrice: array
+    ElAfgift: array
+    EnergiNetNetTarif: array
+    EnergiNetSystemTarif: array
+    NetselskabTarif: array
+    CO2Emission: List[Optional[float]]
+    TotalExMoms: array
+    Moms: array
+    Total: array
+
+    # Output columns in record order, after the two time columns
+    VALUE_COLUMNS = (
+        'SpotPrice', 'ElAfgift', 'EnergiNetNetTarif', 'EnergiNetSystemTarif',
+        'NetselskabTarif', 'CO2Emission', 'TotalExMoms', 'Moms', 'Total',
+    )
+
+    def __len__(self):
+        return len(self.TimeDK)
+
+    def records(self, time_dk_key='TimeDK', time_utc_key='TimeUTC') -> Iterator[dict]:
+        """Yields one dict per slot, with the time columns named as given."""
+        columns = [getattr(self, name) for name in self.VALUE_COLUMNS]
+        for time_dk, time_utc, *values in zip(self.TimeDK, self.TimeUTC, *columns):
+            record = {time_dk_key: time_dk, time_utc_key: time_utc}
+            record.update(zip(self.VALUE_COLUMNS, values))
+            yield record
+
+
+def compute_price_columns(
+        times_dk: Sequence[str],
+        times_utc: Sequence[str],
+        spot_dkk_per_mwh: Sequence[float],
+        tariff_index,
+        tariff_slots: Sequence[int],
+        co2: Sequence[Optional[float]] = (),
+        fees: Optional[FeeSchedule] = None) -> PriceColumns:
+    """
+    Computes all price components and totals for a window.
+
+    Args:
+        times_dk: Danish ISO timestamps of the slots.
+        times_utc: UTC ISO timestamps of the slots.
+        spot_dkk_per_mwh: Spot price per slot, in DKK per MWh.
+        tariff_index: TariffIndex of the grid company.
+        tariff_slots: Index (0-23) into the grid company's hourly tariffs for each slot.
+        co2: CO2 emission per slot. Shorter series are padded with None.
+        fees: FeeSchedule of the taxes and fees, by default that of fees.json.
+
+    Returns:
+        The PriceColumns for the window.
+    """
+    n = len(times_dk)
+
+    fee_columns = (fees or default_schedule()).compile(times_dk)
+
+    # Tariffs only change per day, so look them up once per day rather than per slot
+    per_day = {}
+    netselskab = array('d')
+    for time_dk, slot in zip(times_dk, tariff_slots):
+        day = time_dk[:len('YYYY-MM-DD')]
+        prices = per_day.get(day)
+        if prices is None:
+            prices = per_day[day] = tariff_index.prices_for(date.fromisoformat(day))
+        netselskab.append(prices[slot])
+
+    elafgifter, nettarifs, systemtarifs = fee_columns.ElAfgift, fee_columns.EnergiNetNetTarif, fee_columns.EnergiNetSystemTarif
+    spot = array('d', [p / 1000.0 for p in spot_dkk_per_mwh]) # MWh to KWh
+    total_ex_moms = array('d', [s + a + nt + st + t for s, a, nt, st, t in zip(spot, elafgifter, nettarifs, systemtarifs, netselskab)])
+    vat = array('d', [t * r for t, r in zip(total_ex_moms, fee_columns.MomsRate)])
+    total = array('d', [t + v for t, v in zip(total_ex_moms, vat)])
+
+    co2 = [c or None for c in co2[:n]]
+    co2 += [None] * (n - len(co2))
+
+    return PriceColumns(
+        TimeDK=list(times_dk),
+        TimeUTC=list(times_utc),
+        SpotPrice=spot,
+        ElAfgift=elafgifter,
+        EnergiNetNetTarif=nettarifs,
+        EnergiNetSystemTarif=systemtarifs,
+        NetselskabTarif=netselskab,
+        CO2Emission=co2,
+        TotalExMoms=total_ex_moms,
+        Moms=vat,
+        Total=total,
+    )
+
@@ -0,0 +1,136 @@
+"""
+Resampling of time series into buckets, e.g. 5 minute CO2 emissions or 15 minute prices into
+hours.
+
+Timestamps are given as integer keys (see timeaxis.local_seconds) and buckets by their sorted
+start keys. Values are reduced in a single pass into compact arrays, one accumulator per bucket,
+so a series is never split into per-bucket lists.
+"""
+from array import array
+from bisect import bisect_left
+from typing import List, Optional, Sequence
+
+import timeaxis
+from pricing import PriceColumns
+
+REDUCERS = ('mean', 'min', 'max', 'sum')
+
+# Bucket widths in seconds of the supported resolutions. Days are Danish calendar days, which
+# is what flooring local seconds gives, also for the 23 and 25 hour days.
+RESOLUTIONS = {
+    '15min': 15*60,
+    'hour': 60*60,
+    'day': 24*60*60,
+}
+
+
+def bucket_starts(keys: Sequence[int], width: int) -> array:
+    """Returns the start keys of the buckets of the given width that keys fall into, in order."""
+    starts = array('q')
+    last = None
+    for key in keys:
+        start = key - key % width
+        if start != last:
+            starts.append(start)
+            last = start
+    return starts
+
+
+def resample(keys: Sequence[int], values: Sequence[Optional[float]], starts: Sequence[int],
+             reducer: str = 'mean', end: Optional[int] = None) -> List[Optional[float]]:
+    """
+    Reduces values into the buckets [starts[i], starts[i+1]) and [starts[-1], end).
+
+    Args:
+        keys: Key of each value, in ascending order of bucket. Keys before the first bucket or
+            from end on are ignored.
+        values: The values. None values are ignored.
+        starts: Start keys of the buckets, ascending.
+        reducer: One of REDUCERS.
+        end: End key of the last bucket, or None if it is open-ended.
+
+    Returns:
+        The reduced value per bucket, None for buckets without values.
+    """
+    if reducer not in REDUCERS:
+        raise ValueError(f'Unknown reducer {reducer}')
+
+    n = len(starts)
+    acc = array('d', bytes(8 * n))
+    counts = array('q', bytes(8 * n))
+    if n == 0:
+        return []
+
+    # Sorted keys, e.g. in UTC, are bucketed with bisection instead of one by one
+    if list(keys) == sorted(keys):
+        return _resample_sorted(keys, values, starts, reducer, end)
+
+    i = 0
+    first = starts[0]
+    nextstart = starts[1] if n > 1 else end
+    for key, value in zip(keys, values):
+        if key < first or value is None:
+            continue
+        while nextstart is not None and key >= nextstart:
+            i += 1
+            if i >= n:
+                break
+            nextstart = starts[i + 1] if i + 1 < n else end
+        if i >= n:
+            break
+
+        if counts[i] == 0:
+            acc[i] = value
+        elif reducer == 'min':
+            if value < acc[i]:
+                acc[i] = value
+        elif reducer == 'max':
+            if value > acc[i]:
+                acc[i] = value
+        else:
+            acc[i] += value
+        counts[i] += 1
+
+    if reducer == 'mean':
+        return [a / c if c else None for a, c in zip(acc, counts)]
+    return [a if c else None for a, c in zip(acc, counts)]
+
+
+def _resample_sorted(keys, values, starts, reducer, end):
+    """resample() of sorted keys, reducing the values of each bucket as a slice."""
+    bounds = [bisect_left(keys, start) for start in starts]
+    bounds.append(len(keys) if end is None else bisect_left(keys, end))
+    reduce = min if reducer == 'min' else max if reducer == 'max' else sum
+    has_none = None in values
+
+    reduced = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        bucket = values[lo:hi]
+        if has_none:
+            bucket = [v for v in bucket if v is not None]
+        if not bucket:
+            reduced.append(None)
+        elif reducer == 'mean':
+            reduced.append(sum(bucket) / len(bucket))
+        else:
+            reduced.append(float(reduce(bucket)))
+    return reduced
+
+
+def resample_price_columns(columns: PriceColumns, resolution: str) -> PriceColumns:
+    """
+    Averages price columns into buckets of the given resolution (see RESOLUTIONS). Columns
+    that are already as coarse or coarser are returned unchanged, as they are never interpolated.
+    """
+    width = RESOLUTIONS[resolution]
+    keys = [timeaxis.local_seconds(ts) for ts in columns.TimeDK]
+    starts = bucket_starts(keys, width)
+    if len(starts) == len(keys):
+        return columns
+
+    times_dk = [timeaxis.format_seconds(start) for start in starts]
+    resampled = {}
+    for name in PriceColumns.VALUE_COLUMNS:
+        values = resample(keys, getattr(columns, name), starts)
+        resampled[name] = values if name == 'CO2Emission' else array('d', values)
+    return PriceColumns(TimeDK=times_dk, TimeUTC=timeaxis.copenhagen_to_utc(times_dk), **resampled)
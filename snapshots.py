@@ -0,0 +1,76 @@
+"""
+Precomputed responses ("snapshots") for the most requested price windows.
+
+Most requests are for today's or tomorrow's prices of one of the known grid companies, which are
+the same bytes for every client until the upstream data changes. Snapshots keep the serialized
+response body with a content hash ETag and the time the content last changed, so these requests
+are answered without computing or serializing anything, or with 304 Not Modified.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import hashlib
+import threading
+import time
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    body: bytes
+    mimetype: str
+    etag: str
+    # When the content last changed, for Last-Modified
+    last_modified: datetime
+    # time.monotonic() after which the snapshot is rebuilt
+    expires: float
+
+
+def content_etag(body: bytes) -> str:
+    """Returns a strong ETag value (without quotes) for the given content."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class SnapshotStore:
+    """
+    In-process store of snapshots by key, as small as the number of grid companies times the
+    number of days and formats served from it.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the snapshot for key, or None if there is none or it has expired."""
+        snapshot = self._snapshots.get(key)
+        if snapshot is None or time.monotonic() >= snapshot.expires:
+            return None
+        return snapshot
+
+    def put(self, key, body: bytes, mimetype: str, max_age: float) -> Snapshot:
+        """
+        Stores body as the snapshot for key, valid for max_age seconds. The ETag and
+        Last-Modified stay the same if the content did not change since the previous snapshot.
+        """
+        etag = content_etag(body)
+        with self._lock:
+            previous = self._snapshots.get(key)
+            if previous is not None and previous.etag == etag:
+                last_modified = previous.last_modified
+            else:
+                last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            snapshot = self._snapshots[key] = Snapshot(body, mimetype, etag, last_modified, time.monotonic() + max_age)
+        return snapshot
+
+    def keys(self):
+        return list(self._snapshots)
+
+    def discard(self, key):
+        with self._lock:
+            self._snapshots.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+    def __len__(self):
+        return len(self._snapshots)
@@ -0,0 +1,28 @@
+"""
+Base of the SQLite-backed stores, timeseries.TimeSeriesStore and addresses.AddressStore.
+"""
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Store in the SQLite database at path, created with the given schema if it does not exist.
+
+    Each thread gets its own connection and the database runs in WAL mode, so a store is safe
+    to use from several threads and worker processes.
+    """
+
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(schema)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
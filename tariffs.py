@@ -0,0 +1,95 @@
+"""
+Precompiled lookup of grid company tariffs from DatahubPriceList records.
+
+The raw records are validity intervals with 24 hourly prices each. They are compiled once
+into sorted, non-overlapping segments, so the tariff for a given date is found with a binary
+search instead of scanning (and re-parsing) every record.
+"""
+from bisect import bisect_right
+from datetime import datetime
+import heapq
+from typing import List, Optional, Tuple
+
+
+def _hourly_prices(record) -> Tuple[float, ...]:
+    #compensate for potentially missing prices, use Price1
+    price1 = record['Price1']
+    return tuple(record[f'Price{i}'] or price1 for i in range(1, 25))
+
+
+class TariffIndex:
+    """
+    Index over the tariff records of one (GLN_Number, ChargeTypeCode).
+
+    Where validity intervals overlap, the record with the latest ValidFrom wins (ties go to the
+    record listed first upstream), so a new tariff supersedes an older open-ended one. A record
+    with ValidTo set to None is valid indefinitely.
+    """
+
+    def __init__(self, records: List[dict]):
+        self._records = []
+        self._prices = []
+        parsed = []
+        for i, r in enumerate(records):
+            validFrom = datetime.fromisoformat(r['ValidFrom'])
+            validTo = r['ValidTo'] and datetime.fromisoformat(r['ValidTo']) or None
+            self._records.append(r)
+            self._prices.append(_hourly_prices(r))
+            parsed.append((validFrom, validTo, i))
+
+        # Sweep over all interval boundaries, keeping the active records in a heap ordered by
+        # latest ValidFrom, and record which one wins for each elementary segment
+        boundaries = sorted({p[0] for p in parsed} | {p[1] for p in parsed if p[1] is not None})
+        by_start = sorted(parsed, key=lambda p: p[0])
+        active = []
+        j = 0
+        self._starts: List[datetime] = []
+        self._winners: List[Optional[int]] = []
+        for b in boundaries:
+            while j < len(by_start) and by_start[j][0] <= b:
+                validFrom, validTo, i = by_start[j]
+                heapq.heappush(active, (datetime.min - validFrom, i, validTo))
+                j += 1
+            while active and active[0][2] is not None and active[0][2] <= b:
+                heapq.heappop(active)
+
+            winner = active[0][1] if active else None
+            if not self._winners or self._winners[-1] != winner:
+                self._starts.append(b)
+                self._winners.append(winner)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _lookup(self, when) -> Optional[int]:
+        when = datetime.combine(when, datetime.min.time())
+        k = bisect_right(self._starts, when) - 1
+        if k < 0:
+            return None
+        return self._winners[k]
+
+    def prices_for(self, when) -> Optional[Tuple[float, ...]]:
+        """
+        Returns the 24 hourly prices valid on the date of `when`, or None if no tariff is known.
+
+        Missing hourly prices are filled in with Price1, as energidataservice omits them for
+        tariffs that are flat over the day.
+        """
+        i = self._lookup(when)
+        return None if i is None else self._prices[i]
+
+    def record_for(self, when) -> Optional[dict]:
+        """
+        Returns a copy of the tariff record valid on the date of `when`, with ValidFrom/ValidTo
+        parsed to datetimes and missing hourly prices filled in. The cached records are not modified.
+        """
+        i = self._lookup(when)
+        if i is None:
+            return None
+
+        record = dict(self._records[i])
+        record['ValidFrom'] = datetime.fromisoformat(record['ValidFrom'])
+        record['ValidTo'] = record['ValidTo'] and datetime.fromisoformat(record['ValidTo']) or None
+        for hour, price in enumerate(self._prices[i]):
+            record[f'Price{hour + 1}'] = price
+        return record
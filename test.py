@@ -7,7 +7,24 @@ from flask import Flask, jsonify
 import json
 from pprint import pprint
 import requests
+import threading
+import cachelib
+import pytz
+import io
+import os
+import tempfile
+import msgpack
+import asyncio
+import httpx
 import app
+import pricing
+import resample
+import loadshift
+import billing
+import fees
+import fallbackstore
+import asgi
+from bench.fixtures import FailingAdapter, SyntheticAdapter, async_transport, mount
 
 class TestApp(unittest.TestCase):
     def setUp(self):
@@ -44,7 +61,7 @@ class TestApp(unittest.TestCase):
         self.assertGreater(len(dayaheadprices_success['records']), 0)
 
         # Mock requests.get to simulate API failure
-        with patch('app.requests.get') as mock_get:
+        with patch('app.upstream.get') as mock_get:
             # Simulate HTTP error (e.g., 503 Service Unavailable)
             mock_response = mock_get.return_value
             mock_response.status_code = 503
@@ -58,7 +75,7 @@ class TestApp(unittest.TestCase):
             self.assertEqual(dayaheadprices_success, dayaheadprices_cached)
 
         # Verify that without cache, the same mock would raise an exception
-        with patch('app.requests.get') as mock_get:
+        with patch('app.upstream.get') as mock_get:
             mock_response = mock_get.return_value
             mock_response.status_code = 503
             mock_response.raise_for_status.side_effect = requests.HTTPError("503 Service Unavailable")
@@ -68,6 +85,155 @@ class TestApp(unittest.TestCase):
             with self.assertRaises(requests.HTTPError):
                 app.get_dayahead_prices(different_date, "DK1")
 
+    def test_fallback_cache_shared_store(self):
+        """Test that fallback results stored by one worker are available to another"""
+        backend = cachelib.SimpleCache()
+        calls = []
+
+        @app.fallback_to_cache
+        def fetch(key):
+            calls.append(key)
+            if len(calls) > 1:
+                raise requests.HTTPError("503 Service Unavailable")
+            return {'records': [key]}
+
+        with patch.object(app, '_fallback_store', app.SharedFallbackStore(backend)):
+            self.assertEqual(fetch('a'), {'records': ['a']})
+
+        # A fresh store on the same backend, as in another worker process
+        with patch.object(app, '_fallback_store', app.SharedFallbackStore(backend)):
+            self.assertEqual(fetch('a'), {'records': ['a']})
+            with self.assertRaises(requests.HTTPError):
+                fetch('b')
+
+    def test_fallback_store_bounds(self):
+        """Test that the fallback store is bounded by bytes, with normalized keys and stats"""
+        value = {'records': ['x' * 1000]}
+        size = fallbackstore.entry_size(value)
+        store = app.LocalFallbackStore(max_bytes=3 * size, max_entry_bytes=2 * size)
+        for key in 'abcd':
+            store.set(key, value)
+        self.assertIs(store.get('a'), app.MISSING)
+        self.assertEqual(store.get('b'), value)
+        store.set('e', {'records': ['x' * 3000]})
+        self.assertIs(store.get('e'), app.MISSING)
+
+        stats = store.stats()
+        self.assertEqual((stats.entries, stats.bytes, stats.max_bytes), (3, 3 * size, 3 * size))
+        self.assertGreaterEqual(stats.oldest_age, stats.newest_age)
+        # Least recently used first, after the lookup of b
+        self.assertEqual([key for key, _, _ in store.entries()], ['c', 'd', 'b'])
+
+        def fetch(start, priceArea, end=None):
+            pass
+        self.assertEqual(app._fallback_cache_key(fetch, (datetime.date(2025, 10, 1), ['DK1']), {}),
+                         app._fallback_cache_key(fetch, (datetime.date(2025, 10, 1), ('DK1',)), {}))
+        self.assertNotEqual(app._fallback_cache_key(fetch, ('2025-10-01', 'DK1'), {}),
+                            app._fallback_cache_key(fetch, ('2025-10-01', 'DK1'), {'end': None}))
+
+        # Results served from the cache are not measured and stored again
+        calls = []
+        @app.fallback_to_cache
+        def cached(key):
+            return calls.append(key) or {'records': [key]}
+        with patch.object(app, '_fallback_store', app.LocalFallbackStore()) as local:
+            cached('a')
+            with patch.object(local, 'set') as set_:
+                cached('a')
+            set_.assert_not_called()
+            self.assertEqual(app.fallback_store_stats().entries, 1)
+            self.assertIn('fallback_store_entries 1', self.app.get('/metrics').text)
+
+        # Nor are results rejected as too large
+        with patch.object(app, '_fallback_store', app.LocalFallbackStore(max_bytes=3 * size, max_entry_bytes=size)):
+            with patch.object(fallbackstore, 'entry_size', wraps=fallbackstore.entry_size) as measure:
+                cached('x' * 2000)
+                cached('x' * 2000)
+            self.assertEqual(measure.call_count, 1)
+            self.assertEqual(app.fallback_store_stats().entries, 0)
+
+    def test_fetch_concurrently(self):
+        """Test that independent fetches are issued concurrently"""
+        barrier = threading.Barrier(3, timeout=5)
+
+        def fetch(name):
+            # Only passes if all three fetches are in flight at the same time
+            barrier.wait()
+            return name
+
+        def failing_fetch():
+            barrier.wait()
+            raise requests.HTTPError("503 Service Unavailable")
+
+        fetches = app.fetch_concurrently(
+            a=(fetch, 'a'),
+            b=(fetch, 'b'),
+            c=(failing_fetch,),
+        )
+
+        self.assertEqual(fetches['a'].result(), 'a')
+        self.assertEqual(fetches['b'].result(), 'b')
+        with self.assertRaises(requests.HTTPError):
+            fetches['c'].result()
+
+    def test_upstream_session_pooling(self):
+        """Test that upstream requests share one pooled session per host"""
+        session = app.upstream.session_for('api.energidataservice.dk')
+        self.assertIs(session, app.upstream.session_for('api.energidataservice.dk'))
+        self.assertIsNot(session, app.upstream.session_for('api.elnet.greenpowerdenmark.dk'))
+        self.assertTrue(session.verify.endswith('energidataservice.pem'))
+
+        adapter = session.get_adapter('https://api.energidataservice.dk/dataset/DayAheadPrices')
+        self.assertEqual(adapter._pool_maxsize, app.upstream.POOL_SIZE)
+        self.assertEqual(adapter.max_retries.total, app.upstream.RETRIES)
+
+    def test_timeseries_store_read_through(self):
+        """Test that historic days are served from the local store and only the open tail is fetched"""
+        today = app.today_copenhagen()
+        fetches = []
+        dropped = set()
+
+        def fetch(start, priceArea, end=None):
+            fetches.append((start, end))
+            end = end or today + datetime.timedelta(days=2)
+            first, last = app.timeaxis.utc_seconds([start.isoformat(), end.isoformat()])
+            records = [{
+                'TimeUTC': app.timeaxis.format_seconds(t),
+                'TimeDK': app.timeaxis.format_seconds(app.timeaxis.utc_to_local(t)),
+                'Price': 1.0,
+            } for t in range(first, last, 3600)]
+            return {'records': [r for r in records if r['TimeDK'] not in dropped]}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = app.TimeSeriesStore(os.path.join(tmpdir, 'timeseries.db'))
+            start = today - datetime.timedelta(days=5)
+
+            first = store.read_through('DayAheadPrices', 'TimeDK', fetch, start, 'DK1')
+            self.assertEqual(fetches, [(start, None)])
+            self.assertEqual(first['records'][0]['TimeDK'], start.isoformat() + 'T00:00:00')
+
+            second = store.read_through('DayAheadPrices', 'TimeDK', fetch, start, 'DK1')
+            self.assertEqual(fetches[1:], [(today, None)])
+            self.assertEqual(second, first)
+
+            historic = store.read_through('DayAheadPrices', 'TimeDK', fetch, start, 'DK1', today - datetime.timedelta(days=1))
+            self.assertEqual(len(fetches), 2)
+            self.assertEqual(historic['records'], [r for r in first['records'] if r['TimeDK'] < (today - datetime.timedelta(days=1)).isoformat()])
+
+            self.assertEqual(store.missing_days('DayAheadPrices', 'DK2', start, today), [start + datetime.timedelta(days=i) for i in range(5)])
+
+            # A day published only partly is fetched again, until it is settled
+            partial = today - datetime.timedelta(days=3)
+            dropped.add(partial.isoformat() + 'T23:00:00')
+            store.read_through('CO2EmisProg', 'TimeDK', fetch, start, 'DK1', today)
+            self.assertEqual(store.missing_days('CO2EmisProg', 'DK1', start, today), [partial])
+            store.read_through('CO2EmisProg', 'TimeDK', fetch, start, 'DK1', today)
+            self.assertEqual(fetches[-1], (start, today))
+
+            store.settle_days = 2
+            store.read_through('CO2EmisProg', 'TimeDK', fetch, start, 'DK1', today)
+            self.assertEqual(store.missing_days('CO2EmisProg', 'DK1', start, today), [])
+
     def test_co2emissions(self):
         startDate = app.date_from_reqparam("2024-02-23")
         co2emissions = app.get_co2emissions(startDate, "DK1")
@@ -99,7 +265,7 @@ class TestApp(unittest.TestCase):
             timestamps.append(current_time)
             current_time += datetime.timedelta(minutes=15)
 
-        co2emissions = app.get_co2emissions_aligned_to_timeseries(startDate, "DK1", timestamps, endDate)
+        co2emissions = app.align_co2emissions(app.get_co2emissions(startDate, "DK1", endDate)['records'], timestamps)
 
         rec0 = co2emissions['records'][0]
         self.assertEqual(rec0['TimeDK'], '2025-09-20T00:00:00')
@@ -113,8 +279,30 @@ class TestApp(unittest.TestCase):
         self.assertEqual(rec95['TimeDK'], '2025-09-20T23:45:00')
         #self.assertEqual(rec95['CO2Emission'], (121+121+118)/3)
 
+    def test_timeaxis(self):
+        """Test the DST transition table against pytz, around the 23 and 25 hour days"""
+        import pytz
+        import timeaxis
+        copenhagen = pytz.timezone('Europe/Copenhagen')
+        timestamps = []
+        for year in range(2000, 2037):
+            for month, day in ((3, 24), (10, 24)):
+                start = datetime.datetime(year, month, day)
+                timestamps += [start + datetime.timedelta(minutes=30*i) for i in range(8*48)]
+        expected = [copenhagen.localize(ts).astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%S') for ts in timestamps]
+
+        self.assertEqual(timeaxis.copenhagen_to_utc([ts.isoformat() for ts in timestamps]), expected)
+        self.assertEqual(timeaxis.copenhagen_to_utc(['2025-03-30T03', '2025-10-26T02', '1990-07-01T12']),
+                         ['2025-03-30T01:00:00', '2025-10-26T01:00:00', '1990-07-01T10:00:00'])
+
+        marks = [ts.isoformat() for ts in timestamps[:8*48]]
+        self.assertEqual(timeaxis.grid_seconds(marks, 30*60), timeaxis.local_seconds_series(marks))
+        # A gap and a repeated mark spanning the same time as a gapless series
+        irregular = marks[:10] + marks[11:20] + marks[19:]
+        self.assertEqual(timeaxis.grid_seconds(irregular, 30*60), timeaxis.local_seconds_series(irregular))
+
     def test_get_tariffs(self):
-        gridCompany = app.gridCompanies[0]
+        gridCompany = app.registry.companies[0]
         self.assertEqual(gridCompany.name, "N1 A/S")
         self.assertEqual(gridCompany.gridCompanyNumber, "344")
 
@@ -155,7 +343,7 @@ class TestApp(unittest.TestCase):
         self.assertEqual(tariffs['Price24'], 0.3303)
 
     def test_get_tariffs_only1hour(self):
-        gridCompany = next(c for c in app.gridCompanies if c.name == 'Elinord A/S')
+        gridCompany = next(c for c in app.registry.companies if c.name == 'Elinord A/S')
 
         startDate = app.date_from_reqparam("2024-02-23")
         gln_Number = gridCompany.gln_Number
@@ -193,6 +381,170 @@ class TestApp(unittest.TestCase):
         self.assertEqual(tariffs['Price23'], 0.2724)
         self.assertEqual(tariffs['Price24'], 0.2724)
 
+    def test_tariff_index(self):
+        """Test tariff lookup with overlapping and open-ended validity intervals"""
+        def record(validFrom, validTo, price1, price7=None):
+            r = {'ValidFrom': validFrom, 'ValidTo': validTo, 'Price1': price1}
+            for i in range(2, 25):
+                r[f'Price{i}'] = None
+            r['Price7'] = price7
+            return r
+
+        records = [
+            record('2025-01-01T00:00:00', None, 0.3),
+            record('2024-01-01T00:00:00', '2025-01-01T00:00:00', 0.1, 0.2),
+            record('2024-06-01T00:00:00', '2024-07-01T00:00:00', 0.5),
+        ]
+        index = app.TariffIndex(records)
+
+        self.assertIsNone(index.prices_for(datetime.date(2023, 12, 31)))
+        self.assertEqual(index.prices_for(datetime.date(2024, 2, 1))[0], 0.1)
+        self.assertEqual(index.prices_for(datetime.datetime(2024, 2, 1, 13))[6], 0.2)
+        self.assertEqual(index.prices_for(datetime.date(2024, 6, 15))[6], 0.5)
+        self.assertEqual(index.prices_for(datetime.date(2024, 7, 1))[6], 0.2)
+        self.assertEqual(index.prices_for(datetime.date(2030, 1, 1))[23], 0.3)
+
+        tariffs = index.record_for(datetime.date(2030, 1, 1))
+        self.assertEqual(tariffs['ValidFrom'], datetime.datetime(2025, 1, 1, 0, 0))
+        self.assertIsNone(tariffs['ValidTo'])
+        self.assertEqual(tariffs['Price24'], 0.3)
+
+        # The source records are left untouched
+        self.assertEqual(records[0]['ValidFrom'], '2025-01-01T00:00:00')
+        self.assertIsNone(records[0]['Price24'])
+
+    def test_compute_price_columns(self):
+        """Test the batched pricing engine against the per-row arithmetic"""
+        tariffs = {'ValidFrom': '2025-01-01T00:00:00', 'ValidTo': None, 'Price1': 0.1}
+        tariffs.update({f'Price{i}': 0.1 + i / 100 for i in range(2, 25)})
+        index = app.TariffIndex([tariffs])
+
+        columns = app.compute_price_columns(
+            ['2025-07-23T00:00:00', '2025-07-23T01:00:00', '2026-01-01T23:00:00'],
+            ['2025-07-22T22:00:00', '2025-07-22T23:00:00', '2026-01-01T22:00:00'],
+            [567.2868, 522.501, -10.0],
+            index,
+            [0, 1, 23],
+            [9.833333333333334, 0.0],
+        )
+
+        self.assertEqual(len(columns), 3)
+        records = list(columns.records('HourDK', 'HourUTC'))
+        self.assertEqual(records[0]['HourDK'], '2025-07-23T00:00:00')
+        self.assertEqual(records[0]['CO2Emission'], 9.833333333333334)
+        self.assertIsNone(records[1]['CO2Emission'])
+        self.assertIsNone(records[2]['CO2Emission'])
+        self.assertEqual(records[1]['NetselskabTarif'], 0.1 + 2 / 100)
+        self.assertEqual(records[2]['NetselskabTarif'], 0.1 + 24 / 100)
+        self.assertEqual(records[2]['ElAfgift'], 0.008)
+
+        for r in records:
+            totalExMoms = r['SpotPrice'] + r['ElAfgift'] + \
+                    r['EnergiNetNetTarif'] + r['EnergiNetSystemTarif'] + \
+                    r['NetselskabTarif']
+            self.assertEqual(r['TotalExMoms'], totalExMoms)
+            self.assertEqual(r['Moms'], totalExMoms * 0.25)
+            self.assertEqual(r['Total'], totalExMoms + totalExMoms * 0.25)
+
+    def test_fee_schedule(self):
+        """Test date-effective rates, also changing within a window, and their validation"""
+        schedule = fees.default_schedule()
+        self.assertEqual(schedule.rates_for(datetime.date(2025, 12, 31)), (0.720, 0.061, 0.074, 0.25))
+        self.assertEqual(schedule.rates_for(datetime.date(2026, 1, 1)), (0.008, 0.043, 0.072, 0.25))
+        with self.assertRaises(ValueError):
+            schedule.compile(['2023-12-31T23:00:00'])
+
+        rates = {c: [fees.Interval(None, None, 0.1)] for c in fees.COMPONENTS}
+        rates['ElAfgift'] = [
+            fees.Interval(None, datetime.date(2026, 7, 1), 0.5),
+            fees.Interval(datetime.date(2026, 7, 1), None, 0.2),
+        ]
+        columns = fees.FeeSchedule(rates).compile(['2026-06-30T22:00:00', '2026-06-30T23:00:00', '2026-07-01T00:00:00'])
+        self.assertEqual(list(columns.ElAfgift), [0.5, 0.5, 0.2])
+        self.assertEqual(list(columns.MomsRate), [0.1] * 3)
+
+        rates['ElAfgift'].append(fees.Interval(datetime.date(2026, 12, 1), datetime.date(2027, 1, 1), 0.3))
+        with self.assertRaises(ValueError):
+            fees.FeeSchedule(rates)
+
+    def test_formats(self):
+        """Test that the columnar and CSV formats hold the same values as the records"""
+        tariffs = {'ValidFrom': '2025-01-01T00:00:00', 'ValidTo': None, 'Price1': 0.1}
+        tariffs.update({f'Price{i}': None for i in range(2, 25)})
+        columns = app.compute_price_columns(
+            ['2025-07-23T00:00:00', '2025-07-23T01:00:00'],
+            ['2025-07-22T22:00:00', '2025-07-22T23:00:00'],
+            [567.2868, 522.501],
+            app.TariffIndex([tariffs]),
+            [0, 1],
+            [9.833333333333334],
+        )
+        records = list(columns.records('HourDK', 'HourUTC'))
+        gridCompany = app.registry.companies[0]
+
+        unpacked = msgpack.unpackb(app.formats.render_msgpack(gridCompany, columns, 'HourDK', 'HourUTC'))
+        self.assertEqual(unpacked['gridCompany']['gln_Number'], gridCompany.gln_Number)
+        self.assertEqual(unpacked['columns']['HourDK'], [r['HourDK'] for r in records])
+        self.assertEqual(unpacked['columns']['Total'], [r['Total'] for r in records])
+        self.assertEqual(unpacked['columns']['CO2Emission'], [9.833333333333334, None])
+
+        parsed = json.loads(app.formats.render_columns_json(gridCompany, columns, 'HourDK', 'HourUTC'))
+        self.assertEqual(parsed['columns'], unpacked['columns'])
+
+        lines = ''.join(app.formats.render_csv(columns, 'HourDK', 'HourUTC')).splitlines()
+        self.assertEqual(len(lines), 3)
+        header = lines[0].split(',')
+        row = dict(zip(header, lines[1].split(',')))
+        self.assertEqual(row['HourDK'], '2025-07-23T00:00:00')
+        self.assertEqual(float(row['Total']), records[0]['Total'])
+
+    def test_csv_empty_window(self):
+        """Test that CSV of a window without prices still has the header line"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        try:
+            response = self.app.get('/elpris?start=2030-01-01&format=csv')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data.decode().splitlines(), [','.join(('HourDK', 'HourUTC') + pricing.PriceColumns.VALUE_COLUMNS)])
+
+    def test_streamed_chunks(self):
+        """Test that streamed ranges are fetched, priced and rendered a month at a time as they are sent"""
+        requested = []
+
+        class RecordingAdapter(SyntheticAdapter):
+            def respond(self, url):
+                requested.append(url)
+                return super().respond(url)
+
+        app.cache.clear()
+        mount(RecordingAdapter())
+        renders = app.metrics.span_duration.count(span='render')
+        try:
+            response = self.app.get('/elpris?GLN_Number=5790001089375&start=2025-01-15&end=2025-04-15&format=csv', buffered=False)
+            requested_before_body = len(requested)
+            rendered_before_body = app.metrics.span_duration.count(span='render')
+            lines = response.get_data(as_text=True).splitlines()
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(rendered_before_body, renders)
+        self.assertEqual(app.metrics.span_duration.count(span='render'), renders + 1)
+        # Only January is fetched before the body is sent, February to April while sending it
+        self.assertLess(requested_before_body, len(requested))
+        self.assertEqual(lines[0], ','.join(('HourDK', 'HourUTC') + pricing.PriceColumns.VALUE_COLUMNS))
+        self.assertEqual(lines.count(lines[0]), 1)
+        hours = [line.split(',')[0] for line in lines[1:]]
+        self.assertEqual(len(hours), len(set(hours)))
+        self.assertEqual(hours[0], '2025-01-15T00:00:00')
+        self.assertEqual(hours[-1], '2025-04-14T23:00:00')
+        self.assertEqual(len(hours), 90 * 24 - 1)
+
     def test_get_info_for_address1(self):
         address = "Ringstedgade 66, 4000 Roskilde"
         info = app.get_info_for_address(address)
@@ -207,6 +559,62 @@ class TestApp(unittest.TestCase):
         self.assertEqual(info['name'], 'Elnetselskabet N1')
         self.assertEqual(info['def'], '344')
 
+    def test_address_batch(self):
+        """Test that differently written addresses are looked up upstream once"""
+        app.cache.clear()
+        app._address_store.clear()
+        mount(SyntheticAdapter())
+        lookups = app.metrics.upstream_request_duration.count(upstream='supplierlookup')
+        try:
+            response = self.app.post('/adresse-batch', json={'addresses': [
+                'Sofiendalsvej 80, 9200 Aalborg',
+                ' sofiendalsvej  80,9200 AALBORG SV',
+                'Sofiendalsvej 80, DK-9200 Aalborg, Danmark',
+                'x' * 101,
+            ]})
+            invalid = self.app.post('/adresse-batch', json=['Sofiendalsvej 80, 9200 Aalborg'])
+            cached_keys = list(app.cache.cache._cache)
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json['results']
+        self.assertEqual([r['address'] for r in results[:2]], ['Sofiendalsvej 80, 9200 Aalborg', ' sofiendalsvej  80,9200 AALBORG SV'])
+        self.assertEqual({r['gridCompany']['gln_Number'] for r in results[:3]}, {'5790000611003'})
+        self.assertEqual(results[3]['error'], 'Address too long')
+        self.assertEqual(app.metrics.upstream_request_duration.count(upstream='supplierlookup'), lookups + 1)
+        self.assertEqual(invalid.status_code, 400)
+        # Lookups are kept only in the address store, apart from the cached price data, which they
+        # would otherwise evict
+        self.assertIsNotNone(app._address_store.get('sofiendalsvej 80, 9200'))
+        self.assertEqual(cached_keys, [])
+
+    def test_address_store(self):
+        """Test that address lookups persist in the SQLite store"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'addresses.db')
+            app.AddressStore(path, timeout=60).set('sofiendalsvej 80, 9200', {'def': '344'})
+
+            self.assertEqual(app.AddressStore(path, timeout=60).get('sofiendalsvej 80, 9200'), {'def': '344'})
+            self.assertIsNone(app.AddressStore(path, timeout=0).get('sofiendalsvej 80, 9200'))
+            self.assertEqual(app.AddressStore(path, timeout=0).get('sofiendalsvej 80, 9200', stale=True), {'def': '344'})
+
+    def test_address_store_fallback(self):
+        """Test that expired address lookups are returned when the lookup API fails"""
+        store = app.CacheAddressStore(cachelib.SimpleCache(), timeout=0)
+        store.set('sofiendalsvej 80, 9200', {'def': '344'})
+        self.assertIsNone(store.get('sofiendalsvej 80, 9200'))
+
+        mount(FailingAdapter())
+        try:
+            with patch.object(app, '_address_store', store):
+                self.assertEqual(app.get_info_for_address('Sofiendalsvej 80, 9200 Aalborg'), {'def': '344'})
+                with self.assertRaises(requests.RequestException):
+                    app.get_info_for_address('Sofiendalsvej 81, 9200 Aalborg')
+        finally:
+            app.upstream.close_sessions()
+
     def test_mainroute(self):
         response = self.app.get('/elpris?start=2025-07-23')
 
@@ -226,6 +634,485 @@ class TestApp(unittest.TestCase):
         self.assertEqual(hour1['NetselskabTarif'], 0.0867)
         self.assertEqual(hour1['Total'], 1.8302512499999999)
 
+    def test_mainroute_ndjson(self):
+        response = self.app.get('/elpris?start=2025-07-23&format=ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+
+        lines = response.get_data(as_text=True).splitlines()
+        hour0 = json.loads(lines[0])
+        self.assertEqual(hour0['HourDK'], '2025-07-23T00:00:00')
+        self.assertEqual(hour0['Total'], 1.8862335)
+        self.assertEqual(json.loads(lines[1])['HourDK'], '2025-07-23T01:00:00')
+
+    def test_batchroute(self):
+        response = self.app.get('/elpris-batch?start=2025-07-23&GLN_Number=5790000611003,5790001089375')
+
+        self.assertEqual(response.status_code, 200)
+
+        results = response.json['results']
+        self.assertEqual([r['gridCompany']['gln_Number'] for r in results], ['5790000611003', '5790001089375'])
+
+        hour0 = results[0]['records'][0]
+        self.assertEqual(hour0['HourDK'], '2025-07-23T00:00:00')
+        self.assertEqual(hour0['Total'], 1.8862335)
+
+    def test_batchroute_pricearea(self):
+        response = self.app.get('/elpris-batch?PriceArea=DK2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(r['gridCompany']['priceArea'] == 'DK2' for r in response.json['results']))
+
+    def test_mainroute_range(self):
+        response = self.app.get('/elpris?start=2024-09-15&end=2024-10-15')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['records']), 30*24)
+        self.assertEqual(response.json['records'][0]['HourDK'], '2024-09-15T00:00:00')
+        self.assertEqual(response.json['records'][-1]['HourDK'], '2024-10-14T23:00:00')
+
+        hour1 = response.json['records'][15*24+6]
+        self.assertEqual(hour1['HourDK'], '2024-09-30T06:00:00')
+        self.assertEqual(hour1['NetselskabTarif'], 0.1652)
+
+    def test_mainroute_invalid_range(self):
+        response = self.app.get('/elpris?start=2024-09-15&end=2024-09-15')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.app.get('/elpris?start=2020-01-01&end=2024-01-01')
+        self.assertEqual(response.status_code, 400)
+
+    def test_month_chunks(self):
+        chunks = app.month_chunks(datetime.date(2024, 11, 15), datetime.date(2025, 2, 1))
+        self.assertEqual(chunks, [
+            (datetime.date(2024, 11, 1), datetime.date(2024, 12, 1)),
+            (datetime.date(2024, 12, 1), datetime.date(2025, 1, 1)),
+            (datetime.date(2025, 1, 1), datetime.date(2025, 2, 1)),
+        ])
+
+    def test_mainroute_synthetic_upstream(self):
+        """Test the main route offline, against the benchmark's synthetic upstream"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        try:
+            response = self.app.get('/elpris?start=2025-10-01')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        # 2025-10-26 has 25 hours, but the two hours 02 are averaged into one
+        self.assertEqual(len(response.json['records']), 30*24)
+
+        hour7 = response.json['records'][7]
+        self.assertEqual(hour7['HourDK'], '2025-10-01T07:00:00')
+        self.assertEqual(hour7['NetselskabTarif'], 0.3303)
+        self.assertEqual(hour7['Total'], hour7['TotalExMoms'] + hour7['Moms'])
+
+    def test_mainroute_tariff_slots_dst(self):
+        """Test that tariffs follow the Danish hour of day after the 23 and 25 hour days"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        try:
+            march = self.app.get('/elpris?start=2026-03-28&end=2026-04-01').json['records']
+            october = self.app.get('/elpris?start=2025-10-25&end=2025-10-29').json['records']
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        for records in (march, october):
+            tariffs = {}
+            for r in records:
+                tariffs.setdefault(r['HourDK'][11:13], set()).add(r['NetselskabTarif'])
+            self.assertTrue(all(len(t) == 1 for t in tariffs.values()), tariffs)
+        self.assertEqual(len(march), 4*24 - 1)
+        self.assertEqual(march[7]['NetselskabTarif'], march[-24 + 7]['NetselskabTarif'])
+
+    def test_resample(self):
+        """Test the reducers, empty and bounded buckets"""
+        keys = [0, 300, 600, 1800, 2100, 4000]
+        values = [1.0, 2.0, None, 6.0, 4.0, 9.0]
+        starts = [0, 900, 1800, 3600]
+
+        self.assertEqual(resample.resample(keys, values, starts, 'mean'), [1.5, None, 5.0, 9.0])
+        self.assertEqual(resample.resample(keys, values, starts, 'min', end=3900), [1.0, None, 4.0, None])
+        self.assertEqual(resample.resample(keys, values, starts, 'max'), [2.0, None, 6.0, 9.0])
+        self.assertEqual(resample.resample(keys, values, starts, 'sum'), [3.0, None, 10.0, 9.0])
+        self.assertEqual(list(resample.bucket_starts(keys, 1800)), [0, 1800, 3600])
+        # Unsorted keys, like the local times of a 25 hour day, only need to be in bucket order
+        self.assertEqual(resample.resample([300, 0, 600, 2100, 1800, 4000], [2.0, 1.0, None, 4.0, 6.0, 9.0], starts, 'mean'),
+                         [1.5, None, 5.0, 9.0])
+
+    def test_mainroute_resolution(self):
+        """Test the resolution parameter against the synthetic upstream"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        try:
+            quarters = self.app.get('/elpris-detaljer?start=2025-10-25&end=2025-10-28')
+            hours = self.app.get('/elpris-detaljer?start=2025-10-25&end=2025-10-28&resolution=hour')
+            days = self.app.get('/elpris?start=2025-10-25&end=2025-10-28&resolution=day')
+            invalid = self.app.get('/elpris?resolution=week')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(hours.status_code, 200)
+        # The 25 hour day has its hour 02 averaged into one
+        self.assertEqual(len(hours.json['records']), 3*24)
+        hour = hours.json['records'][13]
+        self.assertEqual(hour['TimeDK'], '2025-10-25T13:00:00')
+        self.assertEqual(hour['TimeUTC'], '2025-10-25T11:00:00')
+        self.assertAlmostEqual(hour['SpotPrice'], sum(r['SpotPrice'] for r in quarters.json['records'][52:56]) / 4)
+
+        self.assertEqual([r['HourDK'] for r in days.json['records']],
+                         ['2025-10-25T00:00:00', '2025-10-26T00:00:00', '2025-10-27T00:00:00'])
+        self.assertEqual(days.json['records'][1]['HourUTC'], '2025-10-25T22:00:00')
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_loadshift(self):
+        """Test the cheapest block and slots, skipping missing values"""
+        values = [5.0, 1.0, 2.0, None, 0.5, 0.5, 3.0, 1.0]
+
+        self.assertEqual(loadshift.cheapest_block(values, 2), (4, 0.5))
+        self.assertEqual(loadshift.cheapest_block(values, 3), (4, 4/3))
+        self.assertEqual(loadshift.cheapest_block(values, 2, 0, 4), (1, 1.5))
+        self.assertIsNone(loadshift.cheapest_block(values, 5, 4))
+        self.assertEqual(loadshift.cheapest_slots(values, 3), ([1, 4, 5], 2/3))
+        self.assertIsNone(loadshift.cheapest_slots(values, 3, 3, 5))
+
+    def test_cheapest_route(self):
+        """Test that the cheapest block of hours before a deadline matches the price series"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        try:
+            query = 'GLN_Number=5790000611003&start=2025-10-20&end=2025-10-22'
+            prices = self.app.get('/elpris?' + query).json['records']
+            response = self.app.get('/elpris-billigst?' + query + '&hours=3&after=2025-10-20T06:30&before=2025-10-21T07:00')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json['results'][0]
+        # Hours from 06:00 (ending after 06:30) to 06:00 the next day (ending by 07:00)
+        candidates = [(sum(r['Total'] for r in prices[i:i + 3]), i) for i in range(6, 31 - 3 + 1)]
+        best = min(candidates)[1]
+        self.assertEqual(result['HourDK'], [r['HourDK'] for r in prices[best:best + 3]])
+        self.assertAlmostEqual(result['Total'], min(candidates)[0] / 3)
+
+    def test_billing(self):
+        """Test reading consumption from CSV and binary, and pricing it per slot"""
+        csv_lines = [
+            'customer;HourDK;kWh\n',
+            'a;2025-10-26T01:00;1,5\n',
+            'b;2025-10-26T02:00;2\n',
+            'a;2025-10-26T02:00;0,5\n',
+            'a;2025-10-26T02:00;\n',
+        ]
+        a, b = billing.read_csv(csv_lines)
+        self.assertEqual(a.customer, 'a')
+        # The repeated hour 02 is told apart by order
+        self.assertEqual(list(a.starts), [1761433200, 1761436800, 1761440400])
+        self.assertEqual(list(a.kWh)[:2], [1.5, 0.5])
+        self.assertNotEqual(a.kWh[2], a.kWh[2])
+        self.assertEqual(list(b.starts), [1761436800])
+
+        data = billing.binary_block('c', 1761436800, 900, [0.25] * 8)
+        c, = billing.read_binary(io.BytesIO(data))
+        self.assertEqual((c.customer, len(c.starts), c.starts[4]), ('c', 8, 1761440400))
+        with self.assertRaises(billing.ConsumptionError):
+            billing.read_binary(io.BytesIO(data[:-1]))
+        with self.assertRaises(billing.ConsumptionError):
+            billing.read_csv(['HourUTC,kWh\n', 'x,1\n'])
+
+        tariffs = {'ValidFrom': '2025-01-01T00:00:00', 'ValidTo': None}
+        tariffs.update({f'Price{i}': 0.1 for i in range(1, 25)})
+        columns = app.compute_price_columns(
+            ['2025-10-26T02:00:00', '2025-10-26T02:00:00'], ['2025-10-26T00:00:00', '2025-10-26T01:00:00'],
+            [1000.0, 2000.0], app.TariffIndex([tariffs]), [2, 2])
+        bill, = billing.bills(columns, [c])
+        self.assertEqual(bill.kWh, 2.0)
+        self.assertEqual(bill.unpricedKWh, 0.0)
+        self.assertAlmostEqual(bill.costs['SpotPrice'], 1.0 + 2.0)
+        self.assertAlmostEqual(bill.costs['Total'], 4 * 0.25 * columns.Total[0] + 4 * 0.25 * columns.Total[1])
+        self.assertAlmostEqual(bill.cost[4], 0.25 * columns.Total[1])
+
+        self.assertEqual(billing.window_dates([a, b]), (datetime.date(2025, 10, 26), datetime.date(2025, 10, 27)))
+
+    def test_bill_route(self):
+        """Test that bills match the hourly prices of /elpris"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        body = 'customer,HourDK,kWh\n' + ''.join(f'x,2025-10-20T{h:02d}:00,{h}\n' for h in range(24))
+        try:
+            prices = self.app.get('/elpris?GLN_Number=5790000611003&start=2025-10-20&end=2025-10-21').json['records']
+            response = self.app.post('/elpris-regning?GLN_Number=5790000611003&hourly=true', data=body, content_type='text/csv')
+            binary = self.app.post('/elpris-regning?GLN_Number=5790000611003', content_type='application/octet-stream',
+                                   data=billing.binary_block('y', 1760911200, 3600, range(24)))
+            unsupported = self.app.post('/elpris-regning', data='{}', content_type='application/json')
+            before_fees = self.app.post('/elpris-regning?GLN_Number=5790000611003', data=body.replace('2025-', '2023-'), content_type='text/csv')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        result, = response.json['results']
+        self.assertEqual(result['kWh'], sum(range(24)))
+        self.assertAlmostEqual(result['Total'], sum(h * r['Total'] for h, r in enumerate(prices)))
+        self.assertEqual(result['hourly']['TimeUTC'], [r['HourUTC'] for r in prices])
+        self.assertAlmostEqual(result['hourly']['Total'][5], 5 * prices[5]['Total'])
+
+        self.assertEqual(binary.status_code, 200)
+        self.assertAlmostEqual(binary.json['results'][0]['Total'], result['Total'])
+        self.assertEqual(unsupported.status_code, 415)
+        # Before the fee schedule starts
+        self.assertEqual(before_fees.status_code, 400)
+        self.assertIn('No ElAfgift rate for 2023-10-20', before_fees.get_data(as_text=True))
+
+    def test_bill_route_dst(self):
+        """Test that all 25 hours of the day DST ends are priced, though the hourly prices merge hour 02"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        try:
+            prices = self.app.get('/elpris?GLN_Number=5790000611003&start=2025-10-26&end=2025-10-27').json['records']
+            response = self.app.post('/elpris-regning?GLN_Number=5790000611003&hourly=true', content_type='application/octet-stream',
+                                     data=billing.binary_block('x', 1761429600, 3600, [1.0] * 25))
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        result, = response.json['results']
+        self.assertEqual((result['kWh'], result['unpricedKWh']), (25.0, 0.0))
+        # Both UTC hours of hour 02 are priced with the merged slot
+        self.assertEqual(len(prices), 24)
+        self.assertAlmostEqual(result['hourly']['Total'][2], prices[2]['Total'])
+        self.assertAlmostEqual(result['hourly']['Total'][3], prices[2]['Total'])
+        self.assertAlmostEqual(result['Total'], sum(r['Total'] for r in prices) + prices[2]['Total'])
+
+    def test_metrics(self):
+        """Test that cache outcomes, upstream calls and stages are counted"""
+        app.cache.clear()
+        mount(SyntheticAdapter())
+        misses = app.metrics.cache_calls.get(function='get_dayahead_prices', outcome='miss')
+        upstream_calls = app.metrics.upstream_request_duration.count(upstream='DayAheadPrices')
+        try:
+            self.app.get('/elpris-detaljer?start=2025-10-01')
+            # The first request also reads the prices when aligning the CO2 emissions to them
+            hits = app.metrics.cache_calls.get(function='get_dayahead_prices', outcome='hit')
+            self.app.get('/elpris-detaljer?start=2025-10-01')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(app.metrics.cache_calls.get(function='get_dayahead_prices', outcome='miss'), misses + 1)
+        self.assertEqual(app.metrics.cache_calls.get(function='get_dayahead_prices', outcome='hit'), hits + 1)
+        self.assertEqual(app.metrics.upstream_request_duration.count(upstream='DayAheadPrices'), upstream_calls + 1)
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        self.assertIn('cache_calls_total{function="get_dayahead_prices",outcome="hit"}', response.text)
+        self.assertIn('span_duration_seconds_count{span="compute"}', response.text)
+        self.assertIn('http_request_duration_seconds_bucket{route="/elpris-detaljer",status="200",le="+Inf"}', response.text)
+
+    def test_prefetch(self):
+        """Test that prefetched entries are served without upstream requests"""
+        copenhagen = pytz.timezone('Europe/Copenhagen')
+        prefetcher = app.Prefetcher(app.cache, app.refresh_cached, app.prefetch_jobs)
+        self.assertEqual(prefetcher.cadence(copenhagen.localize(datetime.datetime(2025, 10, 20, 9, 0))), 5*60)
+        self.assertEqual(prefetcher.cadence(copenhagen.localize(datetime.datetime(2025, 10, 20, 12, 50))), 60)
+
+        # Requests for today use the open ended window, which is what gets prefetched
+        today = datetime.date.today()
+        app.cache.clear()
+        app._fallback_store.clear()
+        app._snapshots.clear()
+        mount(SyntheticAdapter(today))
+        try:
+            now = copenhagen.localize(datetime.datetime.combine(today, datetime.time(9, 0)))
+            self.assertGreater(prefetcher.run_once(now), 0)
+            # Another run within the lease is skipped
+            self.assertEqual(prefetcher.run_once(now), 0)
+
+            mount(FailingAdapter())
+            app._fallback_store.clear()
+            response = self.app.get('/elpris?start=' + today.isoformat())
+            detailed_response = self.app.get('/elpris-detaljer?start=' + today.isoformat())
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['records'][0]['HourDK'], today.isoformat() + 'T00:00:00')
+        self.assertEqual(detailed_response.status_code, 200)
+        self.assertEqual(detailed_response.json['records'][0]['TimeDK'], today.isoformat() + 'T00:00:00')
+
+    def test_coalesced_misses(self):
+        """Test that concurrent misses for the same key are computed once, also on a cold cache, and counted once"""
+        app.cache.clear()
+        calls = []
+        release = threading.Event()
+        waiters = threading.Semaphore(0)
+        join = app.coalesce._join
+
+        def counting_join(key):
+            future, leader = join(key)
+            if not leader:
+                waiters.release()
+            return future, leader
+
+        @app.fallback_to_cache
+        @app.coalesce.memoize(app.cache, timeout=60)
+        def coalesced_fetch(key):
+            calls.append(key)
+            app.metrics.record_upstream_request()
+            # Computes until the other calls wait for it
+            release.wait(5)
+            return {'records': [key, len(calls)]}
+
+        def count(outcome):
+            return app.metrics.cache_calls.get(function='coalesced_fetch', outcome=outcome)
+        misses, hits = count('miss'), count('hit')
+        waiting = app.metrics.coalesced_calls.get(function='coalesced_fetch', outcome='waiter')
+
+        with patch.object(app.coalesce, '_join', counting_join):
+            fetches = app.fetch_concurrently(**{'call%d' % i: (coalesced_fetch, 'a') for i in range(4)})
+            joined = [waiters.acquire(timeout=5) for _ in range(3)]
+            release.set()
+            results = [f.result() for f in fetches.values()]
+
+        self.assertEqual(joined, [True] * 3)
+        self.assertEqual(results, [{'records': ['a', 1]}] * 4)
+        self.assertEqual(calls, ['a'])
+        # The waiters are not cache hits
+        self.assertEqual((count('miss'), count('hit')), (misses + 1, hits))
+        self.assertEqual(app.metrics.coalesced_calls.get(function='coalesced_fetch', outcome='waiter'), waiting + 3)
+
+        self.assertEqual(coalesced_fetch('a'), {'records': ['a', 1]})
+        self.assertEqual(calls, ['a'])
+        self.assertEqual(count('hit'), hits + 1)
+
+    def test_stale_while_revalidate(self):
+        """Test that a stale entry is served while it is refreshed in the background"""
+        calls = []
+        refreshed = threading.Event()
+
+        @app.coalesce.memoize(app.cache, timeout=1, stale_timeout=60)
+        def fetch(key):
+            calls.append(key)
+            if len(calls) > 1:
+                refreshed.set()
+            return {'records': [key, len(calls)]}
+
+        self.assertEqual(fetch('b'), {'records': ['b', 1]})
+        app.time.sleep(1.1)
+        self.assertEqual(fetch('b'), {'records': ['b', 1]})
+        self.assertTrue(refreshed.wait(5))
+        # Give the refresh time to store its result
+        app.time.sleep(0.1)
+        self.assertEqual(fetch('b'), {'records': ['b', 2]})
+
+    def test_asgi_mode(self):
+        """Test that the ASGI mode fetches upstream asynchronously and responds like the WSGI app"""
+        app.cache.clear()
+        app._fallback_store.clear()
+        mount(SyntheticAdapter())
+        try:
+            expected = self.app.get('/elpris?start=2025-10-01').json
+            app.cache.clear()
+            app._fallback_store.clear()
+
+            # Only the async client reaches upstream, so the route must use the prefetched data
+            mount(FailingAdapter())
+            app.upstream.mount_async(async_transport(SyntheticAdapter()))
+
+            async def get_concurrently():
+                transport = httpx.ASGITransport(app=asgi.application)
+                async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+                    responses = await asyncio.gather(*(client.get('/elpris?start=2025-10-01') for _ in range(3)))
+                await app.upstream.aclose_clients()
+                return responses
+
+            responses = asyncio.run(get_concurrently())
+        finally:
+            app.upstream.close_sessions()
+            app.upstream.mount_async(None)
+            app.cache.clear()
+
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected)
+
+    def test_snapshots(self):
+        """Test that today's prices of a known grid company are served from a snapshot"""
+        today = datetime.date.today()
+        url = '/elpris?GLN_Number=5790001089375&start=' + today.isoformat()
+        app.cache.clear()
+        app._snapshots.clear()
+        mount(SyntheticAdapter(today))
+        try:
+            first = self.app.get(url)
+
+            # Served from the snapshot, without upstream data
+            mount(FailingAdapter())
+            app.cache.clear()
+            app._fallback_store.clear()
+            second = self.app.get(url)
+            not_modified = self.app.get(url, headers={'If-None-Match': first.headers['ETag']})
+
+            # Rebuilding unchanged content keeps the validators
+            mount(SyntheticAdapter(today))
+            app.rebuild_snapshots(60)
+            rebuilt = self.app.get(url)
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+            app._snapshots.clear()
+
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first.headers)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(rebuilt.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(rebuilt.headers['Last-Modified'], first.headers['Last-Modified'])
+
+    def test_http_caching(self):
+        """Test Cache-Control by window, and conditional requests with the ETag"""
+        today = datetime.date.today()
+        mount(SyntheticAdapter(today))
+        try:
+            historic = self.app.get('/elpris?GLN_Number=5790001089375&start=2025-10-01&end=2025-10-03')
+            historic_again = self.app.get('/elpris?GLN_Number=5790001089375&start=2025-10-01&end=2025-10-03',
+                                          headers={'If-None-Match': historic.headers['ETag']})
+            current = self.app.get('/elpris?GLN_Number=5790001089375&start=' + today.isoformat() + '&PriceArea=DK1')
+            streamed = self.app.get('/elpris?GLN_Number=5790001089375&start=2025-10-01&end=2025-10-03&format=ndjson')
+        finally:
+            app.upstream.close_sessions()
+            app.cache.clear()
+        gridcompanies = self.app.get('/gridcompanies')
+        gridcompanies_again = self.app.get('/gridcompanies', headers={'If-None-Match': gridcompanies.headers['ETag']})
+
+        self.assertEqual(historic.status_code, 200)
+        self.assertIn('immutable', historic.headers['Cache-Control'])
+        self.assertIn('max-age=86400', historic.headers['Cache-Control'])
+        self.assertIn('Accept', historic.headers['Vary'])
+        self.assertEqual(historic_again.status_code, 304)
+        self.assertEqual(historic_again.data, b'')
+
+        self.assertEqual(current.status_code, 200)
+        self.assertIn('max-age=60', current.headers['Cache-Control'])
+        self.assertNotIn('immutable', current.headers['Cache-Control'])
+
+        self.assertEqual(streamed.status_code, 200)
+        self.assertNotIn('ETag', streamed.headers)
+        self.assertIn('max-age=86400', streamed.headers['Cache-Control'])
+
+        self.assertEqual(gridcompanies_again.status_code, 304)
+        self.assertIn('max-age=3600', gridcompanies_again.headers['Cache-Control'])
+
     def test_mainroute_noparams(self):
         response = self.app.get('/elpris')
 
@@ -297,6 +1184,24 @@ class TestApp(unittest.TestCase):
         self.assertTrue(response.json[0]['priceArea'])
         self.assertTrue(response.json[0]['gridCompanyNumber'])
 
+    def test_gridcompany_registry(self):
+        """Test the registry indexes, unknown GLN_Numbers and refreshed tariff codes"""
+        registry = app.registry
+        self.assertEqual(registry.by_gln('5790000705689').gridCompanyNumber, '790')
+        self.assertEqual(registry.by_number('791').name, 'Radius Elnet A/S')
+        self.assertTrue(all(c.priceArea == 'DK2' for c in registry.by_price_area('DK2')))
+        self.assertEqual(self.app.get('/elpris?GLN_Number=123').status_code, 400)
+
+        records = [
+            {'GLN_Number': '5790000611003', 'ChargeTypeCode': 'T-C-F-T-TD', 'ValidFrom': '2025-01-01T00:00:00', 'ValidTo': None},
+            {'GLN_Number': '5790001089375', 'ChargeTypeCode': '43110', 'ValidFrom': '2024-01-01T00:00:00', 'ValidTo': '2025-01-01T00:00:00'},
+            {'GLN_Number': '5790001089375', 'ChargeTypeCode': '43111', 'ValidFrom': '2025-01-01T00:00:00', 'ValidTo': None},
+        ]
+        refreshed = registry.with_current_tariffs(app.current_tariff_codes(records, datetime.datetime(2025, 6, 1)))
+        self.assertEqual(refreshed.by_gln('5790000611003').chargeTypeCode, 'T-C-F-T-TD')
+        self.assertEqual(refreshed.by_gln('5790001089375').chargeTypeCode, '43111')
+        self.assertNotEqual(refreshed.etag, registry.etag)
+
 
 if __name__ == '__main__':
     unittest.main()
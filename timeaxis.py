@@ -0,0 +1,185 @@
+"""
+Conversion of Danish local timestamps for whole time series.
+
+The upstream datasets label records with ISO timestamps in Danish local time (HourDK, TimeDK,
+Minutes5DK). Instead of parsing and localizing each of them with datetime and pytz, they are
+converted to integer seconds, and to UTC with a precomputed table of the Europe/Copenhagen DST
+transitions. Like pytz.localize(), local times that are ambiguous (the repeated hour 02 of the
+25 hour day in October) or that do not exist (hour 02 of the 23 hour day in March) are taken
+as standard time.
+"""
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+from operator import lt
+from typing import Iterable, List, Sequence
+
+import pytz
+
+COPENHAGEN_TIMEZONE = pytz.timezone('Europe/Copenhagen')
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_fromisoformat = datetime.fromisoformat
+
+STANDARD_OFFSET = 60*60
+DST_OFFSET = 2*60*60
+
+# Years covered by the transition table. Denmark has followed the EU rules since 1996: summer
+# time from 02:00 standard time on the last Sunday of March to 03:00 summer time on the last
+# Sunday of October, both at 01:00 UTC.
+FIRST_YEAR = 1996
+LAST_YEAR = 2099
+
+
+def _last_sunday(year, month):
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - 6) % 7)
+
+
+def _build_transitions():
+    """Returns (local seconds from which an offset applies, offsets), sorted."""
+    transitions, offsets = [], []
+    for year in range(FIRST_YEAR, LAST_YEAR + 1):
+        spring = (_last_sunday(year, 3).toordinal() - _EPOCH_ORDINAL) * 86400
+        fall = (_last_sunday(year, 10).toordinal() - _EPOCH_ORDINAL) * 86400
+        # The skipped hour 02 is standard time, summer time starts at 03:00 local
+        transitions += [spring + 3*60*60, fall + 2*60*60]
+        offsets += [DST_OFFSET, STANDARD_OFFSET]
+    return transitions, offsets
+
+
+_TRANSITIONS, _OFFSETS = _build_transitions()
+_UTC_TRANSITIONS = [t - o for t, o in zip(_TRANSITIONS, _OFFSETS)]
+_TABLE_START = (date(FIRST_YEAR, 1, 1).toordinal() - _EPOCH_ORDINAL) * 86400
+_TABLE_END = (date(LAST_YEAR + 1, 1, 1).toordinal() - _EPOCH_ORDINAL) * 86400
+
+
+@lru_cache(maxsize=4096)
+def _day_string(days: int) -> str:
+    return date.fromordinal(_EPOCH_ORDINAL + days).isoformat()
+
+
+def local_seconds(ts: str) -> int:
+    """
+    Returns the local time of an ISO timestamp (YYYY-MM-DD[THH[:MM[:SS]]]) as seconds since
+    1970-01-01T00:00 local time, without applying any UTC offset.
+    """
+    dt = _fromisoformat(ts)
+    return (dt.toordinal() - _EPOCH_ORDINAL) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def local_seconds_series(timestamps: Iterable[str]) -> List[int]:
+    """Like local_seconds(), for a series of timestamps, without a function call per timestamp."""
+    seconds = []
+    append = seconds.append
+    for ts in timestamps:
+        dt = _fromisoformat(ts)
+        append((dt.toordinal() - _EPOCH_ORDINAL) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second)
+    return seconds
+
+
+def grid_seconds(timestamps: Sequence[str], step: int) -> List[int]:
+    """
+    Like local_seconds_series(), for ascending timestamps on a grid of step seconds, e.g. the
+    5 minute marks of Minutes5UTC. A series without gaps, the usual case, is computed from its
+    first and last timestamp instead of parsing each of them. The timestamps must all be in the
+    same format, so that they compare in chronological order as strings.
+    """
+    n = len(timestamps)
+    if n > 1:
+        first, last = local_seconds(timestamps[0]), local_seconds(timestamps[-1])
+        # n distinct marks on the grid from first to last are all of its marks
+        if last - first == step * (n - 1) and all(map(lt, timestamps, islice(timestamps, 1, None))):
+            return list(range(first, last + 1, step))
+    return local_seconds_series(timestamps)
+
+
+def utc_offset(local: int) -> int:
+    """Returns the UTC offset in seconds of Danish local time, given as local seconds."""
+    if not _TABLE_START <= local < _TABLE_END:
+        dt = datetime(1970, 1, 1) + timedelta(seconds=local)
+        return int(COPENHAGEN_TIMEZONE.utcoffset(dt, is_dst=False).total_seconds())
+    i = bisect_right(_TRANSITIONS, local)
+    return _OFFSETS[i - 1] if i else STANDARD_OFFSET
+
+
+def utc_to_local(utc: int) -> int:
+    """Returns seconds since 1970-01-01T00:00 UTC as Danish local seconds."""
+    if not _TABLE_START <= utc < _TABLE_END:
+        dt = datetime.fromtimestamp(utc, pytz.utc).astimezone(COPENHAGEN_TIMEZONE)
+        return utc + int(dt.utcoffset().total_seconds())
+    i = bisect_right(_UTC_TRANSITIONS, utc)
+    return utc + (_OFFSETS[i - 1] if i else STANDARD_OFFSET)
+
+
+def utc_seconds(timestamps: Iterable[str]) -> List[int]:
+    """
+    Converts a chronological series of ISO timestamps in Danish local time to seconds since
+    1970-01-01T00:00 UTC. Unlike copenhagen_to_utc(), the repeated hour 02 of the 25 hour day
+    is told apart by order: it is summer time until the series goes back (or repeats) in local
+    time.
+    """
+    return local_to_utc(local_seconds_series(timestamps))
+
+
+def local_to_utc(seconds: Iterable[int]) -> List[int]:
+    """Like utc_seconds(), for a chronological series of local seconds."""
+    utc = []
+    previous = None
+    folded = False
+    # The local seconds [lo, hi) between DST transitions, without the repeated hour, that the
+    # last looked up local time is in. Consecutive times in it share the offset.
+    lo = hi = 0
+    offset = STANDARD_OFFSET
+    for local in seconds:
+        if lo <= local < hi:
+            utc.append(local - offset)
+            previous = local
+            continue
+
+        if not _TABLE_START <= local < _TABLE_END:
+            offset = utc_offset(local)
+            lo = hi = 0
+            folded = False
+        else:
+            i = bisect_right(_TRANSITIONS, local)
+            offset = _OFFSETS[i - 1] if i else STANDARD_OFFSET
+            lo = _TRANSITIONS[i - 1] if i else _TABLE_START
+            hi = _TRANSITIONS[i] if i < len(_TRANSITIONS) else _TABLE_END
+            if i and offset == STANDARD_OFFSET and local - lo < 60*60:
+                # The repeated hour 02 of the 25 hour day, summer time until the series goes back
+                folded = folded or (previous is not None and local <= previous)
+                if not folded:
+                    offset = DST_OFFSET
+                lo = hi = 0
+            else:
+                folded = False
+                if i and offset == STANDARD_OFFSET:
+                    lo += 60*60
+        utc.append(local - offset)
+        previous = local
+    return utc
+
+
+def format_seconds(seconds: int) -> str:
+    """Formats seconds since 1970-01-01T00:00 as YYYY-MM-DDTHH:MM:SS."""
+    days, rest = divmod(seconds, 86400)
+    hour, rest = divmod(rest, 3600)
+    minute, second = divmod(rest, 60)
+    return f'{_day_string(days)}T{hour:02d}:{minute:02d}:{second:02d}'
+
+
+def local_now() -> str:
+    """Returns the current Danish local time as YYYY-MM-DDTHH:MM:SS."""
+    return datetime.now(COPENHAGEN_TIMEZONE).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def copenhagen_to_utc(timestamps: Iterable[str]) -> List[str]:
+    """Converts ISO timestamps in Danish local time to UTC, formatted as YYYY-MM-DDTHH:MM:SS."""
+    utc = []
+    for ts in timestamps:
+        local = local_seconds(ts)
+        utc.append(format_seconds(local - utc_offset(local)))
+    return utc
@@ -0,0 +1,201 @@
+"""
+Local persistent store of published energidataservice time series.
+
+Day-ahead prices and CO2 emissions never change once a day has passed, so completed days are
+kept in an SQLite database, one row of records per (dataset, price area, Danish date). Requests
+for historic windows are then served locally, and only the open tail (today and tomorrow) is
+fetched from upstream. A background sync job keeps the recent history filled in incrementally.
+
+A day is only stored once upstream returned all of it, so days published partly are fetched
+again, unless they are older than the settle delay, after which a gap is taken to be permanent.
+"""
+from datetime import date, datetime, timedelta
+import fcntl
+import json
+import threading
+import time
+from typing import Callable, List, Optional
+
+import timeaxis
+from sqlitestore import SQLiteStore
+
+
+def today_copenhagen() -> date:
+    return datetime.now(timeaxis.COPENHAGEN_TIMEZONE).date()
+
+
+def _as_date(d) -> date:
+    return d.date() if isinstance(d, datetime) else d
+
+
+def is_complete_day(day: str, records: List[dict], time_key: str) -> bool:
+    """
+    True if the records of a Danish day cover all of it: one record per slot from midnight to
+    midnight, with slots as long as the records are spaced (5 minutes, 15 minutes or an hour).
+    Uses the UTC column next to the Danish time_key (e.g. TimeUTC for TimeDK).
+    """
+    utc_key = time_key[:-len('DK')] + 'UTC'
+    starts = sorted({timeaxis.local_seconds(r[utc_key]) for r in records})
+    if len(starts) < 2:
+        return False
+    interval = min(b - a for a, b in zip(starts, starts[1:]))
+    next_day = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+    day_start, day_end = timeaxis.utc_seconds([day, next_day])
+    return (starts[0] == day_start and starts[-1] == day_end - interval
+            and len(starts) == (day_end - day_start) // interval)
+
+
+class TimeSeriesStore(SQLiteStore):
+    """
+    SQLite-backed store of upstream records per (dataset, price area, day).
+
+    Safe to use from several threads and worker processes, see SQLiteStore. Incomplete days are
+    stored once they are settle_days old.
+    """
+
+    def __init__(self, path: str, settle_days: int = 7):
+        self.settle_days = settle_days
+        super().__init__(path, """
+            CREATE TABLE IF NOT EXISTS days (
+                dataset TEXT NOT NULL,
+                price_area TEXT NOT NULL,
+                day TEXT NOT NULL,
+                records TEXT NOT NULL,
+                PRIMARY KEY (dataset, price_area, day)
+            ) WITHOUT ROWID
+        """)
+
+    def get_days(self, dataset: str, priceArea: str, start: date, end: date) -> Optional[List[dict]]:
+        """
+        Returns the stored records for the days in [start, end), in order, or None unless
+        every day in the window is stored.
+        """
+        rows = self._connection().execute(
+            'SELECT records FROM days WHERE dataset = ? AND price_area = ? AND day >= ? AND day < ? ORDER BY day',
+            (dataset, priceArea, start.isoformat(), end.isoformat()),
+        ).fetchall()
+        if len(rows) != (end - start).days:
+            return None
+
+        records = []
+        for (day_records,) in rows:
+            records += json.loads(day_records)
+        return records
+
+    def missing_days(self, dataset: str, priceArea: str, start: date, end: date) -> List[date]:
+        """Returns the days in [start, end) that are not stored."""
+        stored = {row[0] for row in self._connection().execute(
+            'SELECT day FROM days WHERE dataset = ? AND price_area = ? AND day >= ? AND day < ?',
+            (dataset, priceArea, start.isoformat(), end.isoformat()),
+        )}
+        days = (start + timedelta(days=i) for i in range((end - start).days))
+        return [d for d in days if d.isoformat() not in stored]
+
+    def put_records(self, dataset: str, priceArea: str, records: List[dict], time_key: str, before: date):
+        """
+        Stores the records of every day before the given date, grouped by the Danish date in the
+        time_key column. Days without records, and days with only part of their records (see
+        is_complete_day) unless settle_days before the given date, are not stored, so they will
+        be fetched again.
+        """
+        settled = (before - timedelta(days=self.settle_days)).isoformat()
+        before = before.isoformat()
+        per_day = {}
+        for r in records:
+            day = r[time_key][:len('YYYY-MM-DD')]
+            if day < before:
+                per_day.setdefault(day, []).append(r)
+        per_day = {day: rs for day, rs in per_day.items() if day < settled or is_complete_day(day, rs, time_key)}
+        if not per_day:
+            return
+
+        with self._connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO days (dataset, price_area, day, records) VALUES (?, ?, ?, ?)',
+                [(dataset, priceArea, day, json.dumps(rs, separators=(',', ':'))) for day, rs in per_day.items()],
+            )
+
+    def read_through(self, dataset: str, time_key: str, fetch: Callable, start, priceArea: str, end=None):
+        """
+        Returns the upstream response for [start, end) like fetch(start, priceArea, end) would,
+        serving completed days from the store and only fetching the rest from upstream.
+        """
+        stored, fetch_start, store_before = self.plan_read(dataset, start, priceArea, end)
+        if fetch_start is None:
+            return {'records': stored}
+        response = fetch(fetch_start, priceArea, end)
+        return self.complete_read(dataset, time_key, priceArea, stored, response, store_before)
+
+    def plan_read(self, dataset: str, start, priceArea: str, end=None):
+        """
+        First half of read_through, for callers that fetch by other means, e.g. asynchronously.
+
+        Returns (stored records, fetch start, store before): the records served from the store,
+        if any, where to fetch the rest from (None if nothing is to be fetched) and the date
+        before which fetched records are to be stored, if any. Pass the fetched response to
+        complete_read().
+        """
+        today = today_copenhagen()
+        startDate = _as_date(start)
+        historic_end = min(_as_date(end), today) if end else today
+        if startDate >= historic_end:
+            return None, start, None
+
+        stored = self.get_days(dataset, priceArea, startDate, historic_end)
+        if stored is None:
+            return None, start, historic_end
+
+        if end and _as_date(end) <= today:
+            return stored, None, None
+        return stored, today, None
+
+    def complete_read(self, dataset: str, time_key: str, priceArea: str, stored, response, store_before):
+        """Second half of read_through, see plan_read."""
+        if store_before:
+            self.put_records(dataset, priceArea, response['records'], time_key, store_before)
+        if stored is None:
+            return response
+        return {'records': stored + response['records']}
+
+    def sync(self, dataset: str, time_key: str, fetch: Callable, priceArea: str, days: int):
+        """Fetches and stores the days missing among the last `days` completed days."""
+        today = today_copenhagen()
+        missing = self.missing_days(dataset, priceArea, today - timedelta(days=days), today)
+        if not missing:
+            return
+
+        # Fetch the whole span of missing days at once, as most of the time it is just yesterday
+        response = fetch(missing[0], priceArea, missing[-1] + timedelta(days=1))
+        self.put_records(dataset, priceArea, response['records'], time_key, today)
+
+
+def start_sync_thread(store: TimeSeriesStore, datasets, priceAreas, days: int, interval: int):
+    """
+    Starts a daemon thread that runs store.sync() for every dataset and price area each interval
+    seconds. `datasets` maps dataset names to (fetch function, time_key). Only one worker process
+    syncs at a time, coordinated by a lock file next to the database.
+    """
+    def sync_all():
+        for dataset, (fetch, time_key) in datasets.items():
+            for priceArea in priceAreas:
+                try:
+                    store.sync(dataset, time_key, fetch, priceArea, days)
+                except Exception as e:
+                    print(f"Warning: sync of {dataset} for {priceArea} failed. Error: {e}")
+
+    def run():
+        while True:
+            with open(store.path + '.sync-lock', 'w') as lockfile:
+                try:
+                    fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                except OSError:
+                    # Another worker is syncing
+                    locked = False
+                if locked:
+                    sync_all()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='timeseries-sync', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,215 @@
+"""
+Pooled HTTP client for the upstream APIs (energidataservice.dk and greenpowerdenmark.dk).
+
+Each worker process keeps one requests.Session per upstream host, so TLS connections are
+kept alive and reused between calls instead of being set up for every request. Sessions
+retry idempotent requests with exponential backoff. Timeouts are given per call, by the
+upstream source (see UPSTREAM_TIMEOUTS in app.py), with DEFAULT_TIMEOUT as a fallback.
+
+aget() is the asyncio counterpart for the ASGI serving mode, with one pooled httpx.AsyncClient
+per host and event loop and the same timeouts and retry policy. httpx is only needed for it.
+"""
+import asyncio
+import os
+import ssl
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+_ENERGIDATASERVICE_PEM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'energidataservice.pem')
+
+# Per-host settings: certificate bundle to verify against
+HOSTS = {
+    'api.energidataservice.dk': {'verify': _ENERGIDATASERVICE_PEM},
+    'api.elnet.greenpowerdenmark.dk': {},
+}
+# Timeout in seconds of calls that do not give one
+DEFAULT_TIMEOUT = 10
+
+POOL_SIZE = 10
+RETRIES = 2
+BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sessions_pid = os.getpid()
+
+# Async clients per event loop, and the transport they use if not the default, see mount_async
+_async_clients = weakref.WeakKeyDictionary()
+_async_transport = None
+
+
+def configure(pool_size=None, retries=None, backoff_factor=None):
+    """
+    Updates the pool size and retry policy.
+
+    Existing sessions are closed, so new settings apply to all subsequent requests.
+
+    Args:
+        pool_size: Maximum number of kept-alive connections per host.
+        retries: Number of retries for failed connections and retryable HTTP statuses.
+        backoff_factor: Backoff factor between retries, see urllib3's Retry.
+    """
+    global POOL_SIZE, RETRIES, BACKOFF_FACTOR
+
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if retries is not None:
+        RETRIES = retries
+    if backoff_factor is not None:
+        BACKOFF_FACTOR = backoff_factor
+
+    close_sessions()
+    _async_clients.clear()
+
+
+def _new_session(host):
+    session = requests.Session()
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=('GET',),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    verify = HOSTS.get(host, {}).get('verify')
+    if verify:
+        session.verify = verify
+    return session
+
+
+def session_for(host):
+    """Returns the shared session for the given host, creating it on first use."""
+    global _sessions_pid
+
+    with _sessions_lock:
+        # Connections must not be shared with a parent process, e.g. after a gunicorn fork
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session(host)
+        return session
+
+
+def close_sessions():
+    """Closes all pooled sessions. They are recreated on the next request."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get(url, params=None, timeout=None, name=None, **kwargs):
+    """
+    Performs a GET request through the pooled session for the host of the URL.
+
+    Args:
+        url: The URL to fetch.
+        params: Query parameters.
+        timeout: Timeout in seconds, defaults to DEFAULT_TIMEOUT.
+        name: Name of the upstream endpoint in metrics, defaults to the host. Must not contain
+            request specific parts of the URL, to keep the number of metric labels bounded.
+
+    Returns:
+        The requests.Response. Callers are expected to call raise_for_status().
+    """
+    host = urlsplit(url).hostname
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    name = name or host
+
+    metrics.record_upstream_request()
+    t0 = time.perf_counter()
+    status = 'error'
+    try:
+        response = session_for(host).get(url, params=params, timeout=timeout, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.upstream_request_duration.observe(time.perf_counter() - t0, upstream=name)
+        metrics.upstream_requests.inc(upstream=name, status=status)
+
+
+def _new_async_client(host):
+    import httpx
+
+    verify = HOSTS.get(host, {}).get('verify')
+    limits = httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE)
+    if _async_transport is not None:
+        return httpx.AsyncClient(transport=_async_transport, limits=limits)
+    # Connection failures are retried by the transport, retryable statuses by aget()
+    transport = httpx.AsyncHTTPTransport(
+        verify=ssl.create_default_context(cafile=verify) if verify else True,
+        limits=limits,
+        retries=RETRIES,
+    )
+    return httpx.AsyncClient(transport=transport)
+
+
+def async_client_for(host):
+    """Returns the shared httpx.AsyncClient for the given host in the running event loop."""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(host)
+    if client is None:
+        client = clients[host] = _new_async_client(host)
+    return client
+
+
+def mount_async(transport):
+    """Makes async clients use the given httpx transport, e.g. to replay recorded responses."""
+    global _async_transport
+    _async_transport = transport
+    _async_clients.clear()
+
+
+async def aclose_clients():
+    """Closes the async clients of the running event loop."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+async def aget(url, params=None, timeout=None, name=None, **kwargs):
+    """
+    Performs a GET request through the pooled async client for the host of the URL.
+
+    Takes the same arguments as get(). Retryable statuses are retried with exponential backoff.
+
+    Returns:
+        The httpx.Response. Callers are expected to call raise_for_status().
+    """
+    host = urlsplit(url).hostname
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    name = name or host
+    client = async_client_for(host)
+
+    metrics.record_upstream_request()
+    t0 = time.perf_counter()
+    status = 'error'
+    try:
+        for attempt in range(RETRIES + 1):
+            response = await client.get(url, params=params, timeout=timeout, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                break
+            await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.upstream_request_duration.observe(time.perf_counter() - t0, upstream=name)
+        metrics.upstream_requests.inc(upstream=name, status=status)